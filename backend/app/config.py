@@ -17,6 +17,110 @@ class Settings(BaseSettings):
     
     # OpenAI settings
     OPENAI_API_KEY: Optional[str] = os.getenv("OPENAI_API_KEY")
+    OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+    
+    # OpenAI HTTP client settings (shared, pooled client)
+    OPENAI_HTTP2: bool = True
+    OPENAI_MAX_CONNECTIONS: int = 50
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY: float = 30.0  # seconds
+    OPENAI_CONNECT_TIMEOUT: float = 5.0  # seconds
+    OPENAI_READ_TIMEOUT: float = 60.0  # seconds
+    OPENAI_POOL_TIMEOUT: float = 10.0  # seconds
+    
+    # Maximum concurrent GPT calls per worker; extra calls queue fairly per user
+    GPT_MAX_CONCURRENCY: int = 16
+    
+    # Retries for timeouts, connection errors and 429/5xx responses
+    GPT_MAX_RETRIES: int = 2
+    GPT_RETRY_BACKOFF_SECONDS: float = 1.0  # doubled after each retry
+    
+    # Circuit breaker: fail fast with 503 while the upstream error rate is high
+    GPT_BREAKER_FAILURE_RATE: float = 0.5
+    GPT_BREAKER_MIN_CALLS: int = 10  # outcomes needed in the window before tripping
+    GPT_BREAKER_WINDOW_SECONDS: float = 30.0
+    GPT_BREAKER_OPEN_SECONDS: float = 30.0
+    
+    # Hedged requests: fire a second attempt if the first is slower than the delay.
+    # The hedge takes its own GPT_MAX_CONCURRENCY slot and is skipped when none is free.
+    GPT_HEDGE_ENABLED: bool = False
+    GPT_HEDGE_DELAY_SECONDS: float = 0.0  # 0 uses the observed p95 latency per model
+    GPT_HEDGE_MIN_SAMPLES: int = 20  # latency samples needed before the p95 is used
+    
+    # Ask models that support it for JSON-mode replies (response_format=json_object)
+    GPT_JSON_MODE: bool = True
+    
+    # Meal details prompt: input token budget and how many recent turns are kept verbatim
+    GPT_DETAILS_INPUT_TOKEN_BUDGET: int = 6000
+    GPT_DETAILS_RECENT_TURNS: int = 6
+    
+    # GPT request/response body logging (bodies are logged at DEBUG)
+    GPT_LOG_LEVEL: str = "INFO"
+    GPT_LOG_SAMPLE_RATE: float = 0.1  # fraction of bodies logged when DEBUG is on
+    GPT_LOG_MAX_CHARS: int = 4000  # per logged body
+    GPT_LOG_MAX_FIELD_CHARS: int = 500  # per string field inside a body
+    
+    # Nutritional needs: targets are computed locally; GPT optionally writes the recommendations
+    NUTRITION_GPT_RECOMMENDATIONS: bool = True
+    NUTRITION_TARGETS_CACHE_SIZE: int = 1024  # in-process entries per cache
+    PROFILE_JOB_WORKERS: int = 2  # background workers recomputing nutrition after profile saves
+
+    # Meal photo vision analysis cache
+    VISION_CACHE_MAX_ENTRIES: int = 512
+    VISION_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # 7 days
+    
+    # Meal details cache: exact signature match first, then the most similar entry
+    DETAILS_CACHE_ENABLED: bool = True
+    DETAILS_CACHE_MAX_ENTRIES: int = 2048
+    DETAILS_CACHE_TTL_SECONDS: int = 14 * 24 * 3600  # 14 days
+    DETAILS_CACHE_SIMILARITY: float = 0.9  # minimum token similarity for a near match
+    DETAILS_CACHE_CANDIDATES: int = 50  # stored near-match candidates compared per lookup
+    
+    # Image preparation for the vision model
+    VISION_MAX_EDGE: int = 1024  # pixels, longest edge
+    VISION_JPEG_QUALITY: int = 80
+    VISION_DETAIL: str = "auto"  # "auto" picks low/high from the prepared size
+    
+    # Stored meal photos (compress_image)
+    IMAGE_STORE_MAX_EDGE: int = 2048  # pixels, longest edge
+    IMAGE_STORE_MIN_QUALITY: int = 40
+    IMAGE_STORE_MAX_QUALITY: int = 85
+    
+    # Meal photo bytes: "gridfs" (a bucket in the app database) or "local"
+    # (content-addressed files under BLOB_STORE_LOCAL_DIR)
+    BLOB_STORE: str = "gridfs"
+    BLOB_STORE_LOCAL_DIR: str = "blob_store"
+    BLOB_CHUNK_SIZE: int = 255 * 1024  # bytes per GridFS chunk / streamed read
+    
+    # Signed meal photo URLs (HMAC over image id and expiry); defaults to SECRET_KEY
+    IMAGE_URL_SECRET: str = os.getenv("IMAGE_URL_SECRET", "")
+    IMAGE_URL_TTL_SECONDS: int = 3600  # URLs stay valid for one to two windows
+    
+    # Near-duplicate uploads: a photo whose dHash is within IMAGE_DEDUP_MAX_DISTANCE
+    # bits of one the same user uploaded recently reuses that image document
+    IMAGE_DEDUP_ENABLED: bool = True
+    IMAGE_DEDUP_WINDOW_HOURS: int = 24
+    IMAGE_DEDUP_MAX_DISTANCE: int = 4  # bits out of 64; capped at 7 by the band index
+    IMAGE_DEDUP_REUSE_ANALYSIS: bool = True  # answer from the matched photo's cached analysis
+    
+    # Image processing pool: PIL decode/resize/encode runs off the event loop
+    IMAGE_POOL_KIND: str = "thread"  # "thread" (PIL releases the GIL) or "process"
+    IMAGE_POOL_WORKERS: int = 2
+    IMAGE_POOL_MAX_QUEUE: int = 16  # waiting tasks before uploads are rejected with a 503
+    IMAGE_POOL_TIMEOUT_SECONDS: float = 20.0
+    
+    # Tiered vision routing: try the fast model first, escalate to the full
+    # model when its confidence is low or its ingredient list is unusable.
+    # gpt-4o-mini bills images at many times the tokens, so it is not cheaper here.
+    VISION_ROUTING_ENABLED: bool = True
+    VISION_FAST_MODEL: str = "gpt-4o"
+    VISION_FAST_MAX_TOKENS: int = 1500
+    VISION_MAX_TOKENS: int = 4096
+    VISION_ESCALATE_CONFIDENCE: str = "low"  # escalate at or below this confidence_level
+    VISION_MAX_INGREDIENTS: int = 25
+    
+    # /api/metrics is disabled unless set; scrapers send it as a bearer token
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
     
     # CORS settings
     CORS_ORIGINS: list = ["http://localhost:3000", "http://127.0.0.1:3000"]
@@ -1,8 +1,14 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from app.routes import auth, profile, chatbot, nutrition, saved_items, recipes, shopping_list, chat, supplements
+from app.routes import auth, profile, chatbot, nutrition, saved_items, recipes, shopping_list, chat, supplements, metrics
 from app.database import DatabaseManager
+from app.utils.openai_client import openai_client
+from app.utils.image_pool import image_pool
+from app.utils.resilience import CircuitOpenError
+from app.services.profile_jobs import profile_jobs
+from app.routes.database import get_database
 import logging
 import os
 
@@ -43,6 +49,16 @@ app.include_router(recipes.router, prefix="/api/recipes", tags=["recipes"])
 app.include_router(shopping_list.router, prefix="/api/shopping-list", tags=["shopping-list"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(supplements.router, prefix="/api/supplements", tags=["supplements"])
+app.include_router(metrics.router, prefix="/api/metrics", tags=["metrics"])
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    # Upstream is failing; tell clients to back off instead of waiting on timeouts
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after) + 1)}
+    )
 
 # Create a database manager instance
 db_manager = DatabaseManager()
@@ -56,6 +72,30 @@ async def startup_db_client():
         logger.error(f"Failed to connect to MongoDB: {str(e)}")
         raise e
 
+@app.on_event("startup")
+async def startup_openai_client():
+    await openai_client.connect()
+    logger.info("OpenAI HTTP client started")
+
+@app.on_event("startup")
+async def startup_profile_jobs():
+    profile_jobs.start()
+    try:
+        await profile_jobs.recover(await get_database())
+    except Exception as e:
+        logger.error(f"Failed to re-queue pending profile jobs: {str(e)}")
+
+@app.on_event("shutdown")
+async def shutdown_profile_jobs():
+    # Stop before the database and OpenAI clients close under running jobs
+    await profile_jobs.stop()
+    logger.info("Profile job workers stopped")
+
+@app.on_event("shutdown")
+async def shutdown_image_pool():
+    image_pool.shutdown()
+    logger.info("Image processing pool stopped")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     try:
@@ -64,6 +104,14 @@ async def shutdown_db_client():
     except Exception as e:
         logger.error(f"Error disconnecting from MongoDB: {str(e)}")
 
+@app.on_event("shutdown")
+async def shutdown_openai_client():
+    try:
+        await openai_client.close()
+        logger.info("OpenAI HTTP client closed")
+    except Exception as e:
+        logger.error(f"Error closing OpenAI HTTP client: {str(e)}")
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to BiteBot API"}
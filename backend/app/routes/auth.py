@@ -17,40 +17,17 @@ from app.utils import (
     map_micronutrients,
     map_health_goals
 )
-from app.utils.gpt import calculate_nutritional_needs
+from app.utils.nutrition_targets import nutrition_plan, nutritional_targets
+from app.services.profile_jobs import profile_jobs, nutrition_status, NUTRITION_PENDING
+from app.utils.gpt_logging import log_body
 from app.utils.json_utils import json_dumps
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import json
+import uuid
 
 router = APIRouter()
 
-def calculate_bmr(weight: float, height: float, age: int, sex: str) -> float:
-    """Calculate Basal Metabolic Rate using Mifflin-St Jeor Equation"""
-    if sex.lower() == "male":
-        return (10 * weight) + (6.25 * height) - (5 * age) + 5
-    else:
-        return (10 * weight) + (6.25 * height) - (5 * age) - 161
-
-def calculate_calorie_target(bmr: float, activity_level: str) -> dict:
-    """Calculate calorie target based on activity level"""
-    activity_multipliers = {
-        "sedentary": 1.2,
-        "light": 1.375,
-        "moderate": 1.55,
-        "very_active": 1.725,
-        "extra_active": 1.9
-    }
-    
-    multiplier = activity_multipliers.get(activity_level.lower(), 1.2)
-    tdee = bmr * multiplier
-    
-    # Set a reasonable range (±10% of TDEE)
-    return {
-        "min": round(tdee * 0.9),
-        "max": round(tdee * 1.1)
-    }
-
 @router.post("/register", response_model=User)
 async def register(user: UserCreate, db: AsyncIOMotorDatabase = Depends(get_database)):
     print("=== Starting Registration Process ===")
@@ -88,75 +65,13 @@ async def register(user: UserCreate, db: AsyncIOMotorDatabase = Depends(get_data
             print("\n=== Starting Nutritional Needs Calculation ===")
             print(f"Calculating needs for user: {user.email}")
             
-            # Create a copy of profile data for logging
-            profile_data = user_dict['profile'].copy()
-            print(f"Profile data being sent to GPT: {json.dumps(profile_data, default=str)}")
+            log_body("Profile data for nutritional needs", user_dict['profile'])
             
-            try:
-                # Get GPT response for nutritional needs and dietary recommendations
-                gpt_response = await calculate_nutritional_needs(profile_data)
-                print(f"GPT-MINI generated response: {json.dumps(gpt_response, default=str)}")
-
-                # Update profile data with both nutritional needs and recommendations
-                user_dict["profile"]["nutritional_needs"] = gpt_response["nutritional_needs"]
-                user_dict["profile"]["dietary_recommendations"] = gpt_response["dietary_recommendations"]
-
-            except Exception as calc_error:
-                print(f"Error in GPT calculation: {str(calc_error)}")
-                # Calculate basic needs using BMR formula as fallback
-                weight = float(user_dict["profile"]["weight"]["value"])
-                height = float(user_dict["profile"]["height"]["value"])
-                age = int(user_dict["profile"]["age"])
-                sex = user_dict["profile"]["sex"]
-                activity_level = user_dict["profile"]["activity_level"]
-                
-                bmr = calculate_bmr(weight, height, age, sex)
-                calories = calculate_calorie_target(bmr, activity_level)
-                
-                nutritional_needs = {
-                    "calories": calories,
-                    "macros": {
-                        "protein": {
-                            "min": round(weight * 1.6),
-                            "max": round(weight * 2.2),
-                            "unit": "g"
-                        },
-                        "carbs": {
-                            "min": round(calories["min"] * 0.45 / 4),
-                            "max": round(calories["max"] * 0.65 / 4),
-                            "unit": "g"
-                        },
-                        "fats": {
-                            "min": round(calories["min"] * 0.20 / 9),
-                            "max": round(calories["max"] * 0.35 / 9),
-                            "unit": "g"
-                        }
-                    },
-                    "other_nutrients": {
-                        "fiber": {
-                            "min": 25,
-                            "max": 30,
-                            "unit": "g"
-                        },
-                        "sugar": {
-                            "min": 0,
-                            "max": 50,
-                            "unit": "g"
-                        },
-                        "sodium": {
-                            "min": 1500,
-                            "max": 2300,
-                            "unit": "mg"
-                        }
-                    }
-                }
-                print("Using fallback nutritional needs calculation")
-                user_dict["profile"]["nutritional_needs"] = nutritional_needs
-                user_dict["profile"]["dietary_recommendations"] = [
-                    "Consume a balanced diet with adequate protein, carbs, and healthy fats",
-                    "Include a variety of fruits and vegetables in your daily meals",
-                    "Stay hydrated by drinking plenty of water throughout the day"
-                ]
+            # Targets come from the local engine; GPT only writes the recommendations
+            plan = await nutrition_plan(user_dict["profile"])
+            user_dict["profile"]["nutritional_needs"] = plan["nutritional_needs"]
+            user_dict["profile"]["dietary_recommendations"] = plan["dietary_recommendations"]
+            log_body("Nutrition plan", plan)
         
         except Exception as e:
             print(f"Critical error in nutritional needs calculation: {str(e)}")
@@ -304,81 +219,43 @@ async def update_profile(
         print("\n=== Starting Profile Update Process ===")
         print(f"Updating profile for user: {current_user.email}")
         
-        # Calculate new nutritional needs based on updated profile
+        profile = profile_data["profile"]
+        previous = current_user.profile or {}
+        
+        # Save right away with targets from the local engine (or the last-known
+        # ones) and the last-known recommendations; a background job
+        # recomputes both and flips nutrition_status to ready
         try:
-            print("\n=== Starting Nutritional Needs Recalculation ===")
-            print(f"Calculating needs for updated profile: {json.dumps(profile_data['profile'], default=str)}")
-            
-            try:
-                # Get GPT response for nutritional needs and dietary recommendations
-                gpt_response = await calculate_nutritional_needs(profile_data["profile"])
-                print(f"GPT-MINI generated response: {json.dumps(gpt_response, default=str)}")
-
-                # Update profile data with both nutritional needs and recommendations
-                profile_data["profile"]["nutritional_needs"] = gpt_response["nutritional_needs"]
-                profile_data["profile"]["dietary_recommendations"] = gpt_response["dietary_recommendations"]
-
-            except Exception as calc_error:
-                print(f"Error in GPT calculation: {str(calc_error)}")
-                # Calculate basic needs using BMR formula as fallback
-                weight = float(profile_data["profile"]["weight"]["value"])
-                height = float(profile_data["profile"]["height"]["value"])
-                age = int(profile_data["profile"]["age"])
-                sex = profile_data["profile"]["sex"]
-                activity_level = profile_data["profile"]["activity_level"]
-                
-                bmr = calculate_bmr(weight, height, age, sex)
-                calories = calculate_calorie_target(bmr, activity_level)
-                
-                nutritional_needs = {
-                    "calories": calories,
-                    "macros": {
-                        "protein": {
-                            "min": round(weight * 1.6),
-                            "max": round(weight * 2.2),
-                            "unit": "g"
-                        },
-                        "carbs": {
-                            "min": round(calories["min"] * 0.45 / 4),
-                            "max": round(calories["max"] * 0.65 / 4),
-                            "unit": "g"
-                        },
-                        "fats": {
-                            "min": round(calories["min"] * 0.20 / 9),
-                            "max": round(calories["max"] * 0.35 / 9),
-                            "unit": "g"
-                        }
-                    },
-                    "other_nutrients": {
-                        "fiber": {"min": 25, "max": 30, "unit": "g"},
-                        "sugar": {"min": 0, "max": 25, "unit": "g"},
-                        "sodium": {"min": 1500, "max": 2300, "unit": "mg"}
-                    }
-                }
-                
-                # Add default dietary recommendations
-                profile_data["profile"]["nutritional_needs"] = nutritional_needs
-                profile_data["profile"]["dietary_recommendations"] = [
-                    "Consume a balanced diet with adequate protein, carbs, and healthy fats",
-                    "Include a variety of fruits and vegetables in your daily meals",
-                    "Stay hydrated by drinking plenty of water throughout the day"
-                ]
-
+            profile["nutritional_needs"] = nutritional_targets(profile)
         except Exception as e:
-            print(f"Error calculating nutritional needs: {str(e)}")
-            raise HTTPException(status_code=500, detail="Failed to calculate nutritional needs")
+            print(f"Error calculating nutritional needs, keeping last-known targets: {str(e)}")
+            profile["nutritional_needs"] = previous.get("nutritional_needs")
+        profile["dietary_recommendations"] = previous.get("dietary_recommendations", [])
+        profile["nutrition_status"] = NUTRITION_PENDING
+        profile["nutrition_version"] = uuid.uuid4().hex
 
         # Remove meal_history as it's redundant
-        if "meal_history" in profile_data["profile"]:
-            del profile_data["profile"]["meal_history"]
+        if "meal_history" in profile:
+            del profile["meal_history"]
 
         # Update the profile in the database
         await db.user_profiles.update_one(
             {"_id": ObjectId(current_user.id)},
             {"$set": profile_data}
         )
+        
+        profile_jobs.enqueue(db, current_user.id, profile, profile["nutrition_version"])
 
-        return {"message": "Profile updated successfully"}
+        return {"message": "Profile updated successfully", "nutrition_status": NUTRITION_PENDING}
     except Exception as e:
         print(f"Error updating profile: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/profile/nutrition-status")
+async def get_nutrition_status(current_user: UserProfile = Depends(get_current_user)):
+    """
+    Whether the targets and recommendations from the last profile save are
+    ready. Poll after a profile update until status is "ready" (or "failed",
+    in which case the last-known values are returned).
+    """
+    return nutrition_status(current_user.profile)
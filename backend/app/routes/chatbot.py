@@ -4,6 +4,6 @@ from app.utils import query_gpt
 router = APIRouter()
 
 @router.post("/")
-def chat_with_bot(message: str):
-    response = query_gpt(message)
+async def chat_with_bot(message: str):
+    response = await query_gpt(message, endpoint="chatbot")
     return {"response": response}
\ No newline at end of file
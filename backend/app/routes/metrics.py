@@ -0,0 +1,25 @@
+import hmac
+from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import Dict, Any
+from ..config import settings
+from ..utils.metrics import metrics
+
+router = APIRouter()
+
+def require_metrics_token(request: Request):
+    """
+    The endpoint is off unless METRICS_TOKEN is set, and then needs it as a
+    bearer token; user tokens don't grant access to process internals
+    """
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), settings.METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+
+@router.get("/", dependencies=[Depends(require_metrics_token)])
+async def get_metrics() -> Dict[str, Any]:
+    """
+    Snapshot of the in-process counters, gauges and histograms for this worker
+    """
+    return {"metrics": metrics.snapshot()}
@@ -1,16 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Form, Body
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Form, Body, Request
+from fastapi.responses import Response, StreamingResponse
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 from ..services.nutrition_service import NutritionService
+from ..services.image_variants import image_variant, variant_etag_hash
+from ..services.image_dedup import find_duplicate, hash_fields
 from ..models import UserProfile, MealCreate, Meal
-from ..auth import get_current_user
-from ..utils.gpt import analyze_meal_image, analyze_meal_details, query_gpt
-from ..utils.nutrition import calculate_meal_scores
+from ..auth import get_current_user, oauth2_scheme
+from ..utils.gpt import (
+    analyze_meal_image, analyze_meal_details, analyze_meal_details_stream, query_gpt,
+    VISION_MODEL, MEAL_DETAILS_MODEL, STREAMED_DETAIL_FIELDS
+)
+from ..utils.nutrition import finalize_meal_details
+from ..utils.vision_cache import vision_cache, image_cache_key
+from ..utils.details_cache import details_cache, details_signature
+from ..utils.image_processing import compress_image, perceptual_hash, prepare_vision_image, IMAGE_VARIANTS, VARIANT_FULL
+from ..utils.image_pool import image_pool, ImagePoolBusy
+from ..utils.blob_store import get_blob_store, BlobNotFound
+from ..utils.image_urls import sign_image_url, image_srcset, verify_image_signature, image_url_id, canonical_image_url
+from ..utils.http_cache import strong_etag, etag_matches, parse_range, RangeNotSatisfiable
+from ..utils.resilience import CircuitOpenError
 from ..utils.json_utils import json_dumps, json_loads
+from ..utils.json_extract import extract_json
+from ..utils.gpt_logging import log_body
+from ..utils.gpt_instrumentation import record_cache_hit
 from .database import get_database as get_db
 from sqlalchemy.orm import Session
+import asyncio
+import hashlib
 import json
+import time
 from datetime import datetime, timedelta
 from bson import ObjectId
 import io
@@ -19,72 +38,12 @@ from ..routes.database import with_retry
 import logging
 from ..config import settings
 import traceback
-from PIL import Image
 import base64
 
 router = APIRouter()
 nutrition_service = NutritionService()
 logger = logging.getLogger(__name__)
 
-def compress_image(image_content: bytes, max_size_mb: float = 0.6) -> bytes:
-    """
-    Compress an image to be under 600KB while maintaining quality.
-    Returns the compressed image as bytes.
-    """
-    try:
-        # Convert bytes to PIL Image
-        image = Image.open(io.BytesIO(image_content))
-        
-        # Convert to RGB if necessary (for PNG with transparency)
-        if image.mode in ('RGBA', 'P'):
-            image = image.convert('RGB')
-        
-        # Calculate target size in bytes (600KB)
-        max_size_bytes = max_size_mb * 1024 * 1024
-        
-        # Start with high quality
-        quality = 85  # Start with slightly lower quality for faster compression
-        output = io.BytesIO()
-        
-        # Compress with decreasing quality until size is under max_size_bytes
-        while quality > 5:
-            output.seek(0)
-            output.truncate()
-            image.save(output, format='JPEG', quality=quality, optimize=True)
-            if output.tell() <= max_size_bytes:
-                break
-            quality -= 10  # Decrease quality more aggressively
-        
-        # If still too large, resize the image
-        if output.tell() > max_size_bytes:
-            # Calculate new dimensions while maintaining aspect ratio
-            ratio = (max_size_bytes / output.tell()) ** 0.5
-            new_width = int(image.width * ratio)
-            new_height = int(image.height * ratio)
-            
-            # Resize image
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Save with optimized settings
-            output.seek(0)
-            output.truncate()
-            image.save(output, format='JPEG', quality=85, optimize=True)
-            
-            # If still too large, try one more time with lower quality
-            if output.tell() > max_size_bytes:
-                output.seek(0)
-                output.truncate()
-                image.save(output, format='JPEG', quality=75, optimize=True)
-        
-        compressed_size = output.tell()
-        print(f"Compressed image to {compressed_size/1024:.1f}KB with quality {quality}")
-        return output.getvalue()
-        
-    except Exception as e:
-        logger.error(f"Error compressing image: {str(e)}")
-        # If compression fails, return original image
-        return image_content
-
 @router.post("/calculate-needs")
 async def calculate_nutritional_needs(
     current_user: UserProfile = Depends(get_current_user),
@@ -94,7 +53,7 @@ async def calculate_nutritional_needs(
     Calculate nutritional needs for the current user
     """
     try:
-        nutritional_plan = await nutrition_service.calculate_nutritional_needs(current_user)
+        nutritional_plan = await nutrition_service.calculate_nutritional_needs(current_user.profile)
         
         # Store the nutritional plan in the database
         await db.user_profiles.update_one(
@@ -102,7 +61,7 @@ async def calculate_nutritional_needs(
             {"$set": {"profile.nutritional_plan": nutritional_plan}}
         )
         
-        return json.loads(nutritional_plan)
+        return nutritional_plan
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -138,32 +97,69 @@ async def analyze_meal_photo(
                 detail="File size too large. Maximum size is 5MB."
             )
         
-        # Compress the image before storing
-        compressed_image = compress_image(image_content)
-        print(f"Compressed image from {len(image_content)} to {len(compressed_image)} bytes")
-        
-        # Store the compressed image in the database
-        image_id = await db.images.insert_one({
-            "user_id": ObjectId(current_user.id),
-            "filename": file.filename,
-            "content_type": "image/jpeg",  # Always store as JPEG after compression
-            "data": compressed_image,
-            "uploaded_at": datetime.utcnow()
-        })
+        # Hash the photo for the vision cache and for near-duplicate detection
+        # in the image pool so decoding doesn't block the event loop
+        cache_key, dhash = await asyncio.gather(
+            image_pool.run("cache_key", image_cache_key, image_content),
+            image_pool.run("dhash", perceptual_hash, image_content)
+        )
+        
+        # A near-duplicate of a photo this user uploaded recently reuses its
+        # image document instead of storing another copy
+        duplicate = await find_duplicate(db, ObjectId(current_user.id), dhash)
+        if duplicate is not None:
+            image_id = duplicate["_id"]
+            print(f"Reusing image {str(image_id)} for near-duplicate upload")
+        else:
+            compressed_image = await image_pool.run("compress", compress_image, image_content)
+            print(f"Compressed image from {len(image_content)} to {len(compressed_image)} bytes")
+            
+            # Store the compressed bytes in the blob store and only metadata in Mongo
+            blob_store = get_blob_store(db)
+            key = await blob_store.put(compressed_image)
+            result = await db.images.insert_one({
+                "user_id": ObjectId(current_user.id),
+                "filename": file.filename,
+                "content_type": "image/jpeg",  # Always store as JPEG after compression
+                "storage": blob_store.name,
+                "blob_key": key,
+                "sha256": key,
+                "size": len(compressed_image),
+                "vision_cache_key": cache_key,
+                **hash_fields(dhash),
+                "uploaded_at": datetime.utcnow()
+            })
+            image_id = result.inserted_id
         
         # Generate the image URL with the full path
-        image_url = f"{settings.API_BASE_URL}/api/nutrition/images/{str(image_id.inserted_id)}"
+        image_url = f"{settings.API_BASE_URL}/api/nutrition/images/{str(image_id)}"
         print(f"Generated image URL: {image_url}")
-        print(f"Image ID: {str(image_id.inserted_id)}")
+        print(f"Image ID: {str(image_id)}")
 
-        # Analyze the image using GPT-4 Vision
-        print("Calling analyze_meal_image...")
-        analysis = await analyze_meal_image(image_content)  # Use original image for analysis
-        print("Successfully analyzed meal image")
+        # Re-uploads of the same photo are answered from the vision cache, and
+        # near-duplicates from the cached analysis of the photo they matched
+        analysis = await vision_cache.get(db, cache_key)
+        if analysis is None and duplicate is not None and settings.IMAGE_DEDUP_REUSE_ANALYSIS:
+            duplicate_key = duplicate.get("vision_cache_key")
+            if duplicate_key and duplicate_key != cache_key:
+                analysis = await vision_cache.get(db, duplicate_key)
+        if analysis is not None:
+            print(f"Vision cache hit for image {cache_key[:12]}")
+            record_cache_hit("meal_image", VISION_MODEL)
+        else:
+            # Send the model a downscaled copy rather than the original upload
+            vision_image, detail = await image_pool.run("vision_prepare", prepare_vision_image, image_content)
+            print(f"Prepared vision image: {len(vision_image)} bytes, detail={detail}")
+            
+            # Analyze the image using GPT-4 Vision
+            print("Calling analyze_meal_image...")
+            analysis = await analyze_meal_image(vision_image, detail=detail, user_id=current_user.id)
+            print("Successfully analyzed meal image")
+            await vision_cache.set(db, cache_key, analysis)
         
         # Add the image URL to the analysis
         analysis["image_url"] = image_url
-        print(f"Final analysis with image URL: {analysis}")
+        log_body("Final analysis with image URL", analysis)
         
         return {
             "status": "success",
@@ -172,6 +168,12 @@ async def analyze_meal_photo(
     except HTTPException as he:
         # Re-raise HTTP exceptions
         raise he
+    except CircuitOpenError:
+        # Rendered as a 503 with Retry-After by the app-level handler
+        raise
+    except ImagePoolBusy as e:
+        logger.warning(f"Rejecting meal photo upload: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         print(f"Error in analyze_meal_photo endpoint: {str(e)}")
         print(f"Error type: {type(e).__name__}")
@@ -223,7 +225,9 @@ async def get_user_meals(
                     "meal_name": meal.get("meal_name", "Unnamed Meal"),
                     "date": meal.get("date", date),
                     "timestamp": meal.get("timestamp", datetime.utcnow().isoformat()),
-                    "image_url": meal.get("image_url", ""),
+                    # Signed so the browser can load the photo without a per-image user lookup
+                    "image_url": sign_image_url(meal.get("image_url", ""), current_user.id),
+                    "image_srcset": image_srcset(meal.get("image_url", ""), current_user.id),
                     "ingredients": meal.get("ingredients", []),
                     "cooking_method": meal.get("cooking_method", ""),
                     "serving_size": meal.get("serving_size", ""),
@@ -262,6 +266,26 @@ async def get_user_meals(
         logger.error(f"Error in get_user_meals: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def cached_meal_details(db, conversation_history: List[Dict[str, Any]], user_profile: Dict[str, Any]):
+    """
+    Look up a cached details analysis for this conversation and profile.
+    Returns (signature, analysis); analysis is None on a miss and signature
+    is None when the cache is disabled. Cached analyses are stored before
+    finalize_meal_details, so scores and micronutrients are recomputed for
+    the current user on every hit.
+    """
+    if not settings.DETAILS_CACHE_ENABLED:
+        return None, None
+    signature = details_signature(conversation_history, user_profile)
+    analysis = await details_cache.get(db, signature)
+    if analysis is not None:
+        record_cache_hit("meal_details", MEAL_DETAILS_MODEL)
+    return signature, analysis
+
+def _sse_event(event: str, payload: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
 @router.post("/analyze-details")
 async def analyze_meal_details_endpoint(
     data: Dict[str, Any],
@@ -278,17 +302,27 @@ async def analyze_meal_details_endpoint(
         conversation_history = data.get("conversation_history", [])
         user_profile = data.get("user_profile", {})
         
-        logger.info(f"Received conversation history: {json.dumps(conversation_history, indent=2)}")
-        logger.info(f"Received user profile: {json.dumps(user_profile, indent=2)}")
+        log_body("Received conversation history", conversation_history)
+        log_body("Received user profile", user_profile)
         
         # Get user's priority micronutrients from their profile
         priority_micronutrients = user_profile.get('profile', {}).get('priority_micronutrients', [])
         logger.info(f"Priority micronutrients: {priority_micronutrients}")
         
+        signature, analysis = await cached_meal_details(db, conversation_history, user_profile)
+        if analysis is not None:
+            logger.info("Meal details served from cache")
+        
         # Analyze meal details using GPT
         try:
-            analysis = await analyze_meal_details(conversation_history, user_profile)
-            logger.info(f"GPT analysis completed: {json.dumps(analysis, indent=2)}")
+            if analysis is None:
+                analysis = await analyze_meal_details(conversation_history, user_profile, user_id=current_user.id)
+                logger.info("GPT analysis completed")
+                log_body("GPT analysis", analysis)
+                if signature is not None:
+                    await details_cache.set(db, signature, analysis)
+        except CircuitOpenError:
+            raise
         except Exception as gpt_error:
             logger.error(f"Error in GPT analysis: {str(gpt_error)}")
             logger.error(f"GPT error type: {type(gpt_error)}")
@@ -298,51 +332,7 @@ async def analyze_meal_details_endpoint(
                 detail=f"Failed to analyze meal with GPT: {str(gpt_error)}"
             )
         
-        # Process the analysis data to ensure all required fields are present
-        # Make sure macronutrients is properly structured
-        if "macronutrients" not in analysis or not analysis["macronutrients"]:
-            analysis["macronutrients"] = {
-                "calories": 0,
-                "protein": 0,
-                "carbs": 0,
-                "fats": 0,
-                "fiber": 0,
-                "sugar": 0,
-                "sodium": 0
-            }
-        
-        # Only track the user's selected priority micronutrients
-        if "micronutrients" not in analysis or not analysis["micronutrients"]:
-            analysis["micronutrients"] = {}
-        
-        # Filter micronutrients to only include priority ones
-        filtered_micronutrients = {}
-        for nutrient in priority_micronutrients:
-            # Convert to snake_case for consistency
-            nutrient_key = nutrient.lower().replace(" ", "_")
-            if nutrient_key in analysis.get("micronutrients", {}):
-                filtered_micronutrients[nutrient_key] = analysis["micronutrients"][nutrient_key]
-        
-        analysis["micronutrients"] = filtered_micronutrients
-        
-        # Calculate nutritional scores
-        scores = calculate_meal_scores(analysis)
-        analysis["scores"] = scores
-        
-        # Ensure we have a meal name
-        if not analysis.get("meal_name"):
-            # Try to extract a meal name from the conversation
-            meal_name = extract_meal_name_from_conversation(conversation_history)
-            if meal_name:
-                analysis["meal_name"] = meal_name
-            else:
-                analysis["meal_name"] = "Analyzed Meal"
-        
-        # Log the meal name for debugging
-        logger.info(f"Meal name from analysis: {analysis.get('meal_name', 'Not provided')}")
-        
-        # Extract image URL from the analysis if it exists
-        image_url = analysis.get("image_url", "")
+        analysis = finalize_meal_details(analysis, conversation_history, priority_micronutrients)
         
         # Do NOT create or store a meal entry here
         return {
@@ -350,6 +340,8 @@ async def analyze_meal_details_endpoint(
             "data": analysis
         }
         
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.error(f"Error in analyze_meal_details_endpoint: {str(e)}")
         raise HTTPException(
@@ -357,54 +349,131 @@ async def analyze_meal_details_endpoint(
             detail=f"Failed to analyze meal details: {str(e)}"
         )
 
-def extract_meal_name_from_conversation(conversation_history):
-    """Extract a potential meal name from the conversation history"""
-    meal_keywords = ["eating", "had", "ate", "having", "consumed", "meal", "breakfast", "lunch", "dinner", "snack"]
+@router.post("/analyze-details/stream")
+async def analyze_meal_details_stream_endpoint(
+    data: Dict[str, Any],
+    current_user: UserProfile = Depends(get_current_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Streaming variant of /analyze-details using Server-Sent Events.
+    Emits a `field` event for meal_name, macronutrients and scores as soon as
+    the model completes them, then a `complete` event carrying the same
+    document /analyze-details returns. Failures are reported as an `error` event.
+    """
+    logger.info("=== Starting Streaming Meal Details Analysis ===")
     
-    for message in conversation_history:
-        if message.get("type") == "user":
-            content = message.get("content", "").lower()
+    conversation_history = data.get("conversation_history", [])
+    user_profile = data.get("user_profile", {})
+    priority_micronutrients = user_profile.get('profile', {}).get('priority_micronutrients', [])
+    
+    async def event_stream():
+        try:
+            signature, analysis = await cached_meal_details(db, conversation_history, user_profile)
+            if analysis is not None:
+                # Replay the cached analysis as the same sequence of events
+                analysis = finalize_meal_details(analysis, conversation_history, priority_micronutrients)
+                for key in STREAMED_DETAIL_FIELDS:
+                    if key in analysis:
+                        yield _sse_event("field", {"key": key, "value": analysis[key]})
+                yield _sse_event("complete", {"status": "success", "data": analysis})
+                return
             
-            # Check if the message contains meal keywords
-            if any(keyword in content for keyword in meal_keywords):
-                # Extract potential meal name (simple heuristic)
-                words = content.split()
-                for i, word in enumerate(words):
-                    if word in meal_keywords and i + 1 < len(words):
-                        # Get 4-5 words after the meal keyword
-                        start_idx = i + 1
-                        end_idx = min(start_idx + 5, len(words))  # Get up to 5 words
-                        potential_name = " ".join(words[start_idx:end_idx])
-                        
-                        # If we got less than 4 words, try to get more context
-                        if len(potential_name.split()) < 4:
-                            # Look for more words before the meal keyword
-                            pre_words = words[max(0, i-2):i]  # Get up to 2 words before
-                            potential_name = " ".join(pre_words + [word] + words[start_idx:end_idx])
-                        
-                        # Capitalize words and limit to 5 words
-                        name_parts = potential_name.split()[:5]
-                        return " ".join(word.capitalize() for word in name_parts)
+            async for event, payload in analyze_meal_details_stream(conversation_history, user_profile, user_id=current_user.id):
+                if event == "complete":
+                    if signature is not None:
+                        await details_cache.set(db, signature, payload)
+                    analysis = finalize_meal_details(payload, conversation_history, priority_micronutrients)
+                    payload = {"status": "success", "data": analysis}
+                yield _sse_event(event, payload)
+        except CircuitOpenError as e:
+            logger.warning(f"Streaming meal details rejected: {str(e)}")
+            yield _sse_event("error", {"detail": str(e), "status_code": 503, "retry_after": int(e.retry_after) + 1})
+        except Exception as e:
+            logger.error(f"Error in analyze_meal_details_stream_endpoint: {str(e)}")
+            yield _sse_event("error", {"detail": f"Failed to analyze meal details: {str(e)}"})
     
-    return None
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Don't let proxies buffer the stream
+        }
+    )
+
+# Image document fields needed to answer a request without loading the bytes
+IMAGE_METADATA_FIELDS = {
+    "user_id": 1, "filename": 1, "content_type": 1, "storage": 1, "blob_key": 1, "sha256": 1, "size": 1, "variants": 1
+}
+
+async def load_inline_image(db, image_id: ObjectId) -> bytes:
+    image = await db.images.find_one({"_id": image_id}, {"data": 1})
+    return bytes(image["data"])
+
+async def image_viewer(
+    image_id: str,
+    request: Request,
+    exp: Optional[int] = None,
+    sig: Optional[str] = None,
+    db = Depends(get_db)
+) -> Optional[UserProfile]:
+    """
+    Who is asking for an image. A signed URL returns None without a user
+    lookup; get_image verifies the signature against the image's owner.
+    Otherwise the bearer token is resolved to the user, whose ownership
+    get_image checks.
+    """
+    if sig is not None:
+        return None
+    return await bearer_viewer(request, db)
+
+async def bearer_viewer(request: Request, db) -> UserProfile:
+    token = await oauth2_scheme(request)
+    return await get_current_user(token, db)
+
+async def owned_image_url(db, image_url: str, user_id: str) -> str:
+    """
+    A client-supplied meal image URL, normalized to its canonical form if it
+    is a meal photo. Raises 403 if the photo isn't one of the user's own.
+    """
+    image_id = image_url_id(image_url)
+    if image_id is None:
+        return image_url
+    owned = await db.images.find_one({"_id": ObjectId(image_id), "user_id": ObjectId(user_id)}, {"_id": 1})
+    if not owned:
+        raise HTTPException(status_code=403, detail="Not authorized to use this image")
+    return canonical_image_url(image_id)
 
 @router.get("/images/{image_id}")
 async def get_image(
     image_id: str,
-    current_user: UserProfile = Depends(get_current_user),
+    request: Request,
+    variant: str = VARIANT_FULL,
+    exp: Optional[int] = None,
+    sig: Optional[str] = None,
+    viewer: Optional[UserProfile] = Depends(image_viewer),
     db = Depends(get_db)
 ):
     """
-    Get a stored image by ID
+    Get a stored image by ID, via a signed URL or with a bearer token.
+    `variant` selects a display size (thumb, card, full); smaller variants
+    are generated on first request and stored.
+    Sends a strong ETag (from the stored content hash) and Content-Length, answers a
+    matching If-None-Match with 304 from the image metadata alone, and
+    serves a single byte range for Range requests.
     """
     try:
         print(f"\n=== Getting Image {image_id} ===")
-        print(f"User ID: {current_user.id}")
+        print(f"User ID: {viewer.id if viewer else 'signed URL'}")
         print(f"Database connection: {db is not None}")
         
-        # Find the image in the database
+        if variant not in IMAGE_VARIANTS:
+            raise HTTPException(status_code=400, detail=f"Unknown image variant: {variant}")
+        
+        # Find the image metadata in the database
         print(f"Searching for image with ID: {image_id}")
-        image = await db.images.find_one({"_id": ObjectId(image_id)})
+        image = await db.images.find_one({"_id": ObjectId(image_id)}, IMAGE_METADATA_FIELDS)
         
         if not image:
             print(f"Image not found in database: {image_id}")
@@ -412,27 +481,87 @@ async def get_image(
             
         print(f"Found image document: {image.keys()}")
         
+        # A signed URL must have been minted for this image's owner; the app
+        # also sends its bearer token, which is used once a link has expired
+        if viewer is None and not verify_image_signature(image_id, str(image["user_id"]), exp, sig):
+            if "authorization" not in request.headers:
+                raise HTTPException(status_code=403, detail="Image link is invalid or has expired")
+            viewer = await bearer_viewer(request, db)
+        
         # Check if the image belongs to the current user
-        if str(image["user_id"]) != current_user.id:
-            print(f"User {current_user.id} not authorized to access image {image_id}")
+        if viewer is not None and str(image["user_id"]) != viewer.id:
+            print(f"User {viewer.id} not authorized to access image {image_id}")
             print(f"Image belongs to user: {image['user_id']}")
             raise HTTPException(status_code=403, detail="Not authorized to access this image")
             
         print(f"Found image: {image['filename']}, content_type: {image['content_type']}")
-        print(f"Image size: {len(image['data'])} bytes")
+        
+        # Images not yet moved out by tools/migrate_image_blobs.py keep their bytes inline
+        data = None
+        if not image.get("blob_key") and not image.get("sha256"):
+            # Hash them once so later revalidations don't load the bytes
+            data = await load_inline_image(db, image["_id"])
+            image["sha256"], image["size"] = hashlib.sha256(data).hexdigest(), len(data)
+            await db.images.update_one(
+                {"_id": image["_id"]}, {"$set": {"sha256": image["sha256"], "size": image["size"]}}
+            )
+        
+        etag = strong_etag(variant_etag_hash(image, variant))
+        # Responses to signed URLs may only be cached until the signature expires
+        max_age = 31536000 if viewer else max(0, exp - int(time.time()))
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"private, max-age={max_age}",
+            "Accept-Ranges": "bytes"
+        }
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            print("Image not modified")
+            return Response(status_code=304, headers=headers)
+        
+        # Variants not built yet are generated only once the request needs the bytes
+        blob = await image_variant(db, image, variant)
+        
+        size = blob["size"]
+        try:
+            byte_range = parse_range(request.headers.get("range"), size, request.headers.get("if-range"), etag)
+        except RangeNotSatisfiable:
+            raise HTTPException(
+                status_code=416,
+                detail="Requested range not satisfiable",
+                headers={"Content-Range": f"bytes */{size}"}
+            )
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1
+        
+        if not blob.get("blob_key"):
+            data = data if data is not None else await load_inline_image(db, image["_id"])
+            body = io.BytesIO(data[start:end + 1])
+        else:
+            # Stream only the requested bytes from the blob store, chunk by chunk
+            reader = await get_blob_store(db, blob.get("storage")).open(blob["blob_key"], start, length)
+            body = reader.chunks
+        print(f"Image size: {size} bytes, sending {length}")
+        
+        headers["Content-Disposition"] = f"inline; filename={image['filename']}"
+        headers["Content-Length"] = str(length)
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
         
         # Create a streaming response with the image data
         response = StreamingResponse(
-            io.BytesIO(image["data"]),
+            body,
+            status_code=206 if byte_range else 200,
             media_type=image["content_type"],
-            headers={
-                "Content-Disposition": f"inline; filename={image['filename']}",
-                "Cache-Control": "public, max-age=31536000"
-            }
+            headers=headers
         )
         print("Created streaming response")
         return response
         
+    except HTTPException:
+        raise
+    except BlobNotFound:
+        logger.error(f"Blob missing for image {image_id}")
+        raise HTTPException(status_code=404, detail="Image not found")
     except Exception as e:
         print(f"Error serving image: {str(e)}")
         print(f"Error type: {type(e).__name__}")
@@ -484,6 +613,9 @@ async def create_meal(
                 # Use a default image if no image URL is provided
                 meal_dict["image_url"] = "https://images.unsplash.com/photo-1515543904379-3d757afe72e4?w=800&dpr=2&q=80"
         
+        # Meals may only point at the user's own photos
+        meal_dict["image_url"] = await owned_image_url(db, meal_dict["image_url"], current_user.id)
+        
         logger.info(f"Meal data: {meal_dict}")
         
         # Insert the meal into the database
@@ -498,6 +630,8 @@ async def create_meal(
         
         return created_meal
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating meal: {str(e)}")
         raise HTTPException(
@@ -516,6 +650,8 @@ async def update_meal(
     try:
         meal_dict = meal.dict()
         meal_dict["user_id"] = current_user["id"]
+        if meal_dict.get("image_url"):
+            meal_dict["image_url"] = await owned_image_url(db, meal_dict["image_url"], current_user["id"])
         
         result = await db.meals.update_one(
             {"_id": ObjectId(meal_id), "user_id": current_user["id"]},
@@ -534,6 +670,8 @@ async def update_meal(
         updated_meal["user_id"] = str(updated_meal["user_id"])
         
         return updated_meal
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating meal: {str(e)}")
         raise HTTPException(
@@ -848,7 +986,7 @@ async def analyze_profile(
     """
     try:
         # Get GPT response
-        response = query_gpt(f"""
+        response = await query_gpt(f"""
         Analyze the following profile changes and provide updated nutritional recommendations.
         Previous Profile:
         {json.dumps(previous_profile, indent=2)}
@@ -897,26 +1035,11 @@ async def analyze_profile(
                 }}
             }}
         }}
-        """)
+        """, endpoint="analyze_profile")
         
         # Extract JSON from response
         try:
-            # Clean up the response by removing markdown code block markers and any text before the JSON
-            content = response.strip()
-            if "```json" in content:
-                content = content.split("```json")[1]
-            if "```" in content:
-                content = content.split("```")[0]
-            content = content.strip()
-            
-            # Look for JSON-like structure between curly braces
-            import re
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                nutritional_needs = json.loads(json_str)
-            else:
-                raise ValueError("No JSON structure found in response")
+            nutritional_needs = extract_json(response)
                 
             # Validate the response structure
             required_fields = ["calories", "macros", "other_nutrients"]
@@ -954,6 +1077,8 @@ async def analyze_profile(
             logger.error(f"Raw GPT response: {response}")
             raise HTTPException(status_code=500, detail=f"Failed to parse GPT response: {str(e)}")
             
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.error(f"Error analyzing profile: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
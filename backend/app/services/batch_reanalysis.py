@@ -0,0 +1,325 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from ..utils.openai_client import openai_client
+from ..utils.gpt import build_meal_details_request, normalize_meal_analysis, MEAL_DETAILS_MODEL
+from ..utils.json_extract import extract_json
+from ..utils.nutrition import finalize_meal_details
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# One checkpoint document per named job
+JOBS_COLLECTION = "reanalysis_jobs"
+
+# Batch API statuses after which a batch will not change again
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Meal fields a re-analysis replaces; everything else (user, date, image) is kept
+REANALYZED_FIELDS = (
+    "ingredients", "cooking_method", "serving_size", "macronutrients", "scores", "health_tags",
+    "health_benefits", "potential_concerns", "suggestions", "recommended_recipes", "micronutrient_balance"
+)
+
+class BatchAPI:
+    """The Files and Batches endpoints of the OpenAI API, over the shared client"""
+
+    async def upload(self, path: str) -> str:
+        client = await openai_client.get_client()
+        with open(path, "rb") as f:
+            response = await client.post(
+                "/files",
+                data={"purpose": "batch"},
+                files={"file": (os.path.basename(path), f, "application/jsonl")}
+            )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    async def create_batch(self, input_file_id: str) -> Dict[str, Any]:
+        client = await openai_client.get_client()
+        response = await client.post("/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h"
+        })
+        response.raise_for_status()
+        return response.json()
+
+    async def get_batch(self, batch_id: str) -> Dict[str, Any]:
+        client = await openai_client.get_client()
+        response = await client.get(f"/batches/{batch_id}")
+        response.raise_for_status()
+        return response.json()
+
+    async def iter_lines(self, file_id: str) -> AsyncIterator[str]:
+        """Stream a result file line by line instead of loading it whole"""
+        client = await openai_client.get_client()
+        async with client.stream("GET", f"/files/{file_id}/content") as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield line
+
+def conversation_from_chat(messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """
+    Rebuild the conversation_history the frontend sent to analyze-details:
+    the text messages before the saved analysis, as role/content pairs.
+    """
+    conversation = []
+    for message in messages:
+        if message.get("isAnalysis"):
+            break
+        content = message.get("content")
+        if message.get("isLoading") or not isinstance(content, str) or not content:
+            continue
+        conversation.append({
+            "role": "user" if message.get("type") == "user" else "assistant",
+            "content": content
+        })
+    return conversation
+
+def _meal_time(meal: Dict[str, Any]) -> Optional[datetime]:
+    timestamp = meal.get("timestamp")
+    if isinstance(timestamp, datetime):
+        return timestamp
+    try:
+        return datetime.fromisoformat(str(timestamp))
+    except ValueError:
+        return None
+
+def meal_update_fields(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a finalized analysis the way create_meal stores it"""
+    fields = {key: analysis[key] for key in REANALYZED_FIELDS if key in analysis}
+    if "scores" in fields:
+        # Stored scores are the numeric ones; the per-nutrient breakdown is not kept
+        fields["scores"] = {key: value for key, value in fields["scores"].items() if isinstance(value, (int, float))}
+    if "recommended_recipes" in fields:
+        fields["recommended_recipes"] = [
+            recipe if isinstance(recipe, str) else recipe.get("name", "")
+            for recipe in fields["recommended_recipes"]
+        ]
+    return fields
+
+class ReanalysisJob:
+    """
+    Re-runs the meal details analysis over stored chats and meals through the
+    Batch API, resumably.
+
+    Progress lives in a checkpoint document in JOBS_COLLECTION: the last chat
+    scanned, every submitted batch, and how many result lines of each batch
+    have been written back. A crashed or interrupted run picks up from there
+    without resubmitting or rewriting anything.
+    """
+    def __init__(self, db, name: str, api: Optional[BatchAPI] = None, work_dir: str = "batch_files"):
+        self.db = db
+        self.name = name
+        self.api = api or BatchAPI()
+        self.work_dir = work_dir
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+
+    async def checkpoint(self) -> Dict[str, Any]:
+        """The job's checkpoint document, created on first use"""
+        now = datetime.utcnow()
+        await self.db[JOBS_COLLECTION].update_one(
+            {"_id": self.name},
+            {"$setOnInsert": {
+                "model": MEAL_DETAILS_MODEL, "cursor": None, "scan_complete": False,
+                "batches": [], "created_at": now, "updated_at": now
+            }},
+            upsert=True
+        )
+        return await self.db[JOBS_COLLECTION].find_one({"_id": self.name})
+
+    async def _profile(self, user_id: str) -> Dict[str, Any]:
+        if user_id not in self._profiles:
+            user = await self.db.user_profiles.find_one({"_id": ObjectId(user_id)}, {"profile": 1})
+            self._profiles[user_id] = (user or {}).get("profile") or {}
+        return self._profiles[user_id]
+
+    async def _candidates(self, after: Optional[ObjectId]) -> AsyncIterator[Tuple[ObjectId, Optional[Dict[str, Any]]]]:
+        """
+        Yield (chat _id, batch request line or None) for chats after `after`,
+        in _id order. Chats are matched to their saved meal by user and image.
+        """
+        query = {"_id": {"$gt": after}} if after else {}
+        cursor = self.db.chat_history.find(query, {"user_id": 1, "image_url": 1, "messages": 1}).sort("_id", 1)
+        async for chat in cursor:
+            line = None
+            conversation = conversation_from_chat(chat.get("messages") or [])
+            if chat.get("image_url") and conversation:
+                user_id = str(chat["user_id"])
+                meal = await self.db.meals.find_one(
+                    {"user_id": user_id, "image_url": chat["image_url"]},
+                    {"timestamp": 1}
+                )
+                if meal:
+                    profile = await self._profile(user_id)
+                    line = {
+                        "custom_id": str(meal["_id"]),
+                        "method": "POST",
+                        "url": "/v1/chat/completions",
+                        "body": build_meal_details_request(conversation, profile, _meal_time(meal))
+                    }
+            yield chat["_id"], line
+
+    async def submit(self, chunk_size: int, limit: Optional[int] = None) -> int:
+        """
+        Write the next requests to JSONL files of up to `chunk_size` lines,
+        upload them and start a batch for each. Returns how many requests
+        were submitted.
+        """
+        job = await self.checkpoint()
+        if job["scan_complete"]:
+            return 0
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        submitted = 0
+        lines: List[str] = []
+        last_chat = job["cursor"]
+        exhausted = True
+        # Duplicate chats of one meal would repeat a custom_id, which a batch rejects
+        seen_meals = set()
+        async for chat_id, line in self._candidates(job["cursor"]):
+            if limit is not None and submitted + len(lines) >= limit:
+                exhausted = False
+                break
+            last_chat = chat_id
+            if line is not None and line["custom_id"] not in seen_meals:
+                seen_meals.add(line["custom_id"])
+                lines.append(json.dumps(line))
+            if len(lines) >= chunk_size:
+                submitted += await self._submit_chunk(lines, last_chat)
+                lines = []
+        if lines:
+            submitted += await self._submit_chunk(lines, last_chat)
+        await self.db[JOBS_COLLECTION].update_one(
+            {"_id": self.name},
+            {"$set": {"cursor": last_chat, "scan_complete": exhausted, "updated_at": datetime.utcnow()}}
+        )
+        return submitted
+
+    async def _submit_chunk(self, lines: List[str], last_chat: ObjectId) -> int:
+        path = os.path.join(self.work_dir, f"{self.name}-{last_chat}.jsonl")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        file_id = await self.api.upload(path)
+        batch = await self.api.create_batch(file_id)
+        # Record the batch and move the cursor in one write, so a crash never
+        # leaves a submitted chunk that would be built again
+        await self.db[JOBS_COLLECTION].update_one(
+            {"_id": self.name},
+            {
+                "$push": {"batches": {
+                    "batch_id": batch["id"], "input_file_id": file_id, "path": path,
+                    "requests": len(lines), "status": batch.get("status", "validating"),
+                    "applied_lines": 0, "updated": 0, "failed": 0, "applied": False
+                }},
+                "$set": {"cursor": last_chat, "updated_at": datetime.utcnow()}
+            }
+        )
+        logger.info(f"Submitted batch {batch['id']} with {len(lines)} requests")
+        return len(lines)
+
+    async def apply(self, poll_interval: float, write_batch_size: int):
+        """Poll every unapplied batch until it finishes and write its results back"""
+        job = await self.checkpoint()
+        pending = [batch for batch in job["batches"] if not batch["applied"]]
+        while pending:
+            still_pending = []
+            for batch in pending:
+                remote = await self.api.get_batch(batch["batch_id"])
+                status = remote.get("status")
+                await self._update_batch(batch["batch_id"], {"status": status, "request_counts": remote.get("request_counts")})
+                if status not in TERMINAL_STATUSES:
+                    still_pending.append(batch)
+                    continue
+                if remote.get("output_file_id"):
+                    await self._apply_results(batch, remote["output_file_id"], write_batch_size)
+                # Requests the API itself failed are only listed in the error file
+                request_failures = (remote.get("request_counts") or {}).get("failed", 0)
+                await self._update_batch(batch["batch_id"], {"applied": True, "request_failures": request_failures})
+                logger.info(f"Batch {batch['batch_id']} {status}")
+            pending = still_pending
+            if pending:
+                await asyncio.sleep(poll_interval)
+
+    async def _update_batch(self, batch_id: str, fields: Dict[str, Any]):
+        await self.db[JOBS_COLLECTION].update_one(
+            {"_id": self.name, "batches.batch_id": batch_id},
+            {"$set": {**{f"batches.$.{key}": value for key, value in fields.items()}, "updated_at": datetime.utcnow()}}
+        )
+
+    async def _apply_results(self, batch: Dict[str, Any], output_file_id: str, write_batch_size: int):
+        """Stream a batch's results and bulk_write them, checkpointing after every write"""
+        applied = batch["applied_lines"]
+        updated, failed = batch["updated"], batch["failed"]
+        results: List[Dict[str, Any]] = []
+        index = 0
+        async for line in self.api.iter_lines(output_file_id):
+            index += 1
+            if index <= applied:
+                continue  # written back by an earlier run
+            results.append(json.loads(line))
+            if len(results) >= write_batch_size:
+                ok, bad = await self._write(results)
+                updated, failed, applied = updated + ok, failed + bad, index
+                await self._update_batch(batch["batch_id"], {"applied_lines": applied, "updated": updated, "failed": failed})
+                results = []
+        if results:
+            ok, bad = await self._write(results)
+            await self._update_batch(batch["batch_id"], {"applied_lines": index, "updated": updated + ok, "failed": failed + bad})
+
+    async def _write(self, results: List[Dict[str, Any]]) -> Tuple[int, int]:
+        """Turn result lines into meal updates and bulk_write them; returns (updated, failed)"""
+        meal_ids = [ObjectId(result["custom_id"]) for result in results]
+        owners = {
+            str(meal["_id"]): meal["user_id"]
+            async for meal in self.db.meals.find({"_id": {"$in": meal_ids}}, {"user_id": 1})
+        }
+        now = datetime.utcnow()
+        operations = []
+        failed = 0
+        for result in results:
+            meal_id = result["custom_id"]
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200 or meal_id not in owners:
+                failed += 1
+                continue
+            try:
+                content = response["body"]["choices"][0]["message"]["content"]
+                priorities = (await self._profile(owners[meal_id])).get("priority_micronutrients", [])
+                analysis = normalize_meal_analysis(extract_json(content), priorities)
+                named = bool(analysis.get("meal_name"))
+                analysis = finalize_meal_details(analysis, [], priorities)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping unusable result for meal {meal_id}: {str(e)}")
+                failed += 1
+                continue
+            fields = meal_update_fields(analysis)
+            if named:
+                fields["meal_name"] = analysis["meal_name"]
+            fields["reanalysis"] = {"job": self.name, "model": response["body"].get("model"), "at": now}
+            operations.append(UpdateOne({"_id": ObjectId(meal_id)}, {"$set": fields}))
+        if operations:
+            await self.db.meals.bulk_write(operations, ordered=False)
+        return len(operations), failed
+
+    async def status(self) -> Dict[str, Any]:
+        job = await self.checkpoint()
+        batches = job["batches"]
+        return {
+            "job": self.name,
+            "model": job["model"],
+            "scan_complete": job["scan_complete"],
+            "batches": len(batches),
+            "requests": sum(batch["requests"] for batch in batches),
+            "applied_batches": sum(1 for batch in batches if batch["applied"]),
+            "updated": sum(batch["updated"] for batch in batches),
+            "failed": sum(batch["failed"] + batch.get("request_failures", 0) for batch in batches),
+            "statuses": {batch["batch_id"]: batch["status"] for batch in batches}
+        }
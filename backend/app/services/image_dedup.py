@@ -0,0 +1,94 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from ..config import settings
+from ..utils.metrics import metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# The 64-bit dHash is indexed as 8 one-byte bands. Two hashes that differ
+# in fewer than 8 bits must agree on at least one band, so an indexed $in
+# over the bands finds every candidate within IMAGE_DEDUP_MAX_DISTANCE.
+DHASH_BANDS = 8
+
+# Hashes with almost every bit equal (blank or flat images) match each
+# other regardless of content, so they are never deduplicated
+MIN_HASH_BITS, MAX_HASH_BITS = 4, 60
+
+# Recent candidates compared per upload
+DEDUP_CANDIDATES = 20
+
+dedup_lookups = metrics.counter(
+    "image_dedup_lookups_total",
+    "Meal photo uploads checked for near-duplicates, by result (duplicate, unique, skipped)"
+)
+dedup_distance = metrics.histogram(
+    "image_dedup_distance_bits",
+    "Hamming distance to the closest recent photo of the same user",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 24, 32)
+)
+
+_indexes_ready = False
+
+def hash_bands(dhash: str) -> List[str]:
+    """Band keys of a hex dHash, prefixed with the band position"""
+    width = len(dhash) // DHASH_BANDS
+    return [f"{band}:{dhash[band * width:(band + 1) * width]}" for band in range(DHASH_BANDS)]
+
+def hamming_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def _dedupable(dhash: Optional[str]) -> bool:
+    return bool(dhash) and MIN_HASH_BITS <= bin(int(dhash, 16)).count("1") <= MAX_HASH_BITS
+
+def hash_fields(dhash: Optional[str]) -> Dict[str, Any]:
+    """Fields to store on a new image document so later uploads can match it"""
+    if not _dedupable(dhash):
+        return {}
+    return {"dhash": dhash, "dhash_bands": hash_bands(dhash)}
+
+async def _ensure_indexes(db):
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    await db.images.create_index([("user_id", 1), ("dhash_bands", 1), ("uploaded_at", -1)])
+    _indexes_ready = True
+
+async def find_duplicate(db, user_id: ObjectId, dhash: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    The user's most similar photo uploaded within IMAGE_DEDUP_WINDOW_HOURS
+    whose dHash is at most IMAGE_DEDUP_MAX_DISTANCE bits away, or None.
+    Returns the image document's _id, dhash and vision_cache_key.
+    """
+    if not settings.IMAGE_DEDUP_ENABLED or not _dedupable(dhash):
+        dedup_lookups.inc(result="skipped")
+        return None
+    # Beyond DHASH_BANDS - 1 bits the band index could miss a match
+    max_distance = min(settings.IMAGE_DEDUP_MAX_DISTANCE, DHASH_BANDS - 1)
+    try:
+        await _ensure_indexes(db)
+        since = datetime.utcnow() - timedelta(hours=settings.IMAGE_DEDUP_WINDOW_HOURS)
+        cursor = db.images.find(
+            {"user_id": user_id, "dhash_bands": {"$in": hash_bands(dhash)}, "uploaded_at": {"$gte": since}},
+            {"dhash": 1, "vision_cache_key": 1}
+        ).sort("uploaded_at", -1).limit(DEDUP_CANDIDATES)
+        best, best_distance = None, None
+        async for candidate in cursor:
+            distance = hamming_distance(dhash, candidate["dhash"])
+            if best_distance is None or distance < best_distance:
+                best, best_distance = candidate, distance
+    except Exception as e:
+        logger.warning(f"Near-duplicate lookup failed: {str(e)}")
+        dedup_lookups.inc(result="skipped")
+        return None
+
+    if best_distance is not None:
+        dedup_distance.observe(best_distance)
+    if best is None or best_distance > max_distance:
+        dedup_lookups.inc(result="unique")
+        return None
+    dedup_lookups.inc(result="duplicate")
+    logger.info(f"Upload is a near-duplicate of image {best['_id']} ({best_distance} bits)")
+    return best
@@ -0,0 +1,85 @@
+import hashlib
+import logging
+from typing import Any, Dict
+from ..utils.blob_store import get_blob_store
+from ..utils.image_pool import image_pool
+from ..utils.image_processing import make_variant, IMAGE_VARIANTS, VARIANT_FULL
+from ..utils.metrics import metrics
+from ..utils.singleflight import SingleFlight
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+variant_builds = metrics.counter(
+    "image_variant_builds_total",
+    "Meal photo variants generated on first request, by variant and result (created, original)"
+)
+
+# Recorded under variants.<name> when a variant is the stored photo itself
+VARIANT_ORIGINAL = "original"
+
+# Concurrent first requests for the same variant build it once
+_variant_flight = SingleFlight("image_variants")
+
+def _blob_fields(image: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: image.get(field) for field in ("storage", "blob_key", "sha256", "size")}
+
+def variant_etag_hash(image: Dict[str, Any], variant: str) -> str:
+    """
+    Hash identifying a variant's content, known from the image metadata
+    alone: the stored photo's sha256 for full, otherwise derived from it and
+    the variant's size and quality, so conditional requests can be answered
+    before the variant is built
+    """
+    if variant == VARIANT_FULL:
+        return image["sha256"]
+    max_edge, quality = IMAGE_VARIANTS[variant]
+    return hashlib.sha256(f"{image['sha256']}:{variant}:{max_edge}:{quality}".encode()).hexdigest()
+
+async def _source_bytes(db, image: Dict[str, Any]) -> bytes:
+    if image.get("blob_key"):
+        return await get_blob_store(db, image.get("storage")).read(image["blob_key"])
+    # Not yet moved out by tools/migrate_image_blobs.py
+    document = await db.images.find_one({"_id": image["_id"]}, {"data": 1})
+    return bytes(document["data"])
+
+async def _build_variant(db, image: Dict[str, Any], variant: str) -> Dict[str, Any]:
+    max_edge, quality = IMAGE_VARIANTS[variant]
+    source = await _source_bytes(db, image)
+    data = await image_pool.run(f"variant_{variant}", make_variant, source, max_edge, quality)
+    if data is None:
+        # Already small enough: the variant is the stored photo itself. Only a
+        # marker is recorded, so the photo's storage fields are read at serve
+        # time and stay right after tools/migrate_image_blobs.py moves it.
+        record, fields = {VARIANT_ORIGINAL: True}, _blob_fields(image)
+        result = "original"
+    else:
+        store = get_blob_store(db)
+        key = await store.put(data)
+        record = fields = {"storage": store.name, "blob_key": key, "sha256": key, "size": len(data)}
+        result = "created"
+    await db.images.update_one({"_id": image["_id"]}, {"$set": {f"variants.{variant}": record}})
+    variant_builds.inc(variant=variant, result=result)
+    logger.info(f"Built {variant} variant of image {image['_id']}: {result}, {fields['size']} bytes")
+    return fields
+
+async def image_variant(db, image: Dict[str, Any], variant: str) -> Dict[str, Any]:
+    """
+    Blob fields (storage, blob_key, sha256, size) of a variant of an image
+    document. Variants are generated on first request, stored in the blob
+    store and recorded under the document's `variants`, so later requests
+    only read metadata. Images still stored inline have no blob_key; their
+    full variant is served from `data` by the caller.
+    """
+    if variant == VARIANT_FULL:
+        return _blob_fields(image)
+    cached = (image.get("variants") or {}).get(variant)
+    # Records without a blob_key were copied from an inline photo before
+    # original markers existed; both mean the stored photo itself
+    if cached and (cached.get(VARIANT_ORIGINAL) or not cached.get("blob_key")):
+        return _blob_fields(image)
+    if cached:
+        return cached
+    return await _variant_flight.do(
+        f"{image['_id']}:{variant}", lambda: _build_variant(db, image, variant)
+    )
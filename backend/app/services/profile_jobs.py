@@ -0,0 +1,153 @@
+import asyncio
+import copy
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from ..config import settings
+from ..utils.metrics import metrics
+from ..utils.nutrition_targets import nutrition_plan
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Values of profile.nutrition_status
+NUTRITION_PENDING = "pending"  # saved; targets/recommendations are being recomputed
+NUTRITION_READY = "ready"
+NUTRITION_FAILED = "failed"  # the job gave up; the last-known values are kept
+
+# Pending jobs picked up again after a restart, per startup
+RECOVER_LIMIT = 500
+
+jobs_total = metrics.counter(
+    "profile_jobs_total",
+    "Profile nutrition recalculation jobs by result (ready, failed, superseded, coalesced, error)"
+)
+job_seconds = metrics.histogram(
+    "profile_job_duration_seconds",
+    "Time from enqueueing a profile nutrition job to patching the profile"
+)
+jobs_queued = metrics.gauge(
+    "profile_jobs_queued",
+    "Profile nutrition jobs waiting for a worker"
+)
+
+@dataclass
+class ProfileJob:
+    db: Any
+    user_id: str
+    profile: Dict[str, Any]
+    version: str
+    enqueued: float
+
+class ProfileJobQueue:
+    """
+    In-process queue that recomputes a user's nutritional needs and dietary
+    recommendations after a profile save, off the request path.
+
+    Jobs are coalesced per user: if a user saves again before their job has
+    started, only the newest profile is computed. Each save stamps the
+    profile with a nutrition_version, and a job only patches the profile if
+    that version is still current, so a slow job never overwrites a newer save.
+    """
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._pending: Dict[str, ProfileJob] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Started {self.workers} profile job workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, db, user_id: str, profile: Dict[str, Any], version: str):
+        """Queue a recalculation for `profile`, replacing any not yet started for this user"""
+        job = ProfileJob(db, user_id, copy.deepcopy(profile), version, time.monotonic())
+        if user_id in self._pending:
+            jobs_total.inc(result="coalesced")
+        else:
+            self._queue.put_nowait(user_id)
+        self._pending[user_id] = job
+        jobs_queued.set(len(self._pending))
+        # Workers normally start with the app; make sure someone is listening
+        self.start()
+
+    async def recover(self, db):
+        """Re-queue jobs for profiles left pending by a previous process"""
+        cursor = db.user_profiles.find(
+            {"profile.nutrition_status": NUTRITION_PENDING},
+            {"profile": 1}
+        ).limit(RECOVER_LIMIT)
+        count = 0
+        async for user in cursor:
+            profile = user.get("profile") or {}
+            self.enqueue(db, str(user["_id"]), profile, profile.get("nutrition_version"))
+            count += 1
+        if count:
+            logger.info(f"Re-queued {count} pending profile nutrition jobs")
+
+    async def _worker(self):
+        while True:
+            user_id = await self._queue.get()
+            job = self._pending.pop(user_id, None)
+            jobs_queued.set(len(self._pending))
+            if job is None:
+                continue
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Profile nutrition job failed for user {user_id}: {str(e)}")
+                try:
+                    await self._patch(job, {"profile.nutrition_status": NUTRITION_FAILED}, "failed")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # Keep the worker alive; the profile stays pending and recover() retries it on restart
+                    logger.error(f"Could not mark profile nutrition failed for user {user_id}: {str(e)}")
+                    jobs_total.inc(result="error")
+
+    async def _run(self, job: ProfileJob):
+        plan = await nutrition_plan(job.profile, user_id=job.user_id)
+        await self._patch(job, {
+            "profile.nutritional_needs": plan["nutritional_needs"],
+            "profile.dietary_recommendations": plan["dietary_recommendations"],
+            "profile.nutrition_status": NUTRITION_READY
+        }, "ready")
+
+    async def _patch(self, job: ProfileJob, fields: Dict[str, Any], result: str):
+        now = datetime.utcnow()
+        patch = await job.db.user_profiles.update_one(
+            {"_id": ObjectId(job.user_id), "profile.nutrition_version": job.version},
+            {"$set": {**fields, "profile.nutrition_updated_at": now, "updated_at": now}}
+        )
+        if patch.matched_count == 0:
+            # A newer save owns the profile now; its own job will patch it
+            result = "superseded"
+        jobs_total.inc(result=result)
+        job_seconds.observe(time.monotonic() - job.enqueued)
+
+# Shared queue for the app; started and stopped in main.py
+profile_jobs = ProfileJobQueue(settings.PROFILE_JOB_WORKERS)
+
+def nutrition_status(profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """What the frontend needs to know about a profile's nutrition targets"""
+    profile = profile or {}
+    return {
+        # Profiles saved before jobs existed were computed inline, so they're ready
+        "status": profile.get("nutrition_status", NUTRITION_READY),
+        "updated_at": profile.get("nutrition_updated_at"),
+        "nutritional_needs": profile.get("nutritional_needs"),
+        "dietary_recommendations": profile.get("dietary_recommendations", [])
+    }
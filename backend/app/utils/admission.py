@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from app.utils.metrics import metrics
+
+# Lanes in priority order: every queued interactive call is admitted
+# before any queued background call
+LANE_INTERACTIVE = "interactive"
+LANE_BACKGROUND = "background"
+LANES = (LANE_INTERACTIVE, LANE_BACKGROUND)
+
+ANONYMOUS_USER = "anonymous"
+
+queue_depth = metrics.gauge(
+    "gpt_admission_queue_depth",
+    "Calls waiting for a GPT concurrency slot, by lane"
+)
+active_calls = metrics.gauge(
+    "gpt_admission_active",
+    "Calls currently holding a GPT concurrency slot"
+)
+wait_seconds = metrics.histogram(
+    "gpt_admission_wait_seconds",
+    "Time spent waiting for a GPT concurrency slot, by lane"
+)
+
+class AdmissionController:
+    """
+    Caps how many upstream calls run at once and decides who goes next.
+
+    Waiting calls are ordered by lane first, then by start-time fair queuing
+    within the lane: each user's calls get virtual start tags that advance by
+    1/weight per call, so a user with a burst of uploads cannot crowd out
+    everyone else, and heavier weights get proportionally more slots.
+    """
+    def __init__(self, name: str, max_concurrency: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._active = 0
+        self._queue: List[list] = []  # heap of [lane_rank, start_tag, seq, future, lane]
+        self._virtual_time: Dict[str, float] = {lane: 0.0 for lane in LANES}
+        self._user_finish: Dict[Tuple[str, str], float] = {}
+        self._depth: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._seq = itertools.count()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def queued(self, lane: Optional[str] = None) -> int:
+        if lane is None:
+            return sum(self._depth.values())
+        return self._depth[lane]
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str] = None, lane: str = LANE_INTERACTIVE, weight: float = 1.0):
+        """Hold one concurrency slot for the duration of the block; yields the queue wait in seconds"""
+        waited = await self.acquire(user_id, lane, weight)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    async def acquire(self, user_id: Optional[str] = None, lane: str = LANE_INTERACTIVE, weight: float = 1.0) -> float:
+        """Wait for a slot and return how long that took, in seconds"""
+        if lane not in LANES:
+            raise ValueError(f"Unknown admission lane: {lane}")
+
+        if self._active < self.max_concurrency and self.queued() == 0:
+            self._active += 1
+            active_calls.set(self._active, controller=self.name)
+            wait_seconds.observe(0.0, lane=lane)
+            return 0.0
+
+        user = user_id or ANONYMOUS_USER
+        start_tag = max(self._virtual_time[lane], self._user_finish.get((lane, user), 0.0))
+        self._user_finish[(lane, user)] = start_tag + 1.0 / max(weight, 0.01)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [LANES.index(lane), start_tag, next(self._seq), future, lane]
+        heapq.heappush(self._queue, entry)
+        self._set_depth(lane, 1)
+
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled: pass it on
+                self.release()
+            else:
+                future.cancel()
+                self._set_depth(lane, -1)
+            raise
+
+        waited = time.monotonic() - started
+        wait_seconds.observe(waited, lane=lane)
+        return waited
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free and nobody is waiting; never queues"""
+        if self._active >= self.max_concurrency or self.queued():
+            return False
+        self._active += 1
+        active_calls.set(self._active, controller=self.name)
+        return True
+
+    def release(self):
+        """Free a slot, handing it straight to the next waiter if there is one"""
+        while self._queue:
+            _, start_tag, _, future, lane = heapq.heappop(self._queue)
+            if future.done():
+                # Cancelled while queued
+                continue
+            self._set_depth(lane, -1)
+            self._virtual_time[lane] = start_tag
+            future.set_result(None)
+            return
+        self._active -= 1
+        active_calls.set(self._active, controller=self.name)
+        self._prune_idle_users()
+
+    def _set_depth(self, lane: str, delta: int):
+        self._depth[lane] += delta
+        queue_depth.set(self._depth[lane], controller=self.name, lane=lane)
+
+    def _prune_idle_users(self):
+        # With nothing queued the fairness history no longer matters
+        if self.queued() == 0 and self._user_finish:
+            self._user_finish.clear()
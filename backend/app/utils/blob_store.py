@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from pymongo.errors import DuplicateKeyError
+from app.config import settings
+from app.utils.metrics import metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+STORE_GRIDFS = "gridfs"
+STORE_LOCAL = "local"
+
+# GridFS bucket holding meal photos (image_blobs.files / image_blobs.chunks)
+GRIDFS_BUCKET = "image_blobs"
+
+blob_bytes = metrics.counter(
+    "blob_store_bytes_total",
+    "Bytes written to and read from the blob store, by backend and direction"
+)
+blob_ops = metrics.counter(
+    "blob_store_operations_total",
+    "Blob store operations by backend, operation and result"
+)
+
+class BlobNotFound(Exception):
+    """No blob is stored under the requested key"""
+
+def blob_key(data: bytes) -> str:
+    """Content address of a blob: identical bytes share one stored copy"""
+    return hashlib.sha256(data).hexdigest()
+
+@dataclass
+class BlobReader:
+    """An open blob: its total size up front, then the requested bytes in chunks"""
+    key: str
+    size: int
+    chunks: AsyncIterator[bytes]
+
+async def _limit(chunks: AsyncIterator[bytes], length: Optional[int]) -> AsyncIterator[bytes]:
+    """Stop a chunk iterator after `length` bytes"""
+    remaining = length
+    async for chunk in chunks:
+        if remaining is not None:
+            chunk = chunk[:remaining]
+            remaining -= len(chunk)
+        if chunk:
+            yield chunk
+        if remaining == 0:
+            break
+
+class BlobStore:
+    """
+    Content-addressed storage for image bytes. Keys are the sha256 of the
+    content, so put() is idempotent and never overwrites different data.
+    Subclasses implement _put, _open and delete.
+    """
+    name = "base"
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+
+    async def put(self, data: bytes) -> str:
+        """Store `data` (if not already stored) and return its key"""
+        key = blob_key(data)
+        try:
+            created = await self._put(key, data)
+        except Exception:
+            blob_ops.inc(backend=self.name, op="put", result="error")
+            raise
+        blob_ops.inc(backend=self.name, op="put", result="created" if created else "exists")
+        if created:
+            blob_bytes.inc(len(data), backend=self.name, direction="write")
+        return key
+
+    async def open(self, key: str, start: int = 0, length: Optional[int] = None) -> BlobReader:
+        """
+        Open a stored blob for a chunked read of `length` bytes from `start`
+        (to the end by default); raises BlobNotFound
+        """
+        try:
+            reader = await self._open(key, start)
+        except BlobNotFound:
+            blob_ops.inc(backend=self.name, op="open", result="not_found")
+            raise
+        blob_ops.inc(backend=self.name, op="open", result="ok")
+        return BlobReader(reader.key, reader.size, self._counted(_limit(reader.chunks, length)))
+
+    async def read(self, key: str) -> bytes:
+        """Whole blob in memory; prefer open() when serving it"""
+        reader = await self.open(key)
+        return b"".join([chunk async for chunk in reader.chunks])
+
+    async def _counted(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async for chunk in chunks:
+            blob_bytes.inc(len(chunk), backend=self.name, direction="read")
+            yield chunk
+
+    async def _put(self, key: str, data: bytes) -> bool:
+        raise NotImplementedError
+
+    async def _open(self, key: str, start: int) -> BlobReader:
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+class GridFSBlobStore(BlobStore):
+    """Blobs in a GridFS bucket of the app database, with the key as the file id"""
+    name = STORE_GRIDFS
+
+    def __init__(self, db, chunk_size: int, bucket_name: str = GRIDFS_BUCKET):
+        super().__init__(chunk_size)
+        self.bucket = AsyncIOMotorGridFSBucket(db, bucket_name=bucket_name, chunk_size_bytes=chunk_size)
+        self.files = db[f"{bucket_name}.files"]
+
+    async def _put(self, key: str, data: bytes) -> bool:
+        if await self.files.find_one({"_id": key}, {"_id": 1}):
+            return False
+        try:
+            # GridFS splits the upload into chunk_size documents as it writes
+            await self.bucket.upload_from_stream_with_id(key, key, data)
+        except DuplicateKeyError:
+            # A concurrent upload of the same content won the race
+            return False
+        return True
+
+    async def _open(self, key: str, start: int) -> BlobReader:
+        try:
+            grid_out = await self.bucket.open_download_stream(key)
+        except NoFile:
+            raise BlobNotFound(key)
+        if start:
+            # Only the chunks from `start` on are fetched
+            grid_out.seek(start)
+
+        async def chunks():
+            while True:
+                chunk = await grid_out.readchunk()
+                if not chunk:
+                    break
+                yield chunk
+
+        return BlobReader(key, grid_out.length, chunks())
+
+    async def delete(self, key: str):
+        try:
+            await self.bucket.delete(key)
+        except NoFile:
+            pass
+
+class LocalBlobStore(BlobStore):
+    """
+    Blobs as files under `root`, sharded by key prefix (ab/cd/abcd...).
+    Writes go to a temporary file that is renamed into place, so a reader
+    never sees a partial blob. File I/O runs in a thread.
+    """
+    name = STORE_LOCAL
+
+    def __init__(self, root: str, chunk_size: int):
+        super().__init__(chunk_size)
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def _write(self, key: str, data: bytes) -> bool:
+        path = self.path(key)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                view = memoryview(data)
+                for start in range(0, len(view), self.chunk_size):
+                    f.write(view[start:start + self.chunk_size])
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return True
+
+    async def _put(self, key: str, data: bytes) -> bool:
+        return await asyncio.to_thread(self._write, key, data)
+
+    async def _open(self, key: str, start: int) -> BlobReader:
+        path = self.path(key)
+        try:
+            f = await asyncio.to_thread(open, path, "rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        size = os.fstat(f.fileno()).st_size
+        f.seek(start)
+
+        async def chunks():
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(f.read, self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                f.close()
+
+        return BlobReader(key, size, chunks())
+
+    async def delete(self, key: str):
+        try:
+            await asyncio.to_thread(os.unlink, self.path(key))
+        except FileNotFoundError:
+            pass
+
+_local_store: Optional[LocalBlobStore] = None
+
+def get_blob_store(db, backend: Optional[str] = None) -> BlobStore:
+    """The configured blob store (BLOB_STORE), or `backend` if given"""
+    global _local_store
+    backend = backend or settings.BLOB_STORE
+    if backend == STORE_GRIDFS:
+        return GridFSBlobStore(db, settings.BLOB_CHUNK_SIZE)
+    if backend == STORE_LOCAL:
+        if _local_store is None:
+            _local_store = LocalBlobStore(settings.BLOB_STORE_LOCAL_DIR, settings.BLOB_CHUNK_SIZE)
+        return _local_store
+    raise ValueError(f"Unknown blob store: {backend}")
@@ -0,0 +1,289 @@
+import copy
+import hashlib
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from app.config import settings
+from app.utils.metrics import metrics
+from app.utils.profile_mappings import map_health_conditions, map_micronutrients
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Bump when the details prompt or model changes so stale analyses are not served
+DETAILS_CACHE_VERSION = "v2"
+DETAILS_CACHE_COLLECTION = "meal_details_cache"
+
+# "basmati rice (1 cup)" as the frontend lists detected ingredients; the name
+# is the last few words of the clause before the parenthesis
+_INGREDIENT = re.compile(r"([^(),;:.!?]+?)\s*\(([^)]{1,40})\)")
+_NAME_WORDS = 4
+# "1 1/2 cups", "0.5 tbsp", "2 pieces", "150g"
+_QUANTITY = re.compile(r"(\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?)\s*([a-z]+)?")
+_WORD = re.compile(r"[a-z]+")
+
+_UNITS = {
+    "cup": "cup", "cups": "cup", "tbsp": "tbsp", "tablespoon": "tbsp", "tablespoons": "tbsp",
+    "tsp": "tsp", "teaspoon": "tsp", "teaspoons": "tsp", "g": "g", "gram": "g", "grams": "g",
+    "kg": "kg", "oz": "oz", "ounce": "oz", "ounces": "oz", "ml": "ml", "l": "l",
+    "piece": "piece", "pieces": "piece", "slice": "slice", "slices": "slice", "bowl": "bowl",
+    "bowls": "bowl", "plate": "plate", "plates": "plate", "wedge": "piece", "wedges": "piece"
+}
+
+# Words in user answers that change the analysis besides quantities
+_METHOD_WORDS = frozenset({
+    "fried", "deep", "baked", "boiled", "roasted", "grilled", "steamed", "sauteed", "raw",
+    "ghee", "butter", "oil", "cream", "coconut", "sugar", "jaggery", "honey", "salt", "skim", "whole"
+})
+_STOP_WORDS = frozenset({
+    "of", "and", "with", "the", "a", "an", "some", "fresh", "plain", "garnish", "i", "ve", "can", "see",
+    "there", "is", "are", "it", "looks", "like", "your", "you", "how", "much", "many", "did", "what", "was"
+})
+
+AGE_BANDS = (18, 30, 45, 60)
+
+cache_lookups = metrics.counter(
+    "details_cache_lookups_total",
+    "Meal details cache lookups by tier (memory, mongo), match (exact, similar) and result"
+)
+cache_similarity = metrics.histogram(
+    "details_cache_similarity",
+    "Similarity of the best near-match found for a meal details lookup",
+    buckets=(0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95, 1.0)
+)
+cache_entries = metrics.gauge(
+    "details_cache_memory_entries",
+    "Entries currently held in the in-process meal details cache"
+)
+
+def _number(text: str) -> float:
+    total = 0.0
+    for part in text.split():
+        if "/" in part:
+            numerator, denominator = part.split("/")
+            total += float(numerator) / float(denominator) if float(denominator) else 0.0
+        else:
+            total += float(part)
+    return total
+
+def _bucket(quantity: float) -> int:
+    """Quantize a quantity into roughly 25% wide log buckets, so 1 cup and 1.1 cups match"""
+    return round(math.log(quantity) / math.log(1.25)) if quantity > 0 else 0
+
+def _portion_tokens(text: str) -> List[str]:
+    tokens = []
+    for number, unit in _QUANTITY.findall(text):
+        unit = _UNITS.get(unit or "", "unit")
+        tokens.append(f"{unit}:{_bucket(_number(number))}")
+    return tokens
+
+def _singular(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+def _ingredient_name(text: str) -> str:
+    words = [_singular(word) for word in _WORD.findall(text) if word not in _STOP_WORDS]
+    return " ".join(words[-_NAME_WORDS:])
+
+@dataclass(frozen=True)
+class DetailsSignature:
+    """What a meal details analysis depends on, canonicalized"""
+    key: str  # exact-match key: tokens plus profile class
+    profile_class: str
+    ingredients: FrozenSet[str]  # ingredient names only
+    tokens: FrozenSet[str]  # ingredients with portions, plus facts from the user's answers
+
+def _listed(values) -> str:
+    if isinstance(values, str):
+        values = [values]
+    return ",".join(sorted({str(item).strip().lower() for item in values or [] if str(item).strip()}))
+
+def profile_class(user_profile: Dict[str, Any]) -> str:
+    """
+    The profile fields that change a details analysis: age band, sex,
+    conditions and priority micronutrients, plus the diet, foods to avoid and
+    goals that shape its recommended recipes and suggestions
+    """
+    profile = user_profile.get("profile") or user_profile
+    try:
+        age = int(profile.get("age") or 0)
+    except (TypeError, ValueError):
+        age = 0
+    band = sum(1 for limit in AGE_BANDS if age >= limit)
+    conditions = sorted(str(item).lower() for item in map_health_conditions(profile.get("personal_health_history") or []))
+    micronutrients = sorted(str(item).lower() for item in map_micronutrients(profile.get("priority_micronutrients") or []))
+    return "|".join([
+        f"age{band}", str(profile.get("sex", "")).lower(), ",".join(conditions), ",".join(micronutrients),
+        _listed(profile.get("dietary_preferences")), _listed(profile.get("foods_to_avoid")),
+        _listed(profile.get("health_goals"))
+    ])
+
+def details_signature(conversation_history: List[Dict[str, Any]], user_profile: Dict[str, Any]) -> DetailsSignature:
+    """
+    Canonical signature of a details request: the ingredients and portions
+    the assistant listed, the quantities and preparation words in the user's
+    answers, and the profile class. Word order, casing, plurals and small
+    portion differences don't change it.
+    """
+    ingredients, tokens = set(), set()
+    for turn in conversation_history:
+        content = str(turn.get("content") or "").lower()
+        if turn.get("role") == "user":
+            tokens.update(f"answer:{token}" for token in _portion_tokens(content))
+            tokens.update(f"answer:{word}" for word in _WORD.findall(content) if word in _METHOD_WORDS)
+            continue
+        for name, portion in _INGREDIENT.findall(content):
+            name = _ingredient_name(name)
+            if not name:
+                continue
+            ingredients.add(name)
+            tokens.add(f"ingredient:{name}")
+            tokens.update(f"portion:{name}:{token}" for token in _portion_tokens(portion))
+
+    klass = profile_class(user_profile)
+    digest = hashlib.sha256(DETAILS_CACHE_VERSION.encode())
+    digest.update(klass.encode())
+    digest.update("\n".join(sorted(tokens)).encode())
+    return DetailsSignature(digest.hexdigest(), klass, frozenset(ingredients), frozenset(tokens))
+
+def similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Jaccard similarity of two token sets"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+class MealDetailsCache:
+    """
+    Cache for analyze_meal_details results, keyed by DetailsSignature.
+
+    Lookups try the exact key first (in-process LRU, then a Mongo collection
+    whose TTL index expires entries server-side), then the most similar
+    stored entry with the same profile class and an overlapping ingredient,
+    accepted if its token similarity reaches DETAILS_CACHE_SIMILARITY.
+    Requests without any recognisable ingredient are never cached.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: int, threshold: float, candidates: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.candidates = candidates
+        self._entries: "OrderedDict[str, Tuple[float, DetailsSignature, Dict[str, Any]]]" = OrderedDict()
+        self._indexes_ready = False
+
+    async def _ensure_indexes(self, db):
+        if self._indexes_ready:
+            return
+        collection = db[DETAILS_CACHE_COLLECTION]
+        await collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        await collection.create_index([("profile_class", 1), ("ingredients", 1)])
+        self._indexes_ready = True
+
+    def _remember(self, signature: DetailsSignature, analysis: Dict[str, Any]):
+        self._entries[signature.key] = (time.monotonic() + self.ttl_seconds, signature, analysis)
+        self._entries.move_to_end(signature.key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        cache_entries.set(len(self._entries))
+
+    def _memory_get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _, analysis = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            cache_entries.set(len(self._entries))
+            return None
+        self._entries.move_to_end(key)
+        return analysis
+
+    def _memory_nearest(self, signature: DetailsSignature) -> Tuple[float, Optional[Dict[str, Any]]]:
+        best, best_analysis = 0.0, None
+        now = time.monotonic()
+        for expires_at, stored, analysis in self._entries.values():
+            if expires_at <= now or stored.profile_class != signature.profile_class:
+                continue
+            if not stored.ingredients & signature.ingredients:
+                continue
+            score = similarity(stored.tokens, signature.tokens)
+            if score > best:
+                best, best_analysis = score, analysis
+        return best, best_analysis
+
+    async def get(self, db, signature: DetailsSignature) -> Optional[Dict[str, Any]]:
+        """Look up a cached analysis, returning a copy the caller may modify"""
+        if not signature.ingredients:
+            return None
+
+        analysis = self._memory_get(signature.key)
+        if analysis is not None:
+            cache_lookups.inc(tier="memory", match="exact", result="hit")
+            return copy.deepcopy(analysis)
+
+        try:
+            collection = db[DETAILS_CACHE_COLLECTION]
+            document = await collection.find_one({"_id": signature.key})
+            if document:
+                cache_lookups.inc(tier="mongo", match="exact", result="hit")
+                self._remember(signature, document["analysis"])
+                return copy.deepcopy(document["analysis"])
+
+            # Near matches: the best of the in-process entries and the newest
+            # stored candidates that share the profile class and an ingredient
+            best, best_analysis = self._memory_nearest(signature)
+            tier = "memory"
+            cursor = collection.find(
+                {"profile_class": signature.profile_class, "ingredients": {"$in": sorted(signature.ingredients)}},
+                {"tokens": 1, "analysis": 1}
+            ).sort("created_at", -1).limit(self.candidates)
+            async for candidate in cursor:
+                score = similarity(frozenset(candidate.get("tokens", [])), signature.tokens)
+                if score > best:
+                    best, best_analysis, tier = score, candidate["analysis"], "mongo"
+        except Exception as e:
+            logger.warning(f"Meal details cache lookup failed: {str(e)}")
+            return None
+
+        if best_analysis is not None:
+            cache_similarity.observe(best)
+        if best_analysis is None or best < self.threshold:
+            cache_lookups.inc(tier="all", match="similar", result="miss")
+            return None
+        cache_lookups.inc(tier=tier, match="similar", result="hit")
+        logger.info(f"Meal details cache near-match with similarity {best:.2f}")
+        return copy.deepcopy(best_analysis)
+
+    async def set(self, db, signature: DetailsSignature, analysis: Dict[str, Any]):
+        """Store an analysis in both tiers"""
+        if not signature.ingredients:
+            return
+        stored = copy.deepcopy(analysis)
+        self._remember(signature, stored)
+        try:
+            await self._ensure_indexes(db)
+            await db[DETAILS_CACHE_COLLECTION].replace_one(
+                {"_id": signature.key},
+                {
+                    "_id": signature.key,
+                    "profile_class": signature.profile_class,
+                    "ingredients": sorted(signature.ingredients),
+                    "tokens": sorted(signature.tokens),
+                    "analysis": stored,
+                    "created_at": datetime.utcnow()
+                },
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Failed to persist meal details cache entry: {str(e)}")
+
+# Create global meal details cache instance
+details_cache = MealDetailsCache(
+    max_entries=settings.DETAILS_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.DETAILS_CACHE_TTL_SECONDS,
+    threshold=settings.DETAILS_CACHE_SIMILARITY,
+    candidates=settings.DETAILS_CACHE_CANDIDATES
+)
@@ -2,13 +2,28 @@ import asyncio
 import base64
 import json
 import os
-import re
+import time
 from datetime import datetime
 from dotenv import load_dotenv
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Optional, Tuple
 import httpx
 from app.config import settings
-import openai
+from app.utils.openai_client import openai_client
+from app.utils.singleflight import SingleFlight, request_fingerprint
+from app.utils.json_stream import IncrementalJSONParser
+from app.utils.json_extract import extract_json, json_response_format
+from app.utils.token_budget import compact_history, count_message_tokens, fit_history, log_usage
+from app.utils.gpt_logging import log_body
+from app.utils.gpt_instrumentation import (
+    GPTCall, record_call, OUTCOME_SUCCESS, OUTCOME_ERROR, OUTCOME_CIRCUIT_OPEN,
+    OUTCOME_CANCELLED, OUTCOME_COALESCED
+)
+from app.utils.admission import AdmissionController, LANE_INTERACTIVE, LANE_BACKGROUND
+from app.utils.resilience import CircuitBreaker, CircuitOpenError, hedged
+from app.utils.metrics import metrics
+from app.utils.vision_routing import (
+    escalation_reason, record_route, ROUTE_DIRECT, ROUTE_FAST, ROUTE_ESCALATED
+)
 
 # Load environment variables
 load_dotenv()
@@ -19,209 +34,318 @@ if not api_key:
     print("Warning: OPENAI_API_KEY not found in environment variables")
 else:
     print("OpenAI API key loaded successfully")
-    print(f"API Key prefix: {api_key[:10]}...")  # Only print first 10 chars for security
-    openai.api_key = api_key
 
-def query_gpt(message: str):
+# Identical completions already in flight are shared rather than re-issued
+gpt_singleflight = SingleFlight("chat_completions")
+
+# Caps concurrent upstream calls per worker, with per-user fair queuing and
+# an interactive lane that is served ahead of background work
+gpt_admission = AdmissionController("openai", settings.GPT_MAX_CONCURRENCY)
+
+# Fails calls fast with a 503 while the upstream error rate is high
+gpt_breaker = CircuitBreaker(
+    "openai",
+    failure_rate_threshold=settings.GPT_BREAKER_FAILURE_RATE,
+    min_calls=settings.GPT_BREAKER_MIN_CALLS,
+    window_seconds=settings.GPT_BREAKER_WINDOW_SECONDS,
+    open_seconds=settings.GPT_BREAKER_OPEN_SECONDS
+)
+
+# Model behind the meal photo analysis
+VISION_MODEL = "chatgpt-4o-latest"
+
+# Upstream statuses that count against the breaker and are worth retrying
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+upstream_latency = metrics.histogram(
+    "gpt_upstream_latency_seconds",
+    "Latency of single upstream chat completion attempts, by model"
+)
+
+class UpstreamError(Exception):
+    """Non-200 response from the OpenAI API"""
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        super().__init__(f"GPT API error: {message}")
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in RETRYABLE_STATUS
+
+async def chat_completion(
+    payload: Dict[str, Any],
+    user_id: Optional[str] = None,
+    lane: str = LANE_INTERACTIVE,
+    endpoint: str = "unknown"
+) -> Dict[str, Any]:
+    """
+    Send a chat completion request through the shared, pooled OpenAI client.
+    Concurrent calls with an identical model, messages and parameters are
+    coalesced into a single upstream request, which then waits for a slot
+    from the admission controller on behalf of `user_id` in `lane`.
+    Latency, tokens and cost are recorded under `endpoint`.
+    Returns the decoded response body.
+    """
+    call = GPTCall(endpoint, payload.get("model", "unknown"))
+    key = request_fingerprint(payload)
+    try:
+        result = await gpt_singleflight.do(key, lambda: _post_chat_completion(payload, user_id, lane, call))
+    except CircuitOpenError:
+        record_call(call, OUTCOME_CIRCUIT_OPEN)
+        raise
+    except asyncio.CancelledError:
+        record_call(call, OUTCOME_CANCELLED)
+        raise
+    except Exception:
+        record_call(call, OUTCOME_ERROR)
+        raise
+    # Only the call that went upstream accounts for the tokens
+    record_call(call, OUTCOME_SUCCESS if call.attempts else OUTCOME_COALESCED, result)
+    return result
+
+def _hedge_delay(model: str) -> Optional[float]:
+    """How long to wait before hedging a call to `model`, or None to not hedge"""
+    if not settings.GPT_HEDGE_ENABLED:
+        return None
+    if settings.GPT_HEDGE_DELAY_SECONDS > 0:
+        return settings.GPT_HEDGE_DELAY_SECONDS
+    # Default to the observed p95 once there are enough samples to trust it
+    if upstream_latency.count(model=model) < settings.GPT_HEDGE_MIN_SAMPLES:
+        return None
+    return upstream_latency.quantile(0.95, model=model)
+
+async def _send_once(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """One upstream attempt; raises UpstreamError on a non-200 response"""
+    client = await openai_client.get_client()
+    started = time.monotonic()
+    response = await client.post("/chat/completions", json=payload)
+    upstream_latency.observe(time.monotonic() - started, model=payload.get("model", "unknown"))
+    
+    print(f"Response status code: {response.status_code}")
+    
+    if response.status_code != 200:
+        error_text = response.text
+        print(f"GPT API error: {error_text}")
+        raise UpstreamError(response.status_code, error_text)
+    
+    return response.json()
+
+async def _post_chat_completion(payload: Dict[str, Any], user_id: Optional[str], lane: str, call: GPTCall) -> Dict[str, Any]:
+    """
+    Issue a chat completion upstream once admitted. Timeouts, transport errors
+    and 429/5xx responses are retried with exponential backoff and reported to
+    the circuit breaker; slow attempts may be hedged with a second one.
+    """
+    # Don't queue for a slot just to be rejected
+    gpt_breaker.check()
+    delay = _hedge_delay(payload.get("model", "unknown"))
+    backoff = settings.GPT_RETRY_BACKOFF_SECONDS
+    
+    async with gpt_admission.slot(user_id, lane) as waited:
+        call.queue_wait = waited
+        started = time.monotonic()
+        for attempt in range(settings.GPT_MAX_RETRIES + 1):
+            gpt_breaker.before_call()
+            call.attempts += 1
+            try:
+                result = await hedged(lambda: _send_once(payload), delay, name="chat_completions", admission=gpt_admission)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                gpt_breaker.record_failure()
+                error = Exception(f"GPT request failed: {type(e).__name__}: {str(e)}")
+            except UpstreamError as e:
+                if not e.retryable:
+                    # The request itself was bad; upstream is healthy
+                    gpt_breaker.record_success()
+                    raise
+                gpt_breaker.record_failure()
+                error = e
+            else:
+                gpt_breaker.record_success()
+                return result
+            finally:
+                call.upstream_seconds = time.monotonic() - started
+            
+            if attempt == settings.GPT_MAX_RETRIES:
+                print(f"Failed after {attempt + 1} attempts: {str(error)}")
+                raise error
+            print(f"Attempt {attempt + 1} failed, retrying in {backoff} seconds...")
+            await asyncio.sleep(backoff)
+            backoff *= 2  # Exponential backoff
+
+async def stream_chat_completion(
+    payload: Dict[str, Any],
+    user_id: Optional[str] = None,
+    lane: str = LANE_INTERACTIVE,
+    endpoint: str = "unknown"
+) -> AsyncIterator[str]:
+    """
+    Stream a chat completion through the shared client, yielding the content
+    deltas as they arrive. Streams are never coalesced, retried or hedged;
+    the admission slot is held until the stream ends.
+    """
+    call = GPTCall(endpoint, payload.get("model", "unknown"))
+    usage_chunk = None
+    outcome = OUTCOME_ERROR
+    try:
+        gpt_breaker.check()
+        client = await openai_client.get_client()
+        async with gpt_admission.slot(user_id, lane) as waited:
+            call.queue_wait = waited
+            started = time.monotonic()
+            gpt_breaker.before_call()
+            call.attempts = 1
+            try:
+                # Ask for a final usage chunk so streamed calls report tokens too
+                request = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+                async with client.stream("POST", "/chat/completions", json=request) as response:
+                    print(f"Response status code: {response.status_code}")
+                    
+                    if response.status_code != 200:
+                        error_text = (await response.aread()).decode("utf-8", errors="replace")
+                        print(f"GPT API error: {error_text}")
+                        raise UpstreamError(response.status_code, error_text)
+                    gpt_breaker.record_success()
+                    
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        if chunk.get("usage"):
+                            usage_chunk = chunk
+                            log_usage("stream", call.model, chunk)
+                        choices = chunk.get("choices") or []
+                        if choices:
+                            delta = choices[0].get("delta", {}).get("content")
+                            if delta:
+                                yield delta
+                outcome = OUTCOME_SUCCESS
+            except UpstreamError as e:
+                if e.retryable:
+                    gpt_breaker.record_failure()
+                else:
+                    gpt_breaker.record_success()
+                raise
+            except (httpx.TimeoutException, httpx.TransportError):
+                gpt_breaker.record_failure()
+                raise
+            finally:
+                call.upstream_seconds = time.monotonic() - started
+    except CircuitOpenError:
+        outcome = OUTCOME_CIRCUIT_OPEN
+        raise
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = OUTCOME_CANCELLED
+        raise
+    finally:
+        record_call(call, outcome, usage_chunk)
+
+async def query_gpt(
+    message: str,
+    user_id: Optional[str] = None,
+    lane: str = LANE_INTERACTIVE,
+    endpoint: str = "query"
+) -> str:
     try:
         print("\n=== Starting GPT Query ===")
         print("Sending request to GPT-4...")
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": message}],
-        )
+        response = await chat_completion({
+            "model": "gpt-4",
+            "messages": [{"role": "user", "content": message}]
+        }, user_id=user_id, lane=lane, endpoint=endpoint)
         print("Received response from GPT-4")
-        return response.choices[0].message.content
+        return response["choices"][0]["message"]["content"]
     except Exception as e:
         print(f"Error in GPT query: {str(e)}")
         raise e
 
-async def calculate_nutritional_needs(profile_data):
+async def generate_dietary_recommendations(
+    profile_data: Dict[str, Any],
+    nutritional_needs: Dict[str, Any],
+    user_id: Optional[str] = None
+) -> List[str]:
     """
-    Calculate personalized nutritional needs and dietary recommendations using GPT-4.
+    Write 3-5 personalized dietary recommendations with GPT-4o-mini.
+    The numeric targets come from the local nutrition_targets engine and are
+    given to the model as context only. Runs in the background admission lane,
+    behind interactive meal analysis.
     """
     try:
-        print("\n=== GPT-MINI GENERATING NUTRITIONAL NEEDS AND RECOMMENDATIONS ===")
-        print(f"Profile data received: {json.dumps(profile_data, default=str)}")
+        print("\n=== GPT-MINI GENERATING DIETARY RECOMMENDATIONS ===")
+        log_body("Profile data received", profile_data)
+        
+        def listed(field: str) -> str:
+            return ', '.join(str(item) for item in profile_data.get(field) or []) or 'None'
         
-        # Construct the prompt for GPT-4
-        prompt = f"""As a professional nutritionist, calculate personalized daily nutritional targets and provide dietary recommendations for the following individual:
+        needs = nutritional_needs
+        prompt = f"""As a professional nutritionist, provide dietary recommendations for the following individual:
 
 Personal Information:
-- Age: {profile_data['age']} years
-- Sex: {profile_data['sex']}
-- Height: {profile_data['height']['value']} {profile_data['height']['unit']}
-- Weight: {profile_data['weight']['value']} {profile_data['weight']['unit']}
-- Activity Level: {profile_data['activity_level']}
+- Age: {profile_data.get('age')} years
+- Sex: {profile_data.get('sex')}
+- Activity Level: {profile_data.get('activity_level')}
 
 Health Profile:
-- Personal Health History: {', '.join(profile_data['personal_health_history'])}
-- Family Health History: {', '.join(profile_data['family_health_history'])}
-- Priority Micronutrients: {', '.join(profile_data['priority_micronutrients'])}
-- Dietary Preferences: {', '.join(profile_data['dietary_preferences'])}
-- Health Goals: {', '.join(profile_data['health_goals'])}
-
-Please provide:
-1. Personalized daily nutritional targets
-2. 3-5 specific dietary recommendations based on the individual's profile
-
-Please provide the response in the following JSON format:
+- Personal Health History: {listed('personal_health_history')}
+- Family Health History: {listed('family_health_history')}
+- Priority Micronutrients: {listed('priority_micronutrients')}
+- Dietary Preferences: {listed('dietary_preferences')}
+- Foods to Avoid: {listed('foods_to_avoid')}
+- Health Goals: {listed('health_goals')}
+
+Daily Targets (already calculated, do not change them):
+- Calories: {needs['calories']['min']}-{needs['calories']['max']} kcal
+- Protein: {needs['macros']['protein']['min']}-{needs['macros']['protein']['max']} g
+- Carbs: {needs['macros']['carbs']['min']}-{needs['macros']['carbs']['max']} g
+- Fats: {needs['macros']['fats']['min']}-{needs['macros']['fats']['max']} g
+- Fiber: {needs['other_nutrients']['fiber']['min']}-{needs['other_nutrients']['fiber']['max']} g
+- Sugar: up to {needs['other_nutrients']['sugar']['max']} g
+- Sodium: up to {needs['other_nutrients']['sodium']['max']} mg
+
+Provide 3-5 specific dietary recommendations that help this individual meet these targets, in the following JSON format:
 {{
-    "nutritional_needs": {{
-        "calories": {{
-            "min": <integer>,
-            "max": <integer>
-        }},
-        "macros": {{
-            "protein": {{
-                "min": <integer>,
-                "max": <integer>,
-                "unit": "g"
-            }},
-            "carbs": {{
-                "min": <integer>,
-                "max": <integer>,
-                "unit": "g"
-            }},
-            "fats": {{
-                "min": <integer>,
-                "max": <integer>,
-                "unit": "g"
-            }}
-        }},
-        "other_nutrients": {{
-            "fiber": {{
-                "min": <integer>,
-                "max": <integer>,
-                "unit": "g"
-            }},
-            "sugar": {{
-                "min": <integer>,
-                "max": <integer>,
-                "unit": "g"
-            }},
-            "sodium": {{
-                "min": <integer>,
-                "max": <integer>,
-                "unit": "mg"
-            }}
-        }}
-    }},
     "dietary_recommendations": [
         "Recommendation 1 - specific to user's health goals and dietary preferences",
         "Recommendation 2 - specific to user's health conditions and micronutrient needs",
-        "Recommendation 3 - specific to user's activity level and age",
-        "Recommendation 4 - specific to user's dietary preferences and health goals",
-        "Recommendation 5 - specific to user's health history and goals"
+        "Recommendation 3 - specific to user's activity level and age"
     ]
 }}
 
-Ensure all values are based on scientific research and dietary guidelines for the individual's age group and health profile. The dietary recommendations should be specific to the user's unique profile and not generic advice."""
+The dietary recommendations should be specific to the user's unique profile and not generic advice."""
 
-        print("\n=== SENDING REQUEST TO GPT-MINI ===")
-        print(f"Using model: gpt-4o-mini-2024-07-18")
-        print(f"Temperature: 0.7")
-        print(f"Max tokens: 1000")
-        
-        # Get response from GPT-4
-        response = openai.chat.completions.create(
-            model="gpt-4o-mini-2024-07-18",
-            messages=[
+        response = await chat_completion({
+            "model": "gpt-4o-mini-2024-07-18",
+            "messages": [
                 {"role": "system", "content": "You are a professional nutritionist providing personalized nutritional recommendations."},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        
-        print("\n=== RECEIVED RESPONSE FROM GPT-MINI ===")
+            "temperature": 0.7,
+            "max_tokens": 400,
+            **json_response_format("gpt-4o-mini-2024-07-18")
+        }, user_id=user_id, lane=LANE_BACKGROUND, endpoint="dietary_recommendations")
         
-        # Extract the response text
-        response_text = response.choices[0].message.content
-        print(f"Raw GPT Response: {response_text}")
+        response_text = response["choices"][0]["message"]["content"]
+        log_body("Raw GPT response", response_text)
         
-        # Parse the JSON response
-        try:
-            # Clean up the response by removing markdown code block markers and any text before the JSON
-            content = response_text.strip()
-            if "```json" in content:
-                content = content.split("```json")[1]
-            if "```" in content:
-                content = content.split("```")[0]
-            content = content.strip()
-            
-            # Look for JSON-like structure between curly braces
-            import re
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                gpt_response = json.loads(json_str)
-            else:
-                raise ValueError("No JSON structure found in response")
-                
-            print("\n=== PARSED GPT RESPONSE ===")
-            print(f"Successfully parsed response: {json.dumps(gpt_response, indent=2)}")
-            
-            # Validate the response structure
-            required_fields = ["nutritional_needs", "dietary_recommendations"]
-            required_nutritional_fields = ["calories", "macros", "other_nutrients"]
-            required_macros = ["protein", "carbs", "fats"]
-            required_nutrients = ["fiber", "sugar", "sodium"]
-            
-            print("\n=== VALIDATING RESPONSE STRUCTURE ===")
-            for field in required_fields:
-                if field not in gpt_response:
-                    raise ValueError(f"Missing required field: {field}")
-                print(f"✓ Found required field: {field}")
-            
-            for field in required_nutritional_fields:
-                if field not in gpt_response["nutritional_needs"]:
-                    raise ValueError(f"Missing required nutritional field: {field}")
-                print(f"✓ Found required nutritional field: {field}")
-            
-            for macro in required_macros:
-                if macro not in gpt_response["nutritional_needs"]["macros"]:
-                    raise ValueError(f"Missing required macro: {macro}")
-                print(f"✓ Found required macro: {macro}")
-            
-            for nutrient in required_nutrients:
-                if nutrient not in gpt_response["nutritional_needs"]["other_nutrients"]:
-                    raise ValueError(f"Missing required nutrient: {nutrient}")
-                print(f"✓ Found required nutrient: {nutrient}")
-            
-            # Ensure all numeric values are integers
-            print("\n=== CONVERTING VALUES TO INTEGERS ===")
-            gpt_response["nutritional_needs"]["calories"]["min"] = int(gpt_response["nutritional_needs"]["calories"]["min"])
-            gpt_response["nutritional_needs"]["calories"]["max"] = int(gpt_response["nutritional_needs"]["calories"]["max"])
-            print(f"✓ Converted calories to integers")
-            
-            for macro in required_macros:
-                gpt_response["nutritional_needs"]["macros"][macro]["min"] = int(gpt_response["nutritional_needs"]["macros"][macro]["min"])
-                gpt_response["nutritional_needs"]["macros"][macro]["max"] = int(gpt_response["nutritional_needs"]["macros"][macro]["max"])
-                print(f"✓ Converted {macro} to integers")
-            
-            for nutrient in required_nutrients:
-                gpt_response["nutritional_needs"]["other_nutrients"][nutrient]["min"] = int(gpt_response["nutritional_needs"]["other_nutrients"][nutrient]["min"])
-                gpt_response["nutritional_needs"]["other_nutrients"][nutrient]["max"] = int(gpt_response["nutritional_needs"]["other_nutrients"][nutrient]["max"])
-                print(f"✓ Converted {nutrient} to integers")
-            
-            print("\n=== GPT-MINI GENERATION COMPLETE ===")
-            print(f"Final response: {json.dumps(gpt_response, indent=2)}")
-            return gpt_response
-            
-        except json.JSONDecodeError as e:
-            print(f"\n❌ Error parsing GPT response as JSON: {str(e)}")
-            print(f"Raw response: {response_text}")
-            raise ValueError("Failed to parse nutritional needs from GPT response")
+        recommendations = extract_json(response_text).get("dietary_recommendations")
+        if not isinstance(recommendations, list) or not recommendations:
+            raise ValueError("Missing required field: dietary_recommendations")
+        return [str(recommendation) for recommendation in recommendations]
             
     except Exception as e:
-        print(f"\n❌ Error calculating nutritional needs: {str(e)}")
+        print(f"\n❌ Error generating dietary recommendations: {str(e)}")
         raise
 
-async def analyze_meal_image(image_content: bytes) -> Dict[str, Any]:
+async def analyze_meal_image(image_content: bytes, detail: str = "auto", user_id: Optional[str] = None) -> Dict[str, Any]:
     """
     Analyze a meal image using ChatGPT-4o Vision API.
     First detects ingredients, then engages in dialogue for more details.
+    Expects the image already prepared by prepare_vision_image; `detail` is
+    the vision detail level ("low", "high" or "auto").
+    With VISION_ROUTING_ENABLED the fast model answers first and the call is
+    escalated to VISION_MODEL only if its answer fails escalation_reason().
     """
     try:
         print("\n=== Starting Image Analysis ===")
@@ -301,570 +425,548 @@ async def analyze_meal_image(image_content: bytes) -> Dict[str, Any]:
         - For cooking method: required_terms=["fried", "baked", "boiled", "roasted"]
         """
         
-        # Prepare the API request
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "chatgpt-4o-latest",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a friendly and knowledgeable nutritionist having a natural conversation with users about their meals. Your responses should be conversational, specific to what you observe, and focused on gathering accurate nutritional information."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": initial_prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            }
+        messages = [
+            {
+                "role": "system",
+                "content": "You are a friendly and knowledgeable nutritionist having a natural conversation with users about their meals. Your responses should be conversational, specific to what you observe, and focused on gathering accurate nutritional information."
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": initial_prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{image_base64}",
+                            "detail": detail
                         }
-                    ]
-                }
-            ],
-            "max_tokens": 16384
-        }
-        
-        print("\n=== Starting GPT Vision Query ===")
-        print("Sending request to ChatGPT-4o...")
-        print(f"API Key present: {'Yes' if api_key else 'No'}")
-        print(f"API Key prefix in headers: {api_key[:10]}...")  # Only print first 10 chars for security
-        print(f"Request URL: https://api.openai.com/v1/chat/completions")
-        print(f"Request payload: {json.dumps(payload, indent=2)}")
+                    }
+                ]
+            }
+        ]
         
-        async with httpx.AsyncClient(timeout=60.0) as client:  # 60 second timeout
-            max_retries = 3
-            retry_delay = 1
+        async def analyze_with(model: str, max_tokens: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+            payload = {"model": model, "messages": messages, "max_tokens": max_tokens}
+            print(f"\n=== Starting GPT Vision Query ({model}) ===")
+            print(f"API Key present: {'Yes' if api_key else 'No'}")
+            print(f"Request URL: {settings.OPENAI_BASE_URL}/chat/completions")
+            log_body("Vision request payload", payload)
             
-            for attempt in range(max_retries):
-                try:
-                    response = await client.post(
-                        "https://api.openai.com/v1/chat/completions",
-                        headers=headers,
-                        json=payload,
-                    )
-                    
-                    print(f"Response status code: {response.status_code}")
-                    print(f"Response headers: {response.headers}")
-                    
-                    if response.status_code != 200:
-                        error_text = response.text
-                        print(f"GPT API error: {error_text}")
-                        raise Exception(f"GPT API error: {error_text}")
-                    
-                    result = response.json()
-                    content = result["choices"][0]["message"]["content"]
-                    print(f"Received response from ChatGPT-4o: {content}")
-                    
-                    # Extract JSON from the response
-                    try:
-                        # Look for JSON content between ```json and ``` markers
-                        import re
-                        json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-                        
-                        if json_match:
-                            # Extract just the JSON part
-                            json_content = json_match.group(1).strip()
-                            print(f"Extracted JSON content: {json_content}")
-                            try:
-                                initial_analysis = json.loads(json_content)
-                                print("Successfully parsed extracted JSON")
-                            except json.JSONDecodeError as e:
-                                print(f"Error parsing extracted JSON: {str(e)}")
-                                raise Exception(f"Failed to parse extracted JSON: {str(e)}")
-                        else:
-                            # If no JSON block is found, try the original parsing approach
-                            print("No JSON code block found, trying alternative parsing methods")
-                            
-                            # Clean up the response by removing markdown code block markers
-                            content = content.strip()
-                            if content.startswith("```json"):
-                                content = content[7:]
-                            if content.endswith("```"):
-                                content = content[:-3]
-                            content = content.strip()
-                            
-                            # Parse the JSON response
-                            try:
-                                # First attempt: direct parsing
-                                initial_analysis = json.loads(content)
-                            except json.JSONDecodeError as e:
-                                print(f"Initial JSON parsing failed: {str(e)}")
-                                print(f"Raw response: {content}")
-                                
-                                # Second attempt: try to extract JSON from the response
-                                try:
-                                    # Look for JSON-like structure between curly braces
-                                    json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                                    if json_match:
-                                        json_str = json_match.group(0)
-                                        print(f"Extracted JSON structure: {json_str}")
-                                        initial_analysis = json.loads(json_str)
-                                    else:
-                                        raise Exception("No JSON structure found in response")
-                                except Exception as e3:
-                                    print(f"Error in final JSON extraction attempt: {str(e3)}")
-                                    raise Exception(f"Failed to parse GPT response as JSON: {str(e)}")
-                    except Exception as e:
-                        print(f"Error extracting or parsing JSON: {str(e)}")
-                        raise Exception(f"Failed to extract or parse JSON from response: {str(e)}")
-
-                    # Extract ingredients from the first response
-                    ingredients_list = []
-                    for ingredient in initial_analysis.get("detected_ingredients", []):
-                        ingredient_name = ingredient.get("name", "")
-                        portion = ingredient.get("portion", "unknown amount")
-                        ingredients_list.append(f"{ingredient_name} ({portion})")
-                    
-                    print("\n=== EXTRACTED INGREDIENTS ===")
-                    print(f"Ingredients: {', '.join(ingredients_list)}")
-                    
-                    return initial_analysis
-                    
-                except (httpx.ReadTimeout, httpx.ConnectTimeout) as e:
-                    if attempt == max_retries - 1:  # Last attempt
-                        print(f"Failed after {max_retries} attempts: {str(e)}")
-                        raise Exception(f"Request timed out after {max_retries} attempts")
-                    else:
-                        print(f"Attempt {attempt + 1} failed, retrying in {retry_delay} seconds...")
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff
-                
-                except Exception as e:
-                    print(f"Unexpected error: {str(e)}")
-                    raise Exception(f"HTTP request failed: {str(e)}")
-                    
+            result = await chat_completion(payload, user_id=user_id, endpoint="meal_image")
+            content = result["choices"][0]["message"]["content"]
+            print(f"Received response from {model}")
+            log_body("Vision response", content)
+            
+            # Extract JSON from the response
+            try:
+                return extract_json(content), result
+            except json.JSONDecodeError as e:
+                print(f"Error extracting or parsing JSON: {str(e)}")
+                raise Exception(f"Failed to extract or parse JSON from response: {str(e)}")
+        
+        started = time.monotonic()
+        responses = []
+        route, reason = ROUTE_DIRECT, "disabled"
+        initial_analysis = None
+        if settings.VISION_ROUTING_ENABLED:
+            # Fast tier first; anything it can't answer confidently goes to the full model
+            try:
+                initial_analysis, result = await analyze_with(settings.VISION_FAST_MODEL, settings.VISION_FAST_MAX_TOKENS)
+                responses.append(result)
+                reason = escalation_reason(
+                    initial_analysis, settings.VISION_ESCALATE_CONFIDENCE, settings.VISION_MAX_INGREDIENTS
+                )
+                route = ROUTE_ESCALATED if reason else ROUTE_FAST
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                print(f"Fast vision model failed, escalating: {str(e)}")
+                route, reason = ROUTE_ESCALATED, "fast_error"
+            if route == ROUTE_ESCALATED:
+                print(f"Escalating vision analysis to {VISION_MODEL}: {reason}")
+                initial_analysis = None
+            else:
+                reason = "accepted"
+        
+        if initial_analysis is None:
+            initial_analysis, result = await analyze_with(VISION_MODEL, settings.VISION_MAX_TOKENS)
+            responses.append(result)
+        record_route(route, reason, time.monotonic() - started, responses)
+
+        # Extract ingredients from the first response
+        ingredients_list = []
+        for ingredient in initial_analysis.get("detected_ingredients", []):
+            ingredient_name = ingredient.get("name", "")
+            portion = ingredient.get("portion", "unknown amount")
+            ingredients_list.append(f"{ingredient_name} ({portion})")
+        
+        print("\n=== EXTRACTED INGREDIENTS ===")
+        print(f"Ingredients: {', '.join(ingredients_list)}")
+        
+        return initial_analysis
+
+    except CircuitOpenError:
+        raise
     except Exception as e:
         print(f"Error in analyze_meal_image: {str(e)}")
         print(f"Error type: {type(e).__name__}")
         print(f"Error details: {str(e)}")
         raise Exception(f"Failed to analyze meal image: {str(e)}")
 
-async def analyze_meal_details(conversation_history: List[Dict[str, str]], user_profile: Dict[str, Any]) -> Dict[str, Any]:
+# Static instructions for meal details analysis. Kept in the system message,
+# identical on every call, so the per-call user message stays small and the
+# shared prefix can be served from OpenAI's prompt cache.
+MEAL_DETAILS_SYSTEM_PROMPT = """You are a nutritional analysis AI that provides detailed meal analysis.
+Analyze the meal based on the detected ingredients and conversation history you are given. The analysis should focus on the actual meal described in the conversation, not any other meal type. Provide specific numerical values for all nutritional information.
+
+When generating health scores, please follow these personalized guidelines:
+
+1. Glycemic Index Score (0-100, lower is better):
+   - Base score on meal's impact on blood sugar
+   - Adjust based on user's age (older adults need more stable blood sugar)
+   - Consider if user has diabetes or prediabetes
+   - Factor in meal timing (breakfast vs dinner)
+   - Example: A 60-year-old with prediabetes should have stricter scoring for high-carb meals
+
+2. Inflammatory Score (0-100, lower is better):
+   - Base score on meal's inflammatory potential
+   - Consider user's health conditions (e.g., arthritis, heart disease)
+   - Factor in age (older adults may be more sensitive to inflammation)
+   - Example: A person with heart disease should have stricter scoring for high-sodium, high-saturated fat meals
+
+3. Heart Health Score (0-100, higher is better):
+   - Base score on meal's impact on cardiovascular health
+   - Consider user's heart health history and family history
+   - Factor in age and sex (heart disease risk varies)
+   - Example: A 55-year-old male with family history of heart disease should have stricter scoring for cholesterol and saturated fat
+
+4. Digestive Score (0-100, higher is better):
+   - Base score on meal's digestibility and gut health impact
+   - Consider user's digestive health history
+   - Factor in age (digestive efficiency changes with age)
+   - Example: A person with IBS should have stricter scoring for high-FODMAP foods
+
+5. Meal Balance Score (0-100, higher is better):
+   - Base score on macronutrient distribution
+   - Adjust ideal ratios based on user's health goals:
+     * Muscle building: Higher protein ratio
+     * Weight loss: Higher protein, moderate fat, lower carb
+     * Endurance: Higher carb ratio
+     * Heart health: Lower saturated fat, higher fiber
+   - Consider age and activity level
+   - Example: A 25-year-old athlete should have different ideal ratios than a 65-year-old sedentary person
+
+6. Micronutrient Balance Score (0-100, higher is better):
+   - Focus on user's priority micronutrients
+   - Consider age-specific needs (e.g., calcium for older adults)
+   - Factor in health conditions (e.g., iron for anemia)
+   - Example: A postmenopausal woman should have stricter scoring for calcium and vitamin D
+
+For health benefits, potential concerns, and suggestions:
+1. Make these SPECIFICALLY tailored to:
+   - User's age and sex
+   - Health goals
+   - Health conditions
+   - Dietary preferences
+   - Priority micronutrients
+   - Meal timing
+2. Consider age-specific needs:
+   - Children: Growth and development
+   - Young adults: Energy and performance
+   - Middle age: Prevention and maintenance
+   - Older adults: Nutrient absorption and chronic conditions
+3. Factor in sex-specific considerations:
+   - Women: Iron, calcium, folate needs
+   - Men: Heart health, prostate health
+4. Address specific health conditions:
+   - Diabetes: Blood sugar impact
+   - Heart disease: Cholesterol and blood pressure
+   - Digestive issues: Gut health and tolerance
+5. Respect dietary preferences and restrictions
+6. Consider meal timing and daily pattern
+
+Example for a 59-year-old male with heart health goals:
+- Glycemic Index: Stricter scoring for refined carbs
+- Inflammatory: Lower tolerance for processed foods
+- Heart Health: Higher emphasis on fiber and omega-3s
+- Digestive: Consider age-related digestive changes
+- Meal Balance: Focus on heart-healthy ratios
+- Micronutrient: Prioritize heart-healthy nutrients
+
+Please provide a comprehensive analysis in the following JSON format with specific numerical values.
+For health benefits, potential concerns, and suggestions, make sure to specifically address the user's age, sex, dietary preferences, foods to avoid, health goals, priority micronutrients to track, and personal/family health history:
+
+Example health goal-specific benefits:
+- For skin health: "The turmeric in the curry provides curcumin, which has anti-inflammatory properties that can help reduce skin inflammation and promote a healthy glow."
+- For cellular health: "The lentils provide essential amino acids and B-vitamins that support cellular repair and energy production."
+- For immunity: "The combination of spices like turmeric and cumin provides antioxidants that support immune function and help fight inflammation."
+- For diabetes management: "The fiber from lentils and vegetables helps regulate blood sugar levels and improve insulin sensitivity."
+- For muscle building: "The combination of lentils and rice provides a complete protein source with all essential amino acids needed for muscle repair and growth."
+- For heart health: "The fiber and potassium from the vegetables help maintain healthy blood pressure and cholesterol levels."
+- For digestive health: "The fiber from lentils and vegetables supports gut health and promotes regular digestion."
+
+Example health goal-specific suggestions:
+- For skin health: "Add more turmeric or include foods rich in vitamin C like amla or citrus fruits to enhance collagen production."
+- For cellular health: "Include more antioxidant-rich spices like turmeric and add nuts or seeds for healthy fats that support cell membrane health."
+- For immunity: "Add more garlic or ginger to the preparation for additional immune-boosting compounds."
+- For diabetes: "Consider reducing the portion of rice and increasing the proportion of lentils and vegetables to better manage blood sugar levels."
+- For muscle building: "Add a side of yogurt or paneer to increase protein content and support muscle recovery."
+- For heart health: "Use less oil in cooking and consider adding more heart-healthy ingredients like garlic and ginger."
+- For digestive health: "Include more probiotic-rich foods like yogurt or fermented vegetables to support gut health."
+
+{
+    "meal_name": "A descriptive name that includes the main ingredients and cooking style",
+    "ingredients": ["ingredient1", "ingredient2", ...],
+    "cooking_method": "method",
+    "serving_size": "size",
+    "macronutrients": {
+        "calories": number,
+        "protein": number,
+        "carbs": number,
+        "fats": number,
+        "fiber": number,
+        "sugar": number,
+        "sodium": number
+    },
+    "health_tags": ["Tag1", "Tag2", "Tag3"],
+    "health_benefits": [
+        "Benefit 1 specifically related to user's health goals, priority micronutrients, and personal/family health history",
+        "Benefit 2 specifically related to user's health goals, priority micronutrients, and personal/family health history",
+        "Benefit 3 specifically related to user's health goals, priority micronutrients, and personal/family health history"
+    ],
+    "potential_concerns": [
+        "Concern 1 specifically related to user's health goals, priority micronutrients, and personal/family health history",
+        "Concern 2 specifically related to user's health goals, priority micronutrients, and personal/family health history"
+    ],
+    "suggestions": [
+        "Suggestion 1 to improve intake of priority micronutrients or address health goals",
+        "Suggestion 2 to improve intake of priority micronutrients or address health goals",
+        "Suggestion 3 to improve intake of priority micronutrients or address health goals"
+    ],
+    "recommended_recipes": [
+        {
+            "name": "Recipe Name 1",
+            "description": "Brief description of how this recipe relates to user's health goals, priority nutrients, and dietary preferences",
+            "ingredients": ["ingredient1", "ingredient2", "..."],
+            "benefits": "How this recipe specifically addresses user's health goals and priority micronutrients"
+        },
+        {
+            "name": "Recipe Name 2",
+            "description": "Brief description of how this recipe relates to user's health goals, priority nutrients, and dietary preferences",
+            "ingredients": ["ingredient1", "ingredient2", "..."],
+            "benefits": "How this recipe specifically addresses user's health goals and priority micronutrients"
+        },
+        {
+            "name": "Recipe Name 3",
+            "description": "Brief description of how this recipe relates to user's health goals, priority nutrients, and dietary preferences",
+            "ingredients": ["ingredient1", "ingredient2", "..."],
+            "benefits": "How this recipe specifically addresses user's health goals and priority micronutrients"
+        }
+    ],
+    "macronutrient_split": {
+        "protein_percentage": number,
+        "carbs_percentage": number,
+        "fats_percentage": number
+    },
+    "micronutrients": {
+        "iron": {"amount": number, "unit": "mg", "percentage_of_daily": number},
+        "vitamin_b12": {"amount": number, "unit": "mcg", "percentage_of_daily": number},
+        "folate": {"amount": number, "unit": "mcg", "percentage_of_daily": number},
+        "vitamin_d": {"amount": number, "unit": "mcg", "percentage_of_daily": number},
+        "calcium": {"amount": number, "unit": "mg", "percentage_of_daily": number},
+        "omega3": {"amount": number, "unit": "g", "percentage_of_daily": number},
+        "potassium": {"amount": number, "unit": "mg", "percentage_of_daily": number},
+        "magnesium": {"amount": number, "unit": "mg", "percentage_of_daily": number},
+        "zinc": {"amount": number, "unit": "mg", "percentage_of_daily": number}
+    },
+    "priority_micronutrients": ["the user's priority micronutrients, exactly as listed in their profile"],
+    "micronutrient_balance": {
+        "score": number,  # Average percentage of daily recommended intake for priority micronutrients
+        "priority_nutrients": [  # List of priority micronutrients and their percentages
+            {"name": "nutrient_name", "percentage": number},
+            ...
+        ]
+    },
+    "scores": {
+        "glycemic_index": number,  # 0-100 scale
+        "inflammatory": number,    # 0-100 scale (lower is better)
+        "heart_health": number,    # 0-100 scale
+        "digestive": number,       # 0-100 scale
+        "meal_balance": number     # 0-100 scale
+    }
+}
+
+For health_benefits, potential_concerns, and suggestions:
+1. Make sure these are SPECIFICALLY tailored to the user's health goals, priority micronutrients, and personal/family health history
+2. Each benefit should explain how the meal supports a specific health goal or provides important micronutrients
+3. Each concern should highlight potential issues related to the user's health conditions or goals
+4. Each suggestion should offer a concrete way to improve the meal to better support the user's specific health needs
+5. Focus on South Asian ingredients and cooking methods that are relevant to the user's health goals
+
+For recommended_recipes:
+1. Suggest recipes that are similar to the analyzed meal but optimized for the user's health goals
+2. Ensure recipes avoid any foods listed in the user's "foods to avoid"
+3. Focus on recipes that are rich in the user's priority micronutrients
+4. Consider the time of day and which meal this might be (breakfast, lunch, dinner)
+5. Provide recipes appropriate for the user's dietary preferences
+6. Include traditional South Asian ingredients and cooking methods that support the user's health goals
+
+For health_tags:
+1. Provide ONLY 3-5 health tags maximum
+2. Focus on health BENEFITS of the meal (not dietary restrictions like "Gluten-Free" or "Vegan")
+3. Each tag should start with a capital letter
+4. Examples of good health tags: "Heart Healthy", "Anti-Inflammatory", "Immune Boosting", "Energy Enhancing", "Gut Friendly"
+5. The tags should be directly related to the meal's health benefits, not just its nutritional content
+
+The suggestions should be specific, actionable improvements that could make the meal healthier.
+
+IMPORTANT: Do NOT suggest adding ingredients that are already present in the meal. For example, if the meal already contains olive oil, turmeric, cumin seeds, or coriander, do not suggest adding these ingredients.
+"""
+
+MEAL_DETAILS_MODEL = "gpt-4o-mini-2024-07-18"
+
+# Profile fields included in the details prompt, in order
+_PROFILE_PROMPT_FIELDS = (
+    ("age", "Age"),
+    ("sex", "Sex"),
+    ("health_goals", "Health Goals"),
+    ("dietary_preferences", "Dietary Preferences"),
+    ("personal_health_history", "Personal Health History"),
+    ("family_health_history", "Family Health History"),
+    ("priority_micronutrients", "Priority Micronutrients"),
+    ("foods_to_avoid", "Foods to Avoid"),
+    ("meals_per_day", "Meals per Day"),
+    ("activity_level", "Activity Level"),
+    ("weight", "Weight"),
+    ("height", "Height"),
+)
+
+def _profile_prompt_lines(user_profile: Dict[str, Any]) -> List[str]:
+    """One line per profile field that is actually set"""
+    lines = []
+    for key, label in _PROFILE_PROMPT_FIELDS:
+        value = user_profile.get(key)
+        if isinstance(value, dict):
+            value = f"{value.get('value', '')} {value.get('unit', '')}".strip()
+        elif isinstance(value, list):
+            value = ", ".join(str(item) for item in value)
+        if value not in (None, ""):
+            lines.append(f"- {label}: {value}")
+    return lines
+
+def _meal_time_context(hour: int) -> str:
+    if 5 <= hour < 11:
+        return "This appears to be a breakfast meal."
+    elif 11 <= hour < 15:
+        return "This appears to be a lunch meal."
+    elif 15 <= hour < 22:
+        return "This appears to be a dinner meal."
+    return "This appears to be a late night meal/snack."
+
+def build_meal_details_request(
+    conversation_history: List[Dict[str, str]],
+    user_profile: Dict[str, Any],
+    meal_time: Optional[datetime] = None
+) -> Dict[str, Any]:
     """
-    Analyze meal details based on conversation history and user profile.
+    Build the chat completion request for a meal details analysis.
+    The conversation is compacted to one line per turn, with older turns
+    summarized and the oldest dropped if needed to stay within
+    GPT_DETAILS_INPUT_TOKEN_BUDGET. `meal_time` defaults to now; pass the
+    meal's own time when re-analyzing a stored meal.
     """
-    try:
-        # Extract priority micronutrients from user profile
-        priority_micronutrients = user_profile.get('priority_micronutrients', [])
-        priority_micronutrients_str = ', '.join(priority_micronutrients) if priority_micronutrients else "None specified"
-        
-        # Extract family health history
-        family_health_history = user_profile.get('family_health_history', [])
-        family_health_history_str = ', '.join(family_health_history) if family_health_history else "None specified"
+    model = MEAL_DETAILS_MODEL
+    # First message contains the detected ingredients
+    detected_ingredients = conversation_history[0].get("content", "") if conversation_history else ""
+    profile_lines = _profile_prompt_lines(user_profile)
+    profile_lines.append(f"- Meal Time Context: {_meal_time_context((meal_time or datetime.now()).hour)}")
+    
+    def build_messages(history_lines: List[str]) -> List[Dict[str, str]]:
+        prompt = (
+            "Provide a detailed nutritional analysis of this meal for this user.\n\n"
+            f"Detected Ingredients from Image Analysis:\n{detected_ingredients}\n\n"
+            "Conversation History:\n" + ("\n".join(history_lines) or "(none)") + "\n\n"
+            "User Profile:\n" + "\n".join(profile_lines)
+        )
+        return [
+            {"role": "system", "content": MEAL_DETAILS_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    
+    history_lines = compact_history(conversation_history, settings.GPT_DETAILS_RECENT_TURNS)
+    history_lines = fit_history(
+        count_message_tokens(build_messages([]), model),
+        history_lines,
+        settings.GPT_DETAILS_INPUT_TOKEN_BUDGET,
+        model
+    )
+    
+    # Prepare the request data
+    request_data = {
+        "model": model,
+        "messages": build_messages(history_lines),
+        "temperature": 0.5,
+        "max_tokens": 2000
+    }
+    request_data.update(json_response_format(model))
+    
+    return request_data
+
+def normalize_meal_analysis(analysis: Dict[str, Any], priority_micronutrients: List[str]) -> Dict[str, Any]:
+    """
+    Normalize a parsed meal analysis: tidy the health tags and make sure
+    micronutrient_balance only covers the user's priority micronutrients.
+    """
+    # Process health tags - ensure they're capitalized and limited to 3-5
+    if "health_tags" in analysis:
+        # Capitalize first letter of each tag
+        health_tags = [tag.capitalize() for tag in analysis["health_tags"]]
         
-        # Extract personal health history
-        personal_health_history = user_profile.get('personal_health_history', [])
-        personal_health_history_str = ', '.join(personal_health_history) if personal_health_history else "None specified"
+        # Limit to 3-5 tags
+        if len(health_tags) > 5:
+            health_tags = health_tags[:5]
+        elif len(health_tags) < 3 and "health_benefits" in analysis and analysis["health_benefits"]:
+            # If we have fewer than 3 tags but have health benefits, convert some benefits to tags
+            for benefit in analysis["health_benefits"]:
+                if len(health_tags) < 3:
+                    # Convert benefit to tag format (shorter, capitalized)
+                    benefit_words = benefit.split()
+                    if len(benefit_words) > 3:
+                        # Shorten long benefits
+                        tag = " ".join(benefit_words[:3]).capitalize()
+                    else:
+                        tag = benefit.capitalize()
+                    
+                    # Only add if not already present
+                    if tag not in health_tags:
+                        health_tags.append(tag)
         
-        # Extract foods to avoid
-        foods_to_avoid = user_profile.get('foods_to_avoid', [])
-        foods_to_avoid_str = ', '.join(foods_to_avoid) if foods_to_avoid else "None specified"
+        analysis["health_tags"] = health_tags
+    
+    # Ensure micronutrient_balance is properly formatted
+    if "micronutrient_balance" not in analysis or not analysis["micronutrient_balance"]:
+        # Calculate micronutrient balance manually
+        micronutrients = analysis.get("micronutrients", {})
         
-        # Extract meals per day
-        meals_per_day = user_profile.get('meals_per_day', 3)
+        # Only use user's priority micronutrients, no defaults
+        # Extract percentages for priority nutrients
+        priority_nutrients = []
+        total_percentage = 0
+        count = 0
         
-        # Extract health goals
-        health_goals = user_profile.get('health_goals', [])
-        health_goals_str = ', '.join(health_goals) if health_goals else "None specified"
+        # Only proceed if there are priority micronutrients
+        if priority_micronutrients:
+            for nutrient in priority_micronutrients:
+                # Convert to snake_case if needed
+                nutrient_key = nutrient.lower().replace(" ", "_")
+                
+                if nutrient_key in micronutrients:
+                    percentage = micronutrients[nutrient_key].get("percentage_of_daily", 0)
+                    priority_nutrients.append({
+                        "name": nutrient,
+                        "percentage": percentage
+                    })
+                    total_percentage += percentage
+                    count += 1
         
-        # Get current time to determine which meal of the day this might be
-        current_time = datetime.now()
-        hour = current_time.hour
+        # Calculate average score
+        score = total_percentage / count if count > 0 else 0
         
-        # Determine meal time context
-        meal_time_context = ""
-        if 5 <= hour < 11:
-            meal_time_context = "This appears to be a breakfast meal."
-        elif 11 <= hour < 15:
-            meal_time_context = "This appears to be a lunch meal."
-        elif 15 <= hour < 22:
-            meal_time_context = "This appears to be a dinner meal."
+        # Set the micronutrient balance
+        analysis["micronutrient_balance"] = {
+            "score": round(score, 1),
+            "priority_nutrients": priority_nutrients
+        }
+    else:
+        # Ensure the micronutrient_balance only contains priority nutrients
+        if priority_micronutrients:
+            existing_balance = analysis["micronutrient_balance"]
+            filtered_nutrients = []
+            total_percentage = 0
+            count = 0
+            
+            # Filter to only include priority nutrients
+            for nutrient_info in existing_balance.get("priority_nutrients", []):
+                nutrient_name = nutrient_info.get("name", "").lower().replace(" ", "_")
+                if any(pn.lower().replace(" ", "_") == nutrient_name for pn in priority_micronutrients):
+                    filtered_nutrients.append(nutrient_info)
+                    total_percentage += nutrient_info.get("percentage", 0)
+                    count += 1
+            
+            # Recalculate score based only on priority nutrients
+            score = total_percentage / count if count > 0 else 0
+            
+            analysis["micronutrient_balance"] = {
+                "score": round(score, 1),
+                "priority_nutrients": filtered_nutrients
+            }
         else:
-            meal_time_context = "This appears to be a late night meal/snack."
+            # If no priority nutrients, set empty list and score to 0
+            analysis["micronutrient_balance"] = {
+                "score": 0,
+                "priority_nutrients": []
+            }
+    
+    return analysis
+
+async def analyze_meal_details(
+    conversation_history: List[Dict[str, str]],
+    user_profile: Dict[str, Any],
+    user_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Analyze meal details based on conversation history and user profile.
+    """
+    try:
+        request_data = build_meal_details_request(conversation_history, user_profile)
+        estimated_tokens = count_message_tokens(request_data["messages"], request_data["model"])
         
-        # Construct a prompt that includes conversation history and user profile
-        prompt = f"""
-        Based on the following conversation about a meal and the user's profile, provide a detailed nutritional analysis.
-        Make sure to provide specific numerical values for all nutritional information.
-
-        Detected Ingredients from Image Analysis:
-        {conversation_history[0].get('content', '')}  # First message contains the detected ingredients
-
-        Conversation History:
-        {json.dumps(conversation_history, indent=2)}
-
-        User Profile:
-        - Age: {user_profile.get('age', 'Not specified')}
-        - Sex: {user_profile.get('sex', 'Not specified')}
-        - Health Goals: {', '.join(user_profile.get('health_goals', ['Not specified']))}
-        - Dietary Preferences: {', '.join(user_profile.get('dietary_preferences', ['Not specified']))}
-        - Personal Health History: {', '.join(user_profile.get('personal_health_history', ['Not specified']))}
-        - Family Health History: {', '.join(user_profile.get('family_health_history', ['Not specified']))}
-        - Priority Micronutrients: {', '.join(user_profile.get('priority_micronutrients', ['Not specified']))}
-        - Foods to Avoid: {', '.join(user_profile.get('foods_to_avoid', ['Not specified']))}
-        - Meals per Day: {user_profile.get('meals_per_day', 'Not specified')}
-        - Activity Level: {user_profile.get('activity_level', 'Not specified')}
-        - Weight: {user_profile.get('weight', {}).get('value', 'Not specified')} {user_profile.get('weight', {}).get('unit', '')}
-        - Height: {user_profile.get('height', {}).get('value', 'Not specified')} {user_profile.get('height', {}).get('unit', '')}
-        - Meal Time Context: {meal_time_context}
-
-        Please analyze the meal based on the detected ingredients and conversation history. The analysis should focus on the actual meal described in the conversation, not any other meal type.
-
-        When generating health scores, please follow these personalized guidelines:
-
-        1. Glycemic Index Score (0-100, lower is better):
-           - Base score on meal's impact on blood sugar
-           - Adjust based on user's age (older adults need more stable blood sugar)
-           - Consider if user has diabetes or prediabetes
-           - Factor in meal timing (breakfast vs dinner)
-           - Example: A 60-year-old with prediabetes should have stricter scoring for high-carb meals
-
-        2. Inflammatory Score (0-100, lower is better):
-           - Base score on meal's inflammatory potential
-           - Consider user's health conditions (e.g., arthritis, heart disease)
-           - Factor in age (older adults may be more sensitive to inflammation)
-           - Example: A person with heart disease should have stricter scoring for high-sodium, high-saturated fat meals
-
-        3. Heart Health Score (0-100, higher is better):
-           - Base score on meal's impact on cardiovascular health
-           - Consider user's heart health history and family history
-           - Factor in age and sex (heart disease risk varies)
-           - Example: A 55-year-old male with family history of heart disease should have stricter scoring for cholesterol and saturated fat
-
-        4. Digestive Score (0-100, higher is better):
-           - Base score on meal's digestibility and gut health impact
-           - Consider user's digestive health history
-           - Factor in age (digestive efficiency changes with age)
-           - Example: A person with IBS should have stricter scoring for high-FODMAP foods
-
-        5. Meal Balance Score (0-100, higher is better):
-           - Base score on macronutrient distribution
-           - Adjust ideal ratios based on user's health goals:
-             * Muscle building: Higher protein ratio
-             * Weight loss: Higher protein, moderate fat, lower carb
-             * Endurance: Higher carb ratio
-             * Heart health: Lower saturated fat, higher fiber
-           - Consider age and activity level
-           - Example: A 25-year-old athlete should have different ideal ratios than a 65-year-old sedentary person
-
-        6. Micronutrient Balance Score (0-100, higher is better):
-           - Focus on user's priority micronutrients
-           - Consider age-specific needs (e.g., calcium for older adults)
-           - Factor in health conditions (e.g., iron for anemia)
-           - Example: A postmenopausal woman should have stricter scoring for calcium and vitamin D
-
-        For health benefits, potential concerns, and suggestions:
-        1. Make these SPECIFICALLY tailored to:
-           - User's age and sex
-           - Health goals
-           - Health conditions
-           - Dietary preferences
-           - Priority micronutrients
-           - Meal timing
-        2. Consider age-specific needs:
-           - Children: Growth and development
-           - Young adults: Energy and performance
-           - Middle age: Prevention and maintenance
-           - Older adults: Nutrient absorption and chronic conditions
-        3. Factor in sex-specific considerations:
-           - Women: Iron, calcium, folate needs
-           - Men: Heart health, prostate health
-        4. Address specific health conditions:
-           - Diabetes: Blood sugar impact
-           - Heart disease: Cholesterol and blood pressure
-           - Digestive issues: Gut health and tolerance
-        5. Respect dietary preferences and restrictions
-        6. Consider meal timing and daily pattern
-
-        Example for a 59-year-old male with heart health goals:
-        - Glycemic Index: Stricter scoring for refined carbs
-        - Inflammatory: Lower tolerance for processed foods
-        - Heart Health: Higher emphasis on fiber and omega-3s
-        - Digestive: Consider age-related digestive changes
-        - Meal Balance: Focus on heart-healthy ratios
-        - Micronutrient: Prioritize heart-healthy nutrients
-
-        Please provide a comprehensive analysis in the following JSON format with specific numerical values.
-        For health benefits, potential concerns, and suggestions, make sure to specifically address the user's age, sex, dietary preferences, foods to avoid, health goals, priority micronutrients to track, and personal/family health history:
-
-        Example health goal-specific benefits:
-        - For skin health: "The turmeric in the curry provides curcumin, which has anti-inflammatory properties that can help reduce skin inflammation and promote a healthy glow."
-        - For cellular health: "The lentils provide essential amino acids and B-vitamins that support cellular repair and energy production."
-        - For immunity: "The combination of spices like turmeric and cumin provides antioxidants that support immune function and help fight inflammation."
-        - For diabetes management: "The fiber from lentils and vegetables helps regulate blood sugar levels and improve insulin sensitivity."
-        - For muscle building: "The combination of lentils and rice provides a complete protein source with all essential amino acids needed for muscle repair and growth."
-        - For heart health: "The fiber and potassium from the vegetables help maintain healthy blood pressure and cholesterol levels."
-        - For digestive health: "The fiber from lentils and vegetables supports gut health and promotes regular digestion."
-
-        Example health goal-specific suggestions:
-        - For skin health: "Add more turmeric or include foods rich in vitamin C like amla or citrus fruits to enhance collagen production."
-        - For cellular health: "Include more antioxidant-rich spices like turmeric and add nuts or seeds for healthy fats that support cell membrane health."
-        - For immunity: "Add more garlic or ginger to the preparation for additional immune-boosting compounds."
-        - For diabetes: "Consider reducing the portion of rice and increasing the proportion of lentils and vegetables to better manage blood sugar levels."
-        - For muscle building: "Add a side of yogurt or paneer to increase protein content and support muscle recovery."
-        - For heart health: "Use less oil in cooking and consider adding more heart-healthy ingredients like garlic and ginger."
-        - For digestive health: "Include more probiotic-rich foods like yogurt or fermented vegetables to support gut health."
-
-        {{
-            "meal_name": "A descriptive name that includes the main ingredients and cooking style",
-            "ingredients": ["ingredient1", "ingredient2", ...],
-            "cooking_method": "method",
-            "serving_size": "size",
-            "macronutrients": {{
-                "calories": number,
-                "protein": number,
-                "carbs": number,
-                "fats": number,
-                "fiber": number,
-                "sugar": number,
-                "sodium": number
-            }},
-            "health_tags": ["Tag1", "Tag2", "Tag3"],
-            "health_benefits": [
-                "Benefit 1 specifically related to user's health goals, priority micronutrients, and personal/family health history",
-                "Benefit 2 specifically related to user's health goals, priority micronutrients, and personal/family health history",
-                "Benefit 3 specifically related to user's health goals, priority micronutrients, and personal/family health history"
-            ],
-            "potential_concerns": [
-                "Concern 1 specifically related to user's health goals, priority micronutrients, and personal/family health history",
-                "Concern 2 specifically related to user's health goals, priority micronutrients, and personal/family health history"
-            ],
-            "suggestions": [
-                "Suggestion 1 to improve intake of priority micronutrients or address health goals",
-                "Suggestion 2 to improve intake of priority micronutrients or address health goals",
-                "Suggestion 3 to improve intake of priority micronutrients or address health goals"
-            ],
-            "recommended_recipes": [
-                {{
-                    "name": "Recipe Name 1",
-                    "description": "Brief description of how this recipe relates to user's health goals, priority nutrients, and dietary preferences",
-                    "ingredients": ["ingredient1", "ingredient2", "..."],
-                    "benefits": "How this recipe specifically addresses user's health goals and priority micronutrients"
-                }},
-                {{
-                    "name": "Recipe Name 2",
-                    "description": "Brief description of how this recipe relates to user's health goals, priority nutrients, and dietary preferences",
-                    "ingredients": ["ingredient1", "ingredient2", "..."],
-                    "benefits": "How this recipe specifically addresses user's health goals and priority micronutrients"
-                }},
-                {{
-                    "name": "Recipe Name 3",
-                    "description": "Brief description of how this recipe relates to user's health goals, priority nutrients, and dietary preferences",
-                    "ingredients": ["ingredient1", "ingredient2", "..."],
-                    "benefits": "How this recipe specifically addresses user's health goals and priority micronutrients"
-                }}
-            ],
-            "macronutrient_split": {{
-                "protein_percentage": number,
-                "carbs_percentage": number,
-                "fats_percentage": number
-            }},
-            "micronutrients": {{
-                "iron": {{"amount": number, "unit": "mg", "percentage_of_daily": number}},
-                "vitamin_b12": {{"amount": number, "unit": "mcg", "percentage_of_daily": number}},
-                "folate": {{"amount": number, "unit": "mcg", "percentage_of_daily": number}},
-                "vitamin_d": {{"amount": number, "unit": "mcg", "percentage_of_daily": number}},
-                "calcium": {{"amount": number, "unit": "mg", "percentage_of_daily": number}},
-                "omega3": {{"amount": number, "unit": "g", "percentage_of_daily": number}},
-                "potassium": {{"amount": number, "unit": "mg", "percentage_of_daily": number}},
-                "magnesium": {{"amount": number, "unit": "mg", "percentage_of_daily": number}},
-                "zinc": {{"amount": number, "unit": "mg", "percentage_of_daily": number}}
-            }},
-            "priority_micronutrients": {priority_micronutrients},  # Add priority micronutrients to the analysis
-            "micronutrient_balance": {{
-                "score": number,  # Average percentage of daily recommended intake for priority micronutrients
-                "priority_nutrients": [  # List of priority micronutrients and their percentages
-                    {{"name": "nutrient_name", "percentage": number}},
-                    ...
-                ]
-            }},
-            "scores": {{
-                "glycemic_index": number,  # 0-100 scale
-                "inflammatory": number,    # 0-100 scale (lower is better)
-                "heart_health": number,    # 0-100 scale
-                "digestive": number,       # 0-100 scale
-                "meal_balance": number     # 0-100 scale
-            }}
-        }}
-
-        For health_benefits, potential_concerns, and suggestions:
-        1. Make sure these are SPECIFICALLY tailored to the user's health goals, priority micronutrients, and personal/family health history
-        2. Each benefit should explain how the meal supports a specific health goal or provides important micronutrients
-        3. Each concern should highlight potential issues related to the user's health conditions or goals
-        4. Each suggestion should offer a concrete way to improve the meal to better support the user's specific health needs
-        5. Focus on South Asian ingredients and cooking methods that are relevant to the user's health goals
-
-        For recommended_recipes:
-        1. Suggest recipes that are similar to the analyzed meal but optimized for the user's health goals
-        2. Ensure recipes avoid any foods listed in the user's "foods to avoid"
-        3. Focus on recipes that are rich in the user's priority micronutrients
-        4. Consider the time of day and which meal this might be (breakfast, lunch, dinner)
-        5. Provide recipes appropriate for the user's dietary preferences
-        6. Include traditional South Asian ingredients and cooking methods that support the user's health goals
-
-        For health_tags:
-        1. Provide ONLY 3-5 health tags maximum
-        2. Focus on health BENEFITS of the meal (not dietary restrictions like "Gluten-Free" or "Vegan")
-        3. Each tag should start with a capital letter
-        4. Examples of good health tags: "Heart Healthy", "Anti-Inflammatory", "Immune Boosting", "Energy Enhancing", "Gut Friendly"
-        5. The tags should be directly related to the meal's health benefits, not just its nutritional content
+        # Make the API request through the shared client
+        response_data = await chat_completion(request_data, user_id=user_id, endpoint="meal_details")
+        log_usage("meal_details", request_data["model"], response_data, estimated_tokens)
+        content = response_data["choices"][0]["message"]["content"]
         
-        The suggestions should be specific, actionable improvements that could make the meal healthier.
+        analysis = extract_json(content)
+        return normalize_meal_analysis(analysis, user_profile.get('priority_micronutrients', []))
         
-        IMPORTANT: Do NOT suggest adding ingredients that are already present in the meal. For example, if the meal already contains olive oil, turmeric, cumin seeds, or coriander, do not suggest adding these ingredients.
-        """
+    except CircuitOpenError:
+        raise
+    except Exception as e:
+        print(f"Error in analyze_meal_details: {str(e)}")
+        raise Exception(f"Failed to analyze meal details: {str(e)}")
+
+# Fields of the details analysis sent to streaming clients as soon as they close
+STREAMED_DETAIL_FIELDS = ("meal_name", "macronutrients", "scores")
+
+async def analyze_meal_details_stream(
+    conversation_history: List[Dict[str, str]],
+    user_profile: Dict[str, Any],
+    user_id: Optional[str] = None
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Streaming variant of analyze_meal_details.
+    Yields ("field", {"key": ..., "value": ...}) for each of STREAMED_DETAIL_FIELDS
+    as soon as the model closes it, then ("complete", analysis) with the
+    normalized document.
+    """
+    try:
+        request_data = build_meal_details_request(conversation_history, user_profile)
+        print(f"Estimated prompt tokens: {count_message_tokens(request_data['messages'], request_data['model'])}")
+        parser = IncrementalJSONParser()
         
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+        async for delta in stream_chat_completion(request_data, user_id=user_id, endpoint="meal_details_stream"):
+            for key, value in parser.feed(delta):
+                if key in STREAMED_DETAIL_FIELDS:
+                    yield "field", {"key": key, "value": value}
         
-        # Prepare the request data
-        request_data = {
-            "model": "gpt-4o-mini-2024-07-18",
-            "messages": [
-                {"role": "system", "content": "You are a nutritional analysis AI that provides detailed meal analysis."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.5,
-            "max_tokens": 2000
-        }
+        analysis = extract_json(parser.text)
+        yield "complete", normalize_meal_analysis(analysis, user_profile.get('priority_micronutrients', []))
         
-        # Make the API request
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=request_data
-            )
-            
-            # Check if the request was successful
-            if response.status_code != 200:
-                print(f"Error from OpenAI API: {response.text}")
-                raise Exception(f"OpenAI API returned an error: {response.text}")
-            
-            # Parse the response
-            response_data = response.json()
-            content = response_data["choices"][0]["message"]["content"]
-            
-            # Clean up the response by removing markdown code block markers and any text before the JSON
-            content = content.strip()
-            if "```json" in content:
-                content = content.split("```json")[1]
-            if "```" in content:
-                content = content.split("```")[0]
-            content = content.strip()
-            
-            # Look for JSON-like structure between curly braces
-            import re
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                analysis = json.loads(json_str)
-            else:
-                raise ValueError("No JSON structure found in response")
-            
-            # Process health tags - ensure they're capitalized and limited to 3-5
-            if "health_tags" in analysis:
-                # Capitalize first letter of each tag
-                health_tags = [tag.capitalize() for tag in analysis["health_tags"]]
-                
-                # Limit to 3-5 tags
-                if len(health_tags) > 5:
-                    health_tags = health_tags[:5]
-                elif len(health_tags) < 3 and "health_benefits" in analysis and analysis["health_benefits"]:
-                    # If we have fewer than 3 tags but have health benefits, convert some benefits to tags
-                    for benefit in analysis["health_benefits"]:
-                        if len(health_tags) < 3:
-                            # Convert benefit to tag format (shorter, capitalized)
-                            benefit_words = benefit.split()
-                            if len(benefit_words) > 3:
-                                # Shorten long benefits
-                                tag = " ".join(benefit_words[:3]).capitalize()
-                            else:
-                                tag = benefit.capitalize()
-                            
-                            # Only add if not already present
-                            if tag not in health_tags:
-                                health_tags.append(tag)
-                
-                analysis["health_tags"] = health_tags
-            
-            # Ensure micronutrient_balance is properly formatted
-            if "micronutrient_balance" not in analysis or not analysis["micronutrient_balance"]:
-                # Calculate micronutrient balance manually
-                micronutrients = analysis.get("micronutrients", {})
-                
-                # Only use user's priority micronutrients, no defaults
-                # Extract percentages for priority nutrients
-                priority_nutrients = []
-                total_percentage = 0
-                count = 0
-                
-                # Only proceed if there are priority micronutrients
-                if priority_micronutrients:
-                    for nutrient in priority_micronutrients:
-                        # Convert to snake_case if needed
-                        nutrient_key = nutrient.lower().replace(" ", "_")
-                        
-                        if nutrient_key in micronutrients:
-                            percentage = micronutrients[nutrient_key].get("percentage_of_daily", 0)
-                            priority_nutrients.append({
-                                "name": nutrient,
-                                "percentage": percentage
-                            })
-                            total_percentage += percentage
-                            count += 1
-                
-                # Calculate average score
-                score = total_percentage / count if count > 0 else 0
-                
-                # Set the micronutrient balance
-                analysis["micronutrient_balance"] = {
-                    "score": round(score, 1),
-                    "priority_nutrients": priority_nutrients
-                }
-            else:
-                # Ensure the micronutrient_balance only contains priority nutrients
-                if priority_micronutrients:
-                    existing_balance = analysis["micronutrient_balance"]
-                    filtered_nutrients = []
-                    total_percentage = 0
-                    count = 0
-                    
-                    # Filter to only include priority nutrients
-                    for nutrient_info in existing_balance.get("priority_nutrients", []):
-                        nutrient_name = nutrient_info.get("name", "").lower().replace(" ", "_")
-                        if any(pn.lower().replace(" ", "_") == nutrient_name for pn in priority_micronutrients):
-                            filtered_nutrients.append(nutrient_info)
-                            total_percentage += nutrient_info.get("percentage", 0)
-                            count += 1
-                    
-                    # Recalculate score based only on priority nutrients
-                    score = total_percentage / count if count > 0 else 0
-                    
-                    analysis["micronutrient_balance"] = {
-                        "score": round(score, 1),
-                        "priority_nutrients": filtered_nutrients
-                    }
-                else:
-                    # If no priority nutrients, set empty list and score to 0
-                    analysis["micronutrient_balance"] = {
-                        "score": 0,
-                        "priority_nutrients": []
-                    }
-            
-            return analysis
-            
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        print(f"Error in analyze_meal_details: {str(e)}")
-        raise Exception(f"Failed to analyze meal details: {str(e)}")
\ No newline at end of file
+        print(f"Error in analyze_meal_details_stream: {str(e)}")
+        raise Exception(f"Failed to analyze meal details: {str(e)}")
@@ -0,0 +1,119 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+from app.utils.metrics import metrics
+
+# Outcomes of a model call as seen by its caller
+OUTCOME_SUCCESS = "success"
+OUTCOME_ERROR = "error"
+OUTCOME_CIRCUIT_OPEN = "circuit_open"
+OUTCOME_CANCELLED = "cancelled"
+OUTCOME_COALESCED = "coalesced"  # shared an identical in-flight call
+OUTCOME_CACHE_HIT = "cache_hit"  # answered from a cache without calling the model
+
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+# USD per 1M tokens as (input, cached input, output), matched by longest model
+# prefix. Used for cost estimates on dashboards, not for billing.
+MODEL_PRICING: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "chatgpt-4o-latest": (5.00, 5.00, 15.00),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+    "gpt-4-vision-preview": (10.00, 10.00, 30.00),
+    "gpt-4": (30.00, 30.00, 60.00),
+}
+
+calls_total = metrics.counter(
+    "gpt_calls_total",
+    "Model calls by endpoint, model and outcome"
+)
+call_latency = metrics.histogram(
+    "gpt_call_latency_seconds",
+    "End-to-end model call latency seen by the caller, by endpoint and model"
+)
+queue_wait = metrics.histogram(
+    "gpt_call_queue_wait_seconds",
+    "Admission queue wait per model call, by endpoint and model"
+)
+upstream_time = metrics.histogram(
+    "gpt_call_upstream_seconds",
+    "Time spent on upstream attempts per call, including retries and backoff"
+)
+retries_total = metrics.counter(
+    "gpt_retries_total",
+    "Upstream attempts beyond the first, by endpoint and model"
+)
+tokens_total = metrics.counter(
+    "gpt_tokens_total",
+    "Tokens reported by the API, by endpoint, model and kind (prompt, cached, completion)"
+)
+prompt_tokens = metrics.histogram(
+    "gpt_prompt_tokens",
+    "Prompt tokens per model call, by endpoint and model",
+    buckets=TOKEN_BUCKETS
+)
+completion_tokens = metrics.histogram(
+    "gpt_completion_tokens",
+    "Completion tokens per model call, by endpoint and model",
+    buckets=TOKEN_BUCKETS
+)
+cost_total = metrics.counter(
+    "gpt_cost_usd_total",
+    "Estimated spend in USD from reported token usage, by endpoint and model"
+)
+
+def _pricing(model: str) -> Optional[Tuple[float, float, float]]:
+    matches = [prefix for prefix in MODEL_PRICING if model.startswith(prefix)]
+    return MODEL_PRICING[max(matches, key=len)] if matches else None
+
+def estimate_cost(model: str, prompt: int, completion: int, cached: int = 0) -> Optional[float]:
+    """Estimated USD cost of a call, or None for a model without a price"""
+    pricing = _pricing(model)
+    if pricing is None:
+        return None
+    input_price, cached_price, output_price = pricing
+    return ((prompt - cached) * input_price + cached * cached_price + completion * output_price) / 1_000_000
+
+@dataclass
+class GPTCall:
+    """What happened during one model call; filled in as the call proceeds"""
+    endpoint: str
+    model: str
+    started: float = field(default_factory=time.monotonic)
+    queue_wait: float = 0.0
+    upstream_seconds: float = 0.0
+    attempts: int = 0
+
+def record_call(call: GPTCall, outcome: str, response: Optional[Dict[str, Any]] = None):
+    """Record a finished call; `response` is the API body (or final stream chunk) carrying usage"""
+    labels = {"endpoint": call.endpoint, "model": call.model}
+    calls_total.inc(outcome=outcome, **labels)
+    call_latency.observe(time.monotonic() - call.started, **labels)
+    if call.attempts == 0:
+        # Coalesced or rejected before reaching upstream: no queueing or spend of its own
+        return
+
+    queue_wait.observe(call.queue_wait, **labels)
+    upstream_time.observe(call.upstream_seconds, **labels)
+    if call.attempts > 1:
+        retries_total.inc(call.attempts - 1, **labels)
+
+    usage = (response or {}).get("usage")
+    if not usage:
+        return
+    prompt = usage.get("prompt_tokens", 0)
+    completion = usage.get("completion_tokens", 0)
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+    tokens_total.inc(prompt - cached, kind="prompt", **labels)
+    tokens_total.inc(cached, kind="cached", **labels)
+    tokens_total.inc(completion, kind="completion", **labels)
+    prompt_tokens.observe(prompt, **labels)
+    completion_tokens.observe(completion, **labels)
+    cost = estimate_cost(call.model, prompt, completion, cached)
+    if cost is not None:
+        cost_total.inc(cost, **labels)
+
+def record_cache_hit(endpoint: str, model: str):
+    """Record a call answered from a cache in front of the model"""
+    calls_total.inc(endpoint=endpoint, model=model, outcome=OUTCOME_CACHE_HIT)
@@ -0,0 +1,78 @@
+import json
+import logging
+import random
+import re
+from typing import Any
+from app.config import settings
+
+# Logger for GPT request/response bodies. Bodies are logged at DEBUG, so they
+# are off unless GPT_LOG_LEVEL=DEBUG
+gpt_logger = logging.getLogger("app.gpt")
+gpt_logger.setLevel(settings.GPT_LOG_LEVEL.upper())
+
+# Keys whose values never reach the logs: credentials, contact details and
+# health history
+REDACTED_KEYS = frozenset({
+    "password", "hashed_password", "token", "access_token", "authorization", "api_key",
+    "email", "full_name", "phone", "address", "date_of_birth",
+    "personal_health_history", "family_health_history",
+})
+
+# A long unbroken run of base64 characters, e.g. an image without a data: prefix
+_BASE64_RUN = re.compile(r"[A-Za-z0-9+/]{256}")
+
+def _kb(length: int) -> str:
+    return f"{length / 1024:.1f} KB"
+
+def redact(value: Any, max_field_chars: int) -> Any:
+    """
+    Copy of `value` that is safe and cheap to log: redacted keys are masked,
+    binary data and base64 payloads are replaced by their size, and other
+    long strings are truncated to `max_field_chars`.
+    """
+    if isinstance(value, dict):
+        return {
+            key: "<redacted>" if str(key).lower() in REDACTED_KEYS else redact(item, max_field_chars)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item, max_field_chars) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{_kb(len(value))} binary>"
+    if isinstance(value, str):
+        if value.startswith("data:") and ";base64," in value[:100]:
+            return f"<{value[5:value.index(';')]} data URL, {_kb(len(value))}>"
+        if len(value) > max_field_chars:
+            if _BASE64_RUN.match(value):
+                return f"<base64, {_kb(len(value))}>"
+            return f"{value[:max_field_chars]}... <{len(value) - max_field_chars} more chars>"
+    return value
+
+class _LazyBody:
+    """Renders a body only when a log handler actually formats the record"""
+    __slots__ = ("body",)
+
+    def __init__(self, body: Any):
+        self.body = body
+
+    def __str__(self) -> str:
+        limit = settings.GPT_LOG_MAX_CHARS
+        if isinstance(self.body, str):
+            text = self.body
+        else:
+            text = json.dumps(redact(self.body, settings.GPT_LOG_MAX_FIELD_CHARS), default=str, ensure_ascii=False)
+        if len(text) > limit:
+            text = f"{text[:limit]}... <truncated {len(text) - limit} chars>"
+        return text
+
+def log_body(message: str, body: Any):
+    """
+    Log a GPT request/response body or user profile at DEBUG, for a
+    GPT_LOG_SAMPLE_RATE fraction of calls, redacted and size-bounded.
+    Nothing is serialized unless the record is emitted.
+    """
+    if not gpt_logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= settings.GPT_LOG_SAMPLE_RATE:
+        return
+    gpt_logger.debug("%s: %s", message, _LazyBody(body))
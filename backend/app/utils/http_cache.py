@@ -0,0 +1,55 @@
+import re
+from typing import Optional, Tuple
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class RangeNotSatisfiable(Exception):
+    """A Range header that selects no bytes of the resource"""
+
+def strong_etag(content_hash: str) -> str:
+    """Strong entity tag for content identified by its hash"""
+    return f'"{content_hash}"'
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches `etag`. Uses the weak
+    comparison RFC 9110 prescribes for If-None-Match, so W/"x" matches "x".
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+def parse_range(header: Optional[str], size: int, if_range: Optional[str] = None, etag: Optional[str] = None) -> Optional[Tuple[int, int]]:
+    """
+    The (start, end) byte positions, end inclusive, selected by a single
+    `bytes=` Range header, or None to send the whole resource: no header,
+    a syntax or unit we don't serve (including multiple ranges), or an
+    If-Range that doesn't strongly match `etag`.
+    Raises RangeNotSatisfiable if the range starts past the end.
+    """
+    if not header:
+        return None
+    if if_range is not None and if_range.strip() != etag:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    if end < start:
+        return None
+    return start, end
@@ -0,0 +1,117 @@
+import asyncio
+import concurrent.futures
+import logging
+import time
+from typing import Any, Callable, Optional
+from app.config import settings
+from app.utils.metrics import metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+POOL_THREAD = "thread"  # PIL releases the GIL while decoding, resizing and encoding
+POOL_PROCESS = "process"  # full isolation; task functions and arguments must be picklable
+
+tasks_total = metrics.counter(
+    "image_pool_tasks_total",
+    "Image processing tasks by stage and result (ok, error, timeout, rejected)"
+)
+queue_seconds = metrics.histogram(
+    "image_pool_queue_seconds",
+    "Time image processing tasks waited for a pool worker, by stage"
+)
+run_seconds = metrics.histogram(
+    "image_pool_run_seconds",
+    "Time image processing tasks spent running in a pool worker, by stage"
+)
+inflight = metrics.gauge(
+    "image_pool_inflight",
+    "Image processing tasks running or waiting in the pool"
+)
+
+class ImagePoolBusy(Exception):
+    """Raised instead of queueing when the image pool's queue is full"""
+
+def _timed(fn: Callable, args: tuple):
+    # Runs in the worker. Wall-clock times, so they compare across processes.
+    started = time.time()
+    result = fn(*args)
+    return result, started, time.time() - started
+
+class ImagePool:
+    """
+    Bounded executor for CPU-bound image work (PIL decode, resize, encode),
+    so it runs off the event loop. At most `workers` tasks run at once and
+    at most `max_queue` more wait; beyond that run() raises ImagePoolBusy
+    rather than letting uploads pile up. Tasks that don't finish within
+    `timeout` seconds raise asyncio.TimeoutError.
+    """
+    def __init__(self, kind: str, workers: int, max_queue: int, timeout: float):
+        if kind not in (POOL_THREAD, POOL_PROCESS):
+            raise ValueError(f"Unknown image pool kind: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._inflight = 0
+
+    def _get_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.kind == POOL_PROCESS:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="image"
+                )
+            logger.info(f"Started image {self.kind} pool with {self.workers} workers")
+        return self._executor
+
+    def _release(self, _future=None):
+        self._inflight -= 1
+        inflight.set(self._inflight)
+
+    async def run(self, stage: str, fn: Callable, *args: Any) -> Any:
+        """Run fn(*args) in the pool and return its result; `stage` labels the metrics"""
+        if self._inflight >= self.workers + self.max_queue:
+            tasks_total.inc(stage=stage, result="rejected")
+            raise ImagePoolBusy(f"Image processing is busy ({self._inflight} tasks queued), try again shortly")
+
+        loop = asyncio.get_running_loop()
+        submitted = time.time()
+        future = self._get_executor().submit(_timed, fn, args)
+        # A slot is freed when the worker finishes (or the task is cancelled
+        # before starting), not when the caller stops waiting
+        self._inflight += 1
+        inflight.set(self._inflight)
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._release))
+
+        try:
+            result, started, seconds = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            tasks_total.inc(stage=stage, result="timeout")
+            logger.warning(f"Image task {stage} timed out after {self.timeout}s")
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            tasks_total.inc(stage=stage, result="error")
+            raise
+
+        queue_seconds.observe(max(0.0, started - submitted), stage=stage)
+        run_seconds.observe(seconds, stage=stage)
+        tasks_total.inc(stage=stage, result="ok")
+        return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Shared pool for the app; shut down in main.py
+image_pool = ImagePool(
+    kind=settings.IMAGE_POOL_KIND,
+    workers=settings.IMAGE_POOL_WORKERS,
+    max_queue=settings.IMAGE_POOL_MAX_QUEUE,
+    timeout=settings.IMAGE_POOL_TIMEOUT_SECONDS
+)
@@ -0,0 +1,199 @@
+import io
+import math
+import logging
+from typing import Dict, Optional, Tuple
+from PIL import Image, ImageOps
+from app.config import settings
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# How far under the target edge a reduced-scale JPEG decode may land
+DRAFT_SLACK = 0.02
+
+VARIANT_FULL = "full"
+
+# Display variants of a stored meal photo: longest edge in pixels and JPEG
+# quality. "full" is the stored photo itself.
+IMAGE_VARIANTS: Dict[str, Optional[Tuple[int, int]]] = {
+    "thumb": (160, 70),
+    "card": (480, 78),
+    VARIANT_FULL: None
+}
+
+# dHash grid: one extra column so each of the 8x8 bits compares two pixels
+DHASH_WIDTH, DHASH_HEIGHT = 9, 8
+
+# OpenAI vision detail levels: "low" sends a single 512px tile, "high" tiles the image
+LOW_DETAIL_MAX_EDGE = 512
+
+def _choose_detail(width: int, height: int) -> str:
+    """Pick the vision detail level for an image of the given size"""
+    if settings.VISION_DETAIL in ("low", "high"):
+        return settings.VISION_DETAIL
+    return "low" if max(width, height) <= LOW_DETAIL_MAX_EDGE else "high"
+
+def prepare_vision_image(
+    image_content: bytes,
+    max_edge: Optional[int] = None,
+    quality: Optional[int] = None
+) -> Tuple[bytes, str]:
+    """
+    Prepare an uploaded photo for the vision model: apply EXIF orientation,
+    downscale so the longest edge is at most `max_edge` and re-encode as JPEG.
+    Returns the bytes to send and the detail level to request.
+    If the image can't be decoded the original bytes are returned unchanged.
+    """
+    max_edge = max_edge or settings.VISION_MAX_EDGE
+    quality = quality or settings.VISION_JPEG_QUALITY
+
+    try:
+        image = Image.open(io.BytesIO(image_content))
+        original_size = image.size
+        # An upright JPEG can be sent as-is if re-encoding would not shrink it
+        reusable = image.format == "JPEG" and image.getexif().get(0x0112, 1) == 1
+        # Let the JPEG decoder skip straight to a reduced scale when it can
+        image.draft("RGB", (max_edge, max_edge))
+
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality)
+        prepared = output.getvalue()
+
+        if reusable and len(image_content) <= len(prepared):
+            return image_content, _choose_detail(*original_size)
+
+        logger.info(
+            f"Prepared vision image: {len(image_content)} -> {len(prepared)} bytes, "
+            f"{image.width}x{image.height}"
+        )
+        return prepared, _choose_detail(image.width, image.height)
+
+    except Exception as e:
+        logger.error(f"Error preparing vision image: {str(e)}")
+        return image_content, "auto"
+
+def _encode_jpeg(image: Image.Image, quality: int, optimize: bool = False) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=optimize)
+    return output.getvalue()
+
+def _search_quality(image: Image.Image, max_bytes: int, min_quality: int, max_quality: int) -> Optional[int]:
+    """
+    Highest quality in [min_quality, max_quality) whose fast (non-optimized)
+    encode fits in max_bytes, or None if even min_quality doesn't. The final
+    optimized encode is never larger than the fast one, so it fits too.
+    """
+    low, high, best = min_quality, max_quality - 1, None
+    while low <= high:
+        quality = (low + high) // 2
+        if len(_encode_jpeg(image, quality)) <= max_bytes:
+            best, low = quality, quality + 1
+        else:
+            high = quality - 1
+    return best
+
+def compress_image(image_content: bytes, max_size_mb: float = 0.6, max_edge: Optional[int] = None) -> bytes:
+    """
+    Compress an uploaded photo for storage: under `max_size_mb` at the
+    highest quality that fits. Decodes straight to a reduced scale where the
+    JPEG allows, applies EXIF orientation, downscales so the longest edge is
+    at most `max_edge`, then does one optimized encode at the top quality,
+    which is returned if it fits (the common case). Otherwise it binary-
+    searches the quality with fast encodes and does a second optimized
+    encode at the quality found; if even the minimum quality is too big the
+    image is shrunk further and searched again first.
+    Returns the original bytes if the image can't be decoded.
+    """
+    max_edge = max_edge or settings.IMAGE_STORE_MAX_EDGE
+    max_bytes = int(max_size_mb * 1024 * 1024)
+    min_quality, max_quality = settings.IMAGE_STORE_MIN_QUALITY, settings.IMAGE_STORE_MAX_QUALITY
+
+    try:
+        image = Image.open(io.BytesIO(image_content))
+        original_size = image.size
+        # Let the JPEG decoder use 1/2, 1/4 or 1/8 scale whenever that lands
+        # within DRAFT_SLACK of the target (4032px phone photos -> 2016px)
+        scale = min(1.0, max_edge * (1 - DRAFT_SLACK) / max(original_size))
+        image.draft("RGB", (math.ceil(original_size[0] * scale), math.ceil(original_size[1] * scale)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        # Most photos fit at the top quality once resized: one optimized encode
+        compressed = _encode_jpeg(image, max_quality, optimize=True)
+        if len(compressed) <= max_bytes:
+            logger.info(
+                f"Compressed image {original_size[0]}x{original_size[1]} -> {image.width}x{image.height}, "
+                f"{len(image_content)/1024:.1f}KB -> {len(compressed)/1024:.1f}KB at quality {max_quality}"
+            )
+            return compressed
+
+        quality = _search_quality(image, max_bytes, min_quality, max_quality)
+        for _ in range(3):
+            if quality is not None:
+                break
+            # Shrink by the overshoot at minimum quality, with some margin
+            ratio = (max_bytes / len(_encode_jpeg(image, min_quality))) ** 0.5 * 0.9
+            image = image.resize(
+                (max(1, int(image.width * ratio)), max(1, int(image.height * ratio))),
+                Image.Resampling.LANCZOS
+            )
+            quality = _search_quality(image, max_bytes, min_quality, max_quality)
+
+        compressed = _encode_jpeg(image, quality or min_quality, optimize=True)
+        logger.info(
+            f"Compressed image {original_size[0]}x{original_size[1]} -> {image.width}x{image.height}, "
+            f"{len(image_content)/1024:.1f}KB -> {len(compressed)/1024:.1f}KB at quality {quality or min_quality}"
+        )
+        return compressed
+
+    except Exception as e:
+        logger.error(f"Error compressing image: {str(e)}")
+        # If compression fails, return original image
+        return image_content
+
+def make_variant(image_content: bytes, max_edge: int, quality: int) -> Optional[bytes]:
+    """
+    A downscaled JPEG of a stored photo whose longest edge is at most
+    `max_edge`, or None if the photo is already that small and can be
+    served as-is. Decodes at a reduced scale where the JPEG allows.
+    """
+    image = Image.open(io.BytesIO(image_content))
+    if max(image.size) <= max_edge:
+        return None
+    scale = max_edge * (1 - DRAFT_SLACK) / max(image.size)
+    image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    return _encode_jpeg(image, quality, optimize=True)
+
+def perceptual_hash(image_content: bytes) -> Optional[str]:
+    """
+    64-bit difference hash (dHash) of a photo as 16 hex digits: the photo
+    is oriented, reduced to 9x8 grayscale and each bit records whether a
+    pixel is brighter than its right neighbour. Re-encoded, rescaled or
+    slightly re-framed copies of a photo differ in only a few bits.
+    Returns None if the image can't be decoded.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_content))
+        image.draft("L", (DHASH_WIDTH * 8, DHASH_HEIGHT * 8))
+        image = ImageOps.exif_transpose(image).convert("L")
+        pixels = list(image.resize((DHASH_WIDTH, DHASH_HEIGHT), Image.Resampling.BOX).getdata())
+        bits = 0
+        for row in range(DHASH_HEIGHT):
+            for col in range(DHASH_WIDTH - 1):
+                left, right = pixels[row * DHASH_WIDTH + col], pixels[row * DHASH_WIDTH + col + 1]
+                bits = (bits << 1) | (1 if left > right else 0)
+        return f"{bits:016x}"
+    except Exception as e:
+        logger.error(f"Error hashing image: {str(e)}")
+        return None
@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import hmac
+import math
+import re
+import time
+from typing import Dict, Optional
+from app.config import settings
+from app.utils.image_processing import IMAGE_VARIANTS, VARIANT_FULL
+
+# Meal photo URLs as stored on meals: {API_BASE_URL}/api/nutrition/images/{id}
+_IMAGE_URL = re.compile(r"/api/nutrition/images/([0-9a-f]{24})")
+
+def _secret() -> bytes:
+    return (settings.IMAGE_URL_SECRET or settings.SECRET_KEY).encode()
+
+def image_signature(image_id: str, owner_id: str, expires: int) -> str:
+    """HMAC-SHA256 over the image id, its owner and the expiry, base64url without padding"""
+    digest = hmac.new(_secret(), f"{image_id}:{owner_id}:{expires}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+def signed_expiry(now: Optional[float] = None) -> int:
+    """
+    Expiry for a URL minted now: the end of the next IMAGE_URL_TTL_SECONDS
+    window, so a URL is valid for at least one TTL and stays the same for
+    every listing within a window, which keeps it cacheable by browsers.
+    """
+    ttl = settings.IMAGE_URL_TTL_SECONDS
+    now = time.time() if now is None else now
+    return (math.floor(now / ttl) + 2) * ttl
+
+def image_url_id(image_url: str) -> Optional[str]:
+    """The image id of a meal photo URL, or None for any other URL"""
+    match = _IMAGE_URL.search(image_url or "")
+    return match.group(1) if match else None
+
+def canonical_image_url(image_id: str) -> str:
+    """The URL stored on meals for a meal photo: no signature or variant"""
+    return f"{settings.API_BASE_URL}/api/nutrition/images/{image_id}"
+
+def sign_image_url(image_url: str, owner_id: str, now: Optional[float] = None) -> str:
+    """
+    A signed, expiring copy of a stored meal photo URL that get_image
+    accepts without a bearer token, provided the photo belongs to
+    `owner_id`. Any existing query is replaced; URLs that aren't meal
+    photos (placeholders, recipe images) are returned as-is.
+    """
+    match = _IMAGE_URL.search(image_url or "")
+    if not match:
+        return image_url
+    image_id = match.group(1)
+    expires = signed_expiry(now)
+    base = image_url[:match.end()]
+    return f"{base}?exp={expires}&sig={image_signature(image_id, owner_id, expires)}"
+
+def image_srcset(image_url: str, owner_id: str, now: Optional[float] = None) -> Dict[str, str]:
+    """
+    Signed URLs for each display variant of a meal photo, keyed by variant
+    name ("thumb", "card", "full"); empty for URLs that aren't meal photos.
+    """
+    signed = sign_image_url(image_url, owner_id, now)
+    if signed == image_url:
+        return {}
+    return {
+        variant: signed if variant == VARIANT_FULL else f"{signed}&variant={variant}"
+        for variant in IMAGE_VARIANTS
+    }
+
+def verify_image_signature(image_id: str, owner_id: str, expires: Optional[int], signature: Optional[str], now: Optional[float] = None) -> bool:
+    """Whether `signature` was minted for this image and its owner and has not expired"""
+    if expires is None or not signature:
+        return False
+    now = time.time() if now is None else now
+    if expires < now:
+        return False
+    return hmac.compare_digest(image_signature(image_id, owner_id, expires), signature)
@@ -0,0 +1,91 @@
+import json
+import re
+from typing import Any, Dict, Optional, Tuple
+from app.config import settings
+
+# Tokens that matter when balancing braces: whole string literals (so braces
+# inside strings are skipped in one step) and the braces themselves
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]', re.DOTALL)
+
+# A brace that can open a JSON object; skips prose such as "{name, portion}"
+_OBJECT_START = re.compile(r'\{\s*["}]')
+
+_FENCE = "```json"
+
+_TRUNCATED = "JSON object in response is truncated"
+
+_decoder = json.JSONDecoder()
+
+# Models that accept response_format={"type": "json_object"}
+JSON_MODE_MODEL_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-4-turbo", "gpt-3.5-turbo")
+
+def json_response_format(model: str) -> Dict[str, Any]:
+    """
+    Request fields enabling JSON mode for `model`, or an empty dict when it is
+    disabled or the model doesn't support it. Merge into the request payload.
+    """
+    if settings.GPT_JSON_MODE and model.startswith(JSON_MODE_MODEL_PREFIXES):
+        return {"response_format": {"type": "json_object"}}
+    return {}
+
+def _balanced_end(text: str, start: int) -> Optional[int]:
+    """Index just past the brace that closes the one at `start`, or None if it never closes"""
+    depth = 0
+    for match in _TOKEN.finditer(text, start):
+        token = match.group(0)
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return None
+
+def _scan(text: str, pos: int) -> Tuple[Optional[Dict[str, Any]], json.JSONDecodeError]:
+    """Return the first non-empty top-level object at or after `pos`, or None and why not"""
+    error = json.JSONDecodeError("No JSON structure found in response", text, pos)
+    empty = None
+    while True:
+        match = _OBJECT_START.search(text, pos)
+        if match is None:
+            return empty, error
+        start = match.start()
+        try:
+            # Decodes one object and ignores whatever follows it
+            value, end = _decoder.raw_decode(text, start)
+        except json.JSONDecodeError as e:
+            error = e
+            end = _balanced_end(text, start)
+            if end is None:
+                return empty, json.JSONDecodeError(_TRUNCATED, text, start)
+        else:
+            if value:
+                return value, error
+            empty = value
+        # Skip the whole candidate, not just its first brace
+        pos = end
+
+def extract_json(text: str) -> Dict[str, Any]:
+    """
+    Extract the JSON object from a model reply in a single pass.
+
+    Handles bare JSON (JSON mode), ```json fenced blocks and objects wrapped
+    in prose. Each candidate object is decoded in place, so trailing prose
+    is never read; a candidate that fails to decode is skipped whole by
+    balancing its braces outside of string literals. A truncated object is
+    reported rather than one of its nested objects being returned instead.
+    Raises json.JSONDecodeError (a ValueError) if no object can be decoded.
+    """
+    # Prefer a fenced block when there is one; prose before it may hold braces
+    fence = text.find(_FENCE)
+    if fence != -1:
+        value, error = _scan(text, fence + len(_FENCE))
+        if value is not None:
+            return value
+        if error.msg == _TRUNCATED:
+            # Runs to the end of the reply, so rescanning from the start can't help
+            raise error
+    value, error = _scan(text, 0)
+    if value is None:
+        raise error
+    return value
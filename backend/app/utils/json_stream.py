@@ -0,0 +1,123 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+_WHITESPACE = " \t\r\n"
+
+class IncrementalJSONParser:
+    """
+    Parses a JSON object that arrives in chunks (e.g. a streamed completion)
+    and reports each top-level field as soon as its value is complete.
+
+    Text before the opening brace, such as a markdown ```json fence, is
+    skipped. Values that fail to decode are skipped rather than raised; the
+    caller is expected to parse the full document once the stream ends.
+    """
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._state = "start"  # start | key | colon | value | comma | done
+        self._token_start: Optional[int] = None
+        self._key: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far"""
+        return self._text
+
+    @property
+    def done(self) -> bool:
+        """True once the top-level object has closed"""
+        return self._state == "done"
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk and return the (key, value) pairs completed by it"""
+        self._text += chunk
+        completed: List[Tuple[str, Any]] = []
+        text = self._text
+        i = self._pos
+
+        while i < len(text) and self._state != "done":
+            ch = text[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._state == "key":
+                            self._key = self._decode(self._token_start, i + 1)
+                            self._state = "colon"
+                        elif self._state == "value":
+                            self._emit(completed, i + 1)
+                i += 1
+                continue
+
+            if self._state == "start":
+                if ch == "{":
+                    self._depth = 1
+                    self._state = "key"
+                i += 1
+                continue
+
+            if self._depth > 1:
+                # Inside a nested container of the current value
+                if ch == '"':
+                    self._in_string = True
+                elif ch in "{[":
+                    self._depth += 1
+                elif ch in "}]":
+                    self._depth -= 1
+                    if self._depth == 1:
+                        self._emit(completed, i + 1)
+                i += 1
+                continue
+
+            # Depth 1: between the top-level tokens
+            if self._state == "key":
+                if ch == '"':
+                    self._in_string = True
+                    self._token_start = i
+                elif ch == "}":
+                    self._state = "done"
+            elif self._state == "colon":
+                if ch == ":":
+                    self._state = "value"
+                    self._token_start = None
+            elif self._state == "value":
+                if self._token_start is None:
+                    if ch not in _WHITESPACE:
+                        self._token_start = i
+                        if ch == '"':
+                            self._in_string = True
+                        elif ch in "{[":
+                            self._depth += 1
+                elif ch in ",}" or ch in _WHITESPACE:
+                    # End of a bare scalar (number, true, false, null)
+                    self._emit(completed, i)
+                    continue
+            elif self._state == "comma":
+                if ch == ",":
+                    self._state = "key"
+                elif ch == "}":
+                    self._state = "done"
+            i += 1
+
+        self._pos = i
+        return completed
+
+    def _decode(self, start: int, end: int) -> Any:
+        return json.loads(self._text[start:end])
+
+    def _emit(self, completed: List[Tuple[str, Any]], end: int):
+        try:
+            completed.append((self._key, self._decode(self._token_start, end)))
+        except (json.JSONDecodeError, TypeError):
+            pass
+        self._state = "comma"
+        self._token_start = None
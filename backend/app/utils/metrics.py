@@ -0,0 +1,161 @@
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+# Default histogram buckets, in seconds (suits latency measurements)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+class Counter:
+    """Monotonically increasing value, optionally split by labels"""
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            values = [{"labels": dict(k), "value": v} for k, v in self._values.items()]
+        return {"type": "counter", "description": self.description, "values": values}
+
+class Gauge:
+    """Value that can go up and down, optionally split by labels"""
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            values = [{"labels": dict(k), "value": v} for k, v in self._values.items()]
+        return {"type": "gauge", "description": self.description, "values": values}
+
+class Histogram:
+    """Bucketed distribution of observed values, optionally split by labels"""
+    def __init__(self, name: str, description: str, buckets: Optional[Tuple[float, ...]] = None):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets or DEFAULT_BUCKETS))
+        # label key -> [bucket counts..., +Inf count], sum, count
+        self._series: Dict[Tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            else:
+                series["counts"][-1] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(labels))
+        return series["count"] if series else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """
+        Estimate a quantile by linear interpolation inside the matching bucket.
+        Returns None when nothing has been observed yet.
+        """
+        series = self._series.get(_label_key(labels))
+        if not series or series["count"] == 0:
+            return None
+        target = q * series["count"]
+        cumulative = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            bucket_count = series["counts"][i]
+            if cumulative + bucket_count >= target and bucket_count > 0:
+                return lower + (bound - lower) * ((target - cumulative) / bucket_count)
+            cumulative += bucket_count
+            lower = bound
+        # Falls in the +Inf bucket: the best we can say is "above the last bound"
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            values = []
+            for key, series in self._series.items():
+                cumulative = 0
+                buckets = {}
+                for bound, bucket_count in zip(self.buckets, series["counts"]):
+                    cumulative += bucket_count
+                    buckets[str(bound)] = cumulative
+                buckets["+Inf"] = series["count"]
+                values.append({
+                    "labels": dict(key),
+                    "count": series["count"],
+                    "sum": round(series["sum"], 6),
+                    "buckets": buckets
+                })
+        for value in values:
+            labels = value["labels"]
+            value["p50"] = self.quantile(0.5, **labels)
+            value["p95"] = self.quantile(0.95, **labels)
+        return {"type": "histogram", "description": self.description, "values": values}
+
+class MetricsRegistry:
+    """Process-wide registry of named metrics, exposed at /api/metrics when METRICS_TOKEN is set"""
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name: str, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = factory()
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        return self._get_or_create(name, lambda: Counter(name, description))
+
+    def gauge(self, name: str, description: str = "") -> Gauge:
+        return self._get_or_create(name, lambda: Gauge(name, description))
+
+    def histogram(self, name: str, description: str = "", buckets: Optional[Tuple[float, ...]] = None) -> Histogram:
+        return self._get_or_create(name, lambda: Histogram(name, description, buckets))
+
+    def names(self) -> List[str]:
+        return sorted(self._metrics)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: self._metrics[name].snapshot() for name in self.names()}
+
+# Create global metrics registry
+metrics = MetricsRegistry()
@@ -1,4 +1,8 @@
-from typing import Dict, Any
+import logging
+from typing import Dict, Any, List
+
+# Set up logging
+logger = logging.getLogger(__name__)
 
 def calculate_meal_scores(analysis: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -246,4 +250,89 @@ def calculate_micronutrient_balance(analysis: Dict[str, Any]) -> Dict[str, float
         average_percentage = total_percentage / count
         scores["overall_balance"] = min(100, average_percentage)
     
-    return scores 
\ No newline at end of file
+    return scores 
+
+def finalize_meal_details(
+    analysis: Dict[str, Any],
+    conversation_history: List[Dict[str, Any]],
+    priority_micronutrients: List[str]
+) -> Dict[str, Any]:
+    """
+    Fill in required fields of a details analysis, keep only the user's
+    priority micronutrients and compute the meal scores locally.
+    """
+    # Process the analysis data to ensure all required fields are present
+    # Make sure macronutrients is properly structured
+    if "macronutrients" not in analysis or not analysis["macronutrients"]:
+        analysis["macronutrients"] = {
+            "calories": 0,
+            "protein": 0,
+            "carbs": 0,
+            "fats": 0,
+            "fiber": 0,
+            "sugar": 0,
+            "sodium": 0
+        }
+    
+    # Only track the user's selected priority micronutrients
+    if "micronutrients" not in analysis or not analysis["micronutrients"]:
+        analysis["micronutrients"] = {}
+    
+    # Filter micronutrients to only include priority ones
+    filtered_micronutrients = {}
+    for nutrient in priority_micronutrients:
+        # Convert to snake_case for consistency
+        nutrient_key = nutrient.lower().replace(" ", "_")
+        if nutrient_key in analysis.get("micronutrients", {}):
+            filtered_micronutrients[nutrient_key] = analysis["micronutrients"][nutrient_key]
+    
+    analysis["micronutrients"] = filtered_micronutrients
+    
+    # Calculate nutritional scores
+    scores = calculate_meal_scores(analysis)
+    analysis["scores"] = scores
+    
+    # Ensure we have a meal name
+    if not analysis.get("meal_name"):
+        # Try to extract a meal name from the conversation
+        meal_name = extract_meal_name_from_conversation(conversation_history)
+        if meal_name:
+            analysis["meal_name"] = meal_name
+        else:
+            analysis["meal_name"] = "Analyzed Meal"
+    
+    # Log the meal name for debugging
+    logger.info(f"Meal name from analysis: {analysis.get('meal_name', 'Not provided')}")
+    
+    return analysis
+
+def extract_meal_name_from_conversation(conversation_history):
+    """Extract a potential meal name from the conversation history"""
+    meal_keywords = ["eating", "had", "ate", "having", "consumed", "meal", "breakfast", "lunch", "dinner", "snack"]
+    
+    for message in conversation_history:
+        if message.get("type") == "user":
+            content = message.get("content", "").lower()
+            
+            # Check if the message contains meal keywords
+            if any(keyword in content for keyword in meal_keywords):
+                # Extract potential meal name (simple heuristic)
+                words = content.split()
+                for i, word in enumerate(words):
+                    if word in meal_keywords and i + 1 < len(words):
+                        # Get 4-5 words after the meal keyword
+                        start_idx = i + 1
+                        end_idx = min(start_idx + 5, len(words))  # Get up to 5 words
+                        potential_name = " ".join(words[start_idx:end_idx])
+                        
+                        # If we got less than 4 words, try to get more context
+                        if len(potential_name.split()) < 4:
+                            # Look for more words before the meal keyword
+                            pre_words = words[max(0, i-2):i]  # Get up to 2 words before
+                            potential_name = " ".join(pre_words + [word] + words[start_idx:end_idx])
+                        
+                        # Capitalize words and limit to 5 words
+                        name_parts = potential_name.split()[:5]
+                        return " ".join(word.capitalize() for word in name_parts)
+    
+    return None
@@ -0,0 +1,253 @@
+import copy
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from app.config import settings
+from app.utils.gpt import generate_dietary_recommendations
+from app.utils.metrics import metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Bump when the formulas below change so cached targets are recomputed
+TARGETS_VERSION = "v1"
+
+# Physical activity multipliers on BMR, by activity level id
+ACTIVITY_MULTIPLIERS = {
+    "sedentary": 1.2,
+    "light": 1.375,
+    "moderate": 1.55,
+    "very": 1.725,
+    "extra": 1.9
+}
+
+# Profiles store activity level ids ("moderate"), older ones the full label
+# ("Moderately active (...)") or other spellings ("very_active")
+_ACTIVITY_PREFIXES = (
+    ("sedentary", "sedentary"),
+    ("light", "light"),
+    ("moderate", "moderate"),
+    ("very", "very"),
+    ("extra", "extra")
+)
+
+# Health history and goals are matched on keywords so both the ids and the
+# labels from profile_mappings are recognised
+CONDITION_KEYWORDS = {
+    "diabetes": ("diabetes", "prediabetes"),
+    "hypertension": ("hypertension", "blood pressure", "blood_pressure"),
+    "cholesterol": ("cholesterol", "hyperlipidemia"),
+    "digestive": ("ibs", "digestive"),
+    "heart": ("heart",),
+    "weight_loss": ("weight loss", "weight_loss", "lose weight"),
+    "weight_gain": ("weight gain", "weight_gain", "gain weight"),
+    "muscle": ("muscle",)
+}
+
+# Profile fields that determine the targets; nothing else invalidates them
+TARGET_FIELDS = ("age", "sex", "height", "weight", "activity_level", "personal_health_history", "health_goals")
+
+# Extra fields the dietary recommendations are written from
+RECOMMENDATION_FIELDS = TARGET_FIELDS + (
+    "family_health_history", "priority_micronutrients", "dietary_preferences", "foods_to_avoid"
+)
+
+# Floors so that a deficit never prescribes a crash diet
+MIN_CALORIES = {"male": 1500, "female": 1200}
+
+GENERAL_RECOMMENDATIONS = [
+    "Consume a balanced diet with adequate protein, carbs, and healthy fats",
+    "Include a variety of fruits and vegetables in your daily meals",
+    "Stay hydrated by drinking plenty of water throughout the day"
+]
+
+targets_cache_lookups = metrics.counter(
+    "nutrition_targets_cache_lookups_total",
+    "Nutrition targets and recommendations cache lookups by kind and result"
+)
+
+def _to_kg(weight: Dict[str, Any]) -> float:
+    value = float(weight["value"])
+    unit = str(weight.get("unit", "kg")).lower()
+    return value * 0.45359237 if unit in ("lb", "lbs", "pound", "pounds") else value
+
+def _to_cm(height: Dict[str, Any]) -> float:
+    value = float(height["value"])
+    unit = str(height.get("unit", "cm")).lower()
+    if unit in ("in", "inch", "inches"):
+        return value * 2.54
+    if unit in ("ft", "feet"):
+        return value * 30.48
+    if unit == "m":
+        return value * 100
+    return value
+
+def activity_key(activity_level: str) -> str:
+    """Normalize an activity level id or label to a key of ACTIVITY_MULTIPLIERS"""
+    value = str(activity_level or "").strip().lower()
+    for prefix, key in _ACTIVITY_PREFIXES:
+        if value.startswith(prefix):
+            return key
+    return "sedentary"
+
+def profile_flags(profile: Dict[str, Any]) -> set:
+    """The CONDITION_KEYWORDS keys found in a profile's health history and goals"""
+    text = " ".join(
+        str(item).lower()
+        for field in ("personal_health_history", "health_goals")
+        for item in profile.get(field) or []
+    )
+    return {flag for flag, keywords in CONDITION_KEYWORDS.items() if any(keyword in text for keyword in keywords)}
+
+def calculate_bmr(weight_kg: float, height_cm: float, age: int, sex: str) -> float:
+    """Calculate Basal Metabolic Rate using Mifflin-St Jeor Equation"""
+    bmr = (10 * weight_kg) + (6.25 * height_cm) - (5 * age)
+    return bmr + 5 if str(sex).lower() == "male" else bmr - 161
+
+def _grams(min_value: float, max_value: float, unit: str = "g") -> Dict[str, Any]:
+    return {"min": int(round(min_value)), "max": int(round(max_value)), "unit": unit}
+
+def calculate_targets(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Daily nutritional targets for a profile, in the shape of
+    NutritionalNeeds. Raises KeyError/ValueError if age, sex, height or
+    weight are missing or not numbers.
+    """
+    weight = _to_kg(profile["weight"])
+    height = _to_cm(profile["height"])
+    age = int(profile["age"])
+    sex = str(profile["sex"]).lower()
+    flags = profile_flags(profile)
+
+    tdee = calculate_bmr(weight, height, age, sex) * ACTIVITY_MULTIPLIERS[activity_key(profile.get("activity_level"))]
+
+    # Goal adjustments: a moderate deficit or surplus around maintenance
+    if "weight_loss" in flags:
+        tdee *= 0.85
+    elif "weight_gain" in flags:
+        tdee *= 1.10
+    elif "muscle" in flags:
+        tdee *= 1.05
+    tdee = max(tdee, MIN_CALORIES.get(sex, 1200))
+    calories = {"min": int(round(tdee * 0.9)), "max": int(round(tdee * 1.1))}
+
+    # Protein in g/kg body weight; more when building muscle or losing weight,
+    # and older adults need more to preserve muscle
+    protein_range = (1.0, 1.6)
+    if "muscle" in flags or "weight_loss" in flags:
+        protein_range = (1.6, 2.2)
+    elif age >= 65:
+        protein_range = (1.2, 1.6)
+
+    # Share of energy from carbs and fats
+    carbs_range = (0.40, 0.50) if "diabetes" in flags else (0.45, 0.65)
+    fats_range = (0.20, 0.30) if flags & {"cholesterol", "heart"} else (0.20, 0.35)
+
+    # Fiber at 14 g per 1000 kcal, a little more for blood sugar and cholesterol
+    fiber_min = 14 * calories["min"] / 1000
+    if flags & {"diabetes", "cholesterol", "digestive"}:
+        fiber_min += 5
+
+    # Added sugar under 10% of energy, 5% when managing blood sugar or weight
+    sugar_share = 0.05 if flags & {"diabetes", "weight_loss"} else 0.10
+
+    sodium = (1000, 1500) if flags & {"hypertension", "heart"} else (1500, 2300)
+
+    return {
+        "calories": calories,
+        "macros": {
+            "protein": _grams(weight * protein_range[0], weight * protein_range[1]),
+            "carbs": _grams(calories["min"] * carbs_range[0] / 4, calories["max"] * carbs_range[1] / 4),
+            "fats": _grams(calories["min"] * fats_range[0] / 9, calories["max"] * fats_range[1] / 9)
+        },
+        "other_nutrients": {
+            "fiber": _grams(fiber_min, fiber_min + 10),
+            "sugar": _grams(0, calories["max"] * sugar_share / 4),
+            "sodium": _grams(sodium[0], sodium[1], unit="mg")
+        }
+    }
+
+def default_recommendations(profile: Dict[str, Any], needs: Dict[str, Any]) -> List[str]:
+    """Rule-based dietary recommendations, used when GPT is off or fails"""
+    flags = profile_flags(profile)
+    recommendations = []
+    if "diabetes" in flags:
+        recommendations.append("Pair carbohydrates with protein or fiber and favour whole grains and dals over refined flour and rice")
+    if flags & {"hypertension", "heart"}:
+        sodium = needs["other_nutrients"]["sodium"]["max"]
+        recommendations.append(f"Keep sodium under {sodium} mg a day by limiting pickles, papad and packaged snacks")
+    if "cholesterol" in flags:
+        recommendations.append("Cook with small amounts of unsaturated oils and limit ghee, butter and fried foods")
+    if "weight_loss" in flags:
+        recommendations.append("Build meals around vegetables and lean protein to stay full within your calorie range")
+    if "muscle" in flags:
+        protein = needs["macros"]["protein"]
+        recommendations.append(f"Spread {protein['min']}-{protein['max']} g of protein across your meals, including after training")
+    micronutrients = profile.get("priority_micronutrients") or []
+    if micronutrients:
+        recommendations.append(f"Choose foods rich in {', '.join(str(item) for item in micronutrients[:3])} most days")
+    return (recommendations + GENERAL_RECOMMENDATIONS)[:5]
+
+def profile_hash(profile: Dict[str, Any], fields=TARGET_FIELDS) -> str:
+    """Stable hash of the given profile fields"""
+    relevant = {field: profile.get(field) for field in fields}
+    canonical = json.dumps(relevant, sort_keys=True, default=str)
+    return hashlib.sha256(f"{TARGETS_VERSION}:{canonical}".encode()).hexdigest()
+
+class _LRU:
+    """Small in-process LRU keyed by profile hash; entries are copied on the way in and out"""
+
+    def __init__(self, kind: str, max_entries: int):
+        self.kind = kind
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            targets_cache_lookups.inc(kind=self.kind, result="hit")
+            return copy.deepcopy(self._entries[key])
+        targets_cache_lookups.inc(kind=self.kind, result="miss")
+        return None
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = copy.deepcopy(value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+_targets_cache = _LRU("targets", settings.NUTRITION_TARGETS_CACHE_SIZE)
+_recommendations_cache = _LRU("recommendations", settings.NUTRITION_TARGETS_CACHE_SIZE)
+
+def nutritional_targets(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """calculate_targets, cached by a hash of TARGET_FIELDS"""
+    key = profile_hash(profile)
+    needs = _targets_cache.get(key)
+    if needs is None:
+        needs = calculate_targets(profile)
+        _targets_cache.set(key, needs)
+    return needs
+
+async def nutrition_plan(profile: Dict[str, Any], user_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Nutritional needs and dietary recommendations for a profile.
+    The needs always come from the local engine. The recommendations are
+    written by GPT when NUTRITION_GPT_RECOMMENDATIONS is on, cached by a
+    hash of RECOMMENDATION_FIELDS, and fall back to rule-based ones.
+    """
+    needs = nutritional_targets(profile)
+    if not settings.NUTRITION_GPT_RECOMMENDATIONS:
+        return {"nutritional_needs": needs, "dietary_recommendations": default_recommendations(profile, needs)}
+
+    key = profile_hash(profile, RECOMMENDATION_FIELDS)
+    recommendations = _recommendations_cache.get(key)
+    if recommendations is None:
+        try:
+            recommendations = await generate_dietary_recommendations(profile, needs, user_id=user_id)
+            _recommendations_cache.set(key, recommendations)
+        except Exception as e:
+            logger.warning(f"Falling back to default dietary recommendations: {str(e)}")
+            recommendations = default_recommendations(profile, needs)
+    return {"nutritional_needs": needs, "dietary_recommendations": recommendations}
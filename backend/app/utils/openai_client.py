@@ -0,0 +1,82 @@
+import logging
+from typing import Optional
+import httpx
+from app.config import settings
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+def _http2_available() -> bool:
+    """HTTP/2 support in httpx needs the optional `h2` package"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+class OpenAIClientManager:
+    """
+    Owns the single long-lived httpx.AsyncClient used for every OpenAI call.
+    Connections are kept alive and (when available) multiplexed over HTTP/2,
+    so requests after the first skip the TCP+TLS handshake.
+    """
+    _instance = None
+    _client: Optional[httpx.AsyncClient] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(OpenAIClientManager, cls).__new__(cls)
+        return cls._instance
+
+    async def connect(self):
+        """Create the pooled client"""
+        if self._client is not None:
+            return
+
+        http2 = settings.OPENAI_HTTP2
+        if http2 and not _http2_available():
+            logger.warning("OPENAI_HTTP2 is enabled but the 'h2' package is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY
+        )
+        timeout = httpx.Timeout(
+            settings.OPENAI_READ_TIMEOUT,
+            connect=settings.OPENAI_CONNECT_TIMEOUT,
+            pool=settings.OPENAI_POOL_TIMEOUT
+        )
+
+        # No default Content-Type: httpx sets it per request (JSON bodies, file uploads)
+        headers = {}
+        if settings.OPENAI_API_KEY:
+            headers["Authorization"] = f"Bearer {settings.OPENAI_API_KEY}"
+
+        self._client = httpx.AsyncClient(
+            base_url=settings.OPENAI_BASE_URL,
+            headers=headers,
+            limits=limits,
+            timeout=timeout,
+            http2=http2
+        )
+        logger.info(
+            f"OpenAI client ready (base_url={settings.OPENAI_BASE_URL}, http2={http2}, "
+            f"max_connections={settings.OPENAI_MAX_CONNECTIONS})"
+        )
+
+    async def get_client(self) -> httpx.AsyncClient:
+        """Get the shared client, creating it lazily outside the app lifespan (scripts, tests)"""
+        if self._client is None:
+            await self.connect()
+        return self._client
+
+    async def close(self):
+        """Close the pooled client and all of its connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# Create global OpenAI client manager instance
+openai_client = OpenAIClientManager()
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+from app.utils.metrics import metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+breaker_state = metrics.gauge(
+    "circuit_breaker_open",
+    "1 while the named circuit breaker is open or half-open, 0 when closed"
+)
+breaker_rejections = metrics.counter(
+    "circuit_breaker_rejections_total",
+    "Calls rejected without reaching upstream because the breaker was open"
+)
+hedged_calls = metrics.counter(
+    "hedged_requests_total",
+    "Hedged second attempts fired, how many of them won, and hedges skipped for lack of a slot (no_slot)"
+)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the circuit breaker is open"""
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(
+            f"{name} is temporarily unavailable after repeated upstream failures, "
+            f"retry in {int(retry_after) + 1} seconds"
+        )
+
+class CircuitBreaker:
+    """
+    Error-rate circuit breaker over a rolling time window.
+
+    Closed: calls flow and outcomes are recorded. Once at least `min_calls`
+    outcomes in the window show a failure rate >= `failure_rate_threshold`,
+    the breaker opens and calls fail fast for `open_seconds`. It then goes
+    half-open and lets `half_open_max_calls` probes through: a successful
+    probe closes it, a failed one opens it again.
+    """
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        min_calls: int = 10,
+        window_seconds: float = 30.0,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self._state = STATE_CLOSED
+        self._outcomes: deque = deque()  # (timestamp, succeeded)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started = 0.0
+
+    @property
+    def state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            return STATE_HALF_OPEN
+        return self._state
+
+    def _retry_after(self) -> float:
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def check(self):
+        """Fail fast if the breaker is open; does not reserve a half-open probe"""
+        if self.state == STATE_OPEN:
+            breaker_rejections.inc(breaker=self.name)
+            raise CircuitOpenError(self.name, self._retry_after())
+
+    def before_call(self):
+        """Reserve permission for one upstream call, or raise CircuitOpenError"""
+        state = self.state
+        if state == STATE_CLOSED:
+            return
+        if state == STATE_HALF_OPEN:
+            # Also re-arm if earlier probes never reported back (e.g. were cancelled)
+            if self._state == STATE_OPEN or time.monotonic() - self._probe_started >= self.open_seconds:
+                self._state = STATE_HALF_OPEN
+                self._probes = 0
+            if self._probes < self.half_open_max_calls:
+                self._probes += 1
+                self._probe_started = time.monotonic()
+                return
+        breaker_rejections.inc(breaker=self.name)
+        raise CircuitOpenError(self.name, self._retry_after() if state == STATE_OPEN else self.open_seconds)
+
+    def record_success(self):
+        if self._state == STATE_HALF_OPEN:
+            logger.info(f"Circuit breaker '{self.name}' closed after a successful probe")
+            self._state = STATE_CLOSED
+            self._outcomes.clear()
+            breaker_state.set(0, breaker=self.name)
+            return
+        self._record(True)
+
+    def record_failure(self):
+        if self._state == STATE_HALF_OPEN:
+            self._open()
+            return
+        self._record(False)
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        if (
+            self._state == STATE_CLOSED
+            and len(self._outcomes) >= self.min_calls
+            and failures / len(self._outcomes) >= self.failure_rate_threshold
+        ):
+            self._open()
+
+    def _record(self, succeeded: bool):
+        now = time.monotonic()
+        self._outcomes.append((now, succeeded))
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _open(self):
+        logger.warning(f"Circuit breaker '{self.name}' opened for {self.open_seconds}s")
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        breaker_state.set(1, breaker=self.name)
+
+async def hedged(
+    attempt: Callable[[], Awaitable[Any]],
+    delay: Optional[float],
+    name: str = "default",
+    admission: Optional[Any] = None
+) -> Any:
+    """
+    Run `attempt`; if it hasn't finished after `delay` seconds, start a second
+    identical attempt and return whichever succeeds first, cancelling the
+    other. Only use for idempotent calls. With no delay this is a plain call.
+    With an AdmissionController the second attempt needs a free slot of its
+    own, held until it finishes; if none is free it isn't fired.
+    """
+    if delay is None:
+        return await attempt()
+
+    primary = asyncio.ensure_future(attempt())
+    pending = {primary}
+    last_error: Optional[BaseException] = None
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        if admission is not None and not admission.try_acquire():
+            hedged_calls.inc(call=name, outcome="no_slot")
+            return await primary
+        hedged_calls.inc(call=name, outcome="fired")
+        hedge = asyncio.ensure_future(attempt())
+        if admission is not None:
+            hedge.add_done_callback(lambda _: admission.release())
+        pending.add(hedge)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        hedged_calls.inc(call=name, outcome="won")
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        # Also reached when the caller is cancelled while waiting
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,57 @@
+import asyncio
+import copy
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
+from app.utils.metrics import metrics
+
+coalesced_calls = metrics.counter(
+    "singleflight_coalesced_total",
+    "Calls that awaited an identical in-flight call instead of starting their own"
+)
+inflight_calls = metrics.gauge(
+    "singleflight_inflight",
+    "Distinct calls currently in flight"
+)
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """
+    Canonical hash of a request payload (model, messages and parameters).
+    Keys are sorted so logically identical payloads hash the same.
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+    The first caller starts the work as its own task; everyone with the same
+    key awaits that task, so one caller disconnecting does not cancel the
+    shared call for the others.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None:
+            coalesced_calls.inc(group=self.name)
+            result = await asyncio.shield(task)
+            # Followers get their own copy so callers can't mutate each other's result
+            return copy.deepcopy(result)
+
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        inflight_calls.inc(group=self.name)
+
+        def _done(_task):
+            if self._inflight.get(key) is _task:
+                del self._inflight[key]
+            inflight_calls.dec(group=self.name)
+            # Mark the exception as retrieved when every caller has gone away
+            if not _task.cancelled():
+                _task.exception()
+
+        task.add_done_callback(_done)
+        return await asyncio.shield(task)
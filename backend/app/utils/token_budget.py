@@ -0,0 +1,131 @@
+import logging
+import math
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English text when tiktoken isn't installed
+CHARS_PER_TOKEN = 4
+
+# Per-message and per-reply framing overhead of the chat format
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+class TokenBudgetError(ValueError):
+    """The fixed part of a prompt doesn't fit in its input token budget"""
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """The tiktoken encoding for `model`, or None if tiktoken isn't installed"""
+    try:
+        import tiktoken
+    except ImportError:
+        logger.warning("tiktoken is not installed, estimating token counts from text length")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str, model: str) -> int:
+    """Count the tokens in `text` locally, exactly with tiktoken or by estimate"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+def count_message_tokens(messages: List[Dict[str, Any]], model: str) -> int:
+    """Count the prompt tokens of a chat request's messages; image parts are not counted"""
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        total += TOKENS_PER_MESSAGE
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+        total += count_tokens(content, model)
+    return total
+
+def _one_line(text: str) -> str:
+    return " ".join(str(text).split())
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+def _summarize_turn(role: str, content: str) -> str:
+    """Condense an older turn: user answers carry the facts, so keep more of them"""
+    if role == "user":
+        return f"user: {_clip(content, 200)}"
+    # Keep the question the user went on to answer, or else the opening sentence
+    sentences = _SENTENCE_END.split(content)
+    kept = next((sentence for sentence in sentences if sentence.endswith("?")), sentences[0])
+    return f"{role}: {_clip(kept, 120)}"
+
+def compact_history(
+    conversation_history: List[Dict[str, Any]],
+    recent_turns: int,
+    skip_first: bool = True
+) -> List[str]:
+    """
+    Render a conversation as one line per turn, oldest first.
+    The first message (the detected ingredients, sent separately) is dropped
+    when `skip_first` is set, and all but the last `recent_turns` turns are
+    summarized.
+    """
+    turns = conversation_history[1:] if skip_first else conversation_history
+    lines = []
+    older = len(turns) - recent_turns
+    for index, turn in enumerate(turns):
+        role = turn.get("role", "user")
+        content = _one_line(turn.get("content", ""))
+        if not content:
+            continue
+        if index < older:
+            lines.append(_summarize_turn(role, content))
+        else:
+            lines.append(f"{role}: {content}")
+    return lines
+
+def fit_history(
+    fixed_tokens: int,
+    history_lines: List[str],
+    budget: int,
+    model: str
+) -> List[str]:
+    """
+    Drop the oldest history lines until the prompt fits in `budget` tokens.
+    Raises TokenBudgetError if even the fixed part of the prompt doesn't fit.
+    """
+    if fixed_tokens > budget:
+        raise TokenBudgetError(f"Prompt needs {fixed_tokens} tokens before any history, budget is {budget}")
+
+    # Newest turns are the most relevant, so fill the budget from the end
+    kept: List[str] = []
+    used = fixed_tokens
+    for line in reversed(history_lines):
+        cost = count_tokens(line, model) + 1  # newline
+        if used + cost > budget:
+            logger.info(f"Token budget reached: dropped {len(history_lines) - len(kept)} oldest conversation turns")
+            break
+        kept.append(line)
+        used += cost
+    kept.reverse()
+    return kept
+
+def log_usage(call: str, model: str, response: Dict[str, Any], estimated_prompt_tokens: Optional[int] = None):
+    """Log the token usage the API reported for a call, next to our local estimate"""
+    usage = response.get("usage") or {}
+    message = (
+        f"Token usage [{call}] model={model} "
+        f"prompt={usage.get('prompt_tokens', '?')} completion={usage.get('completion_tokens', '?')}"
+    )
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached:
+        message += f" cached={cached}"
+    if estimated_prompt_tokens is not None:
+        message += f" estimated_prompt={estimated_prompt_tokens}"
+    logger.info(message)
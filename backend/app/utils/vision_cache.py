@@ -0,0 +1,136 @@
+import copy
+import hashlib
+import io
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional
+from PIL import Image, ImageOps
+from app.config import settings
+from app.utils.metrics import metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Bump when the vision prompt or VISION_MODEL changes so stale analyses are
+# not served; model settings from config are folded into the key as well
+VISION_CACHE_VERSION = "v2"
+VISION_CACHE_COLLECTION = "vision_analysis_cache"
+
+# Only these fields of an analysis are worth caching; request-specific
+# fields such as image_url are added by the route afterwards
+CACHED_FIELDS = ("detected_ingredients", "confidence_level", "meal_type", "clarifying_questions")
+
+# Decoding at reduced size is enough to fingerprint the pixels and much cheaper
+# than a full decode of a 12MP phone photo
+_HASH_DECODE_SIZE = (512, 512)
+
+cache_lookups = metrics.counter(
+    "vision_cache_lookups_total",
+    "Vision analysis cache lookups by tier and result"
+)
+cache_entries = metrics.gauge(
+    "vision_cache_memory_entries",
+    "Entries currently held in the in-process vision cache"
+)
+
+def _cache_version() -> str:
+    """VISION_CACHE_VERSION plus the configured settings that shape an analysis"""
+    return ":".join(str(part) for part in (
+        VISION_CACHE_VERSION, settings.VISION_ROUTING_ENABLED, settings.VISION_FAST_MODEL,
+        settings.VISION_FAST_MAX_TOKENS, settings.VISION_MAX_TOKENS, settings.VISION_ESCALATE_CONFIDENCE,
+        settings.VISION_MAX_INGREDIENTS, settings.VISION_MAX_EDGE, settings.VISION_DETAIL
+    ))
+
+def image_cache_key(image_content: bytes) -> str:
+    """
+    Content hash of the normalized image: decoded, orientation applied and
+    converted to RGB, so the same photo re-uploaded with different metadata
+    maps to the same key. Falls back to hashing the raw bytes if decoding fails.
+    """
+    digest = hashlib.sha256(_cache_version().encode())
+    try:
+        image = Image.open(io.BytesIO(image_content))
+        image.draft("RGB", _HASH_DECODE_SIZE)
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        digest.update(f"{image.width}x{image.height}".encode())
+        digest.update(image.tobytes())
+    except Exception as e:
+        logger.warning(f"Could not decode image for cache key, hashing raw bytes: {str(e)}")
+        digest.update(image_content)
+    return digest.hexdigest()
+
+class VisionAnalysisCache:
+    """
+    Two-tier cache for analyze_meal_image results: an in-process LRU in front
+    of a Mongo collection whose TTL index expires entries server-side.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._indexes_ready = False
+
+    async def _ensure_indexes(self, db):
+        if self._indexes_ready:
+            return
+        await db[VISION_CACHE_COLLECTION].create_index(
+            "created_at", expireAfterSeconds=self.ttl_seconds
+        )
+        self._indexes_ready = True
+
+    def _remember(self, key: str, analysis: Dict[str, Any]):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, analysis)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        cache_entries.set(len(self._entries))
+
+    async def get(self, db, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached analysis, returning a copy the caller may modify"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, analysis = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                cache_lookups.inc(tier="memory", result="hit")
+                return copy.deepcopy(analysis)
+            del self._entries[key]
+            cache_entries.set(len(self._entries))
+        cache_lookups.inc(tier="memory", result="miss")
+
+        try:
+            document = await db[VISION_CACHE_COLLECTION].find_one({"_id": key})
+        except Exception as e:
+            logger.warning(f"Vision cache lookup failed: {str(e)}")
+            return None
+
+        if not document:
+            cache_lookups.inc(tier="mongo", result="miss")
+            return None
+
+        cache_lookups.inc(tier="mongo", result="hit")
+        analysis = document["analysis"]
+        self._remember(key, analysis)
+        return copy.deepcopy(analysis)
+
+    async def set(self, db, key: str, analysis: Dict[str, Any]):
+        """Store the cacheable part of an analysis in both tiers"""
+        cached = {field: copy.deepcopy(analysis[field]) for field in CACHED_FIELDS if field in analysis}
+        self._remember(key, cached)
+        try:
+            await self._ensure_indexes(db)
+            await db[VISION_CACHE_COLLECTION].replace_one(
+                {"_id": key},
+                {"_id": key, "analysis": cached, "created_at": datetime.utcnow()},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Failed to persist vision cache entry: {str(e)}")
+
+# Create global vision cache instance
+vision_cache = VisionAnalysisCache(
+    max_entries=settings.VISION_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.VISION_CACHE_TTL_SECONDS
+)
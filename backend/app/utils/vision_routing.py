@@ -0,0 +1,78 @@
+from typing import Any, Dict, List, Optional
+from app.utils.gpt_instrumentation import estimate_cost
+from app.utils.metrics import metrics
+
+# Values of confidence_level in a vision analysis, least confident first
+CONFIDENCE_LEVELS = ("low", "medium", "high")
+
+# Routes a meal photo analysis can take
+ROUTE_DIRECT = "direct"  # routing disabled, full model only
+ROUTE_FAST = "fast"  # fast model answered and was accepted
+ROUTE_ESCALATED = "escalated"  # fast model answer rejected, full model answered
+
+# Portions that carry no information
+_EMPTY_PORTIONS = {"", "unknown", "unknown amount", "n/a", "none", "?"}
+
+routes_total = metrics.counter(
+    "vision_routes_total",
+    "Meal photo analyses by route (direct, fast, escalated) and the reason for it"
+)
+route_latency = metrics.histogram(
+    "vision_route_latency_seconds",
+    "End-to-end latency of a meal photo analysis by route, including any escalation"
+)
+route_cost = metrics.counter(
+    "vision_route_cost_usd_total",
+    "Estimated spend on meal photo analyses by route, summed over every tier tried"
+)
+
+def ingredient_problem(analysis: Dict[str, Any], max_ingredients: int) -> Optional[str]:
+    """Why the detected ingredients can't be used as-is, or None if they look valid"""
+    ingredients = analysis.get("detected_ingredients")
+    if not isinstance(ingredients, list) or not ingredients:
+        return "no_ingredients"
+    if len(ingredients) > max_ingredients:
+        return "too_many_ingredients"
+    names = set()
+    for ingredient in ingredients:
+        if not isinstance(ingredient, dict):
+            return "invalid_ingredients"
+        name = str(ingredient.get("name") or "").strip().lower()
+        portion = str(ingredient.get("portion") or "").strip().lower()
+        if not name or portion in _EMPTY_PORTIONS:
+            return "invalid_ingredients"
+        if name in names:
+            return "duplicate_ingredients"
+        names.add(name)
+    return None
+
+def escalation_reason(analysis: Dict[str, Any], escalate_at: str, max_ingredients: int) -> Optional[str]:
+    """
+    Why a fast-tier analysis should be redone by the full model, or None to
+    accept it. Escalates when confidence_level is missing or at or below
+    `escalate_at`, or when the ingredient list fails validation.
+    """
+    problem = ingredient_problem(analysis, max_ingredients)
+    if problem:
+        return problem
+    confidence = str(analysis.get("confidence_level") or "").strip().lower()
+    if confidence not in CONFIDENCE_LEVELS:
+        return "missing_confidence"
+    threshold = escalate_at.lower() if escalate_at.lower() in CONFIDENCE_LEVELS else "low"
+    if CONFIDENCE_LEVELS.index(confidence) <= CONFIDENCE_LEVELS.index(threshold):
+        return "low_confidence"
+    return None
+
+def _response_cost(response: Dict[str, Any]) -> float:
+    usage = response.get("usage") or {}
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+    cost = estimate_cost(
+        response.get("model", ""), usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), cached
+    )
+    return cost or 0.0
+
+def record_route(route: str, reason: str, seconds: float, responses: List[Dict[str, Any]]):
+    """Record how a meal photo analysis was routed, its total latency and the cost of every tier tried"""
+    routes_total.inc(route=route, reason=reason)
+    route_latency.observe(seconds, route=route)
+    route_cost.inc(sum(_response_cost(response) for response in responses), route=route)
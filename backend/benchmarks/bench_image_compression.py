@@ -0,0 +1,113 @@
+"""
+Benchmark stored-photo compression.
+
+For every image in a corpus directory, compares compress_image against the
+previous algorithm (full-resolution decode, up to 8 optimized encodes
+stepping quality down by 10, then resize and re-encode): time per image,
+output bytes and output dimensions. Use --max-size-mb to tighten the
+budget and exercise the resize path.
+
+Usage (from the backend directory):
+    python benchmarks/bench_image_compression.py [--corpus DIR] [--max-size-mb 0.6] [--repeat N]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+# Add the backend directory to Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from PIL import Image  # noqa: E402
+from app.utils.image_processing import compress_image  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(backend_dir, "app", "recipes")
+
+def legacy_compress_image(image_content: bytes, max_size_mb: float = 0.6) -> bytes:
+    """compress_image as it was before the quality search, for comparison"""
+    image = Image.open(io.BytesIO(image_content))
+    if image.mode in ('RGBA', 'P'):
+        image = image.convert('RGB')
+    max_size_bytes = max_size_mb * 1024 * 1024
+    quality = 85
+    output = io.BytesIO()
+    while quality > 5:
+        output.seek(0)
+        output.truncate()
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+        if output.tell() <= max_size_bytes:
+            break
+        quality -= 10
+    if output.tell() > max_size_bytes:
+        ratio = (max_size_bytes / output.tell()) ** 0.5
+        image = image.resize((int(image.width * ratio), int(image.height * ratio)), Image.Resampling.LANCZOS)
+        output.seek(0)
+        output.truncate()
+        image.save(output, format='JPEG', quality=85, optimize=True)
+        if output.tell() > max_size_bytes:
+            output.seek(0)
+            output.truncate()
+            image.save(output, format='JPEG', quality=75, optimize=True)
+    return output.getvalue()
+
+def load_corpus(corpus_dir: str):
+    images = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            with open(os.path.join(corpus_dir, name), "rb") as f:
+                images.append((name, f.read()))
+    return images
+
+def summarize(label: str, values, unit: str):
+    if not values:
+        return
+    p95 = sorted(values)[int(0.95 * (len(values) - 1))]
+    print(
+        f"{label:<28} mean={statistics.mean(values):>10.1f}{unit}  "
+        f"median={statistics.median(values):>10.1f}{unit}  p95={p95:>10.1f}{unit}  max={max(values):>10.1f}{unit}"
+    )
+
+def run(compress, images, max_size_mb: float, repeat: int):
+    times, sizes, over_budget = [], [], 0
+    edges = []
+    for name, content in images:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = compress(content, max_size_mb)
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        times.append(best)
+        sizes.append(len(output) / 1024)
+        edges.append(max(Image.open(io.BytesIO(output)).size))
+        if len(output) > max_size_mb * 1024 * 1024:
+            over_budget += 1
+    return times, sizes, edges, over_budget
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="directory of sample meal photos")
+    parser.add_argument("--max-size-mb", type=float, default=0.6, help="byte budget per image")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per image; the fastest is kept")
+    args = parser.parse_args()
+
+    images = load_corpus(args.corpus)
+    if not images:
+        print(f"No images found in {args.corpus}")
+        return
+
+    print(f"=== Compression over {len(images)} images from {args.corpus}, budget {args.max_size_mb}MB ===")
+    summarize("input", [len(content) / 1024 for _, content in images], "KB")
+    for label, compress in (("legacy", legacy_compress_image), ("compress_image", compress_image)):
+        times, sizes, edges, over_budget = run(compress, images, args.max_size_mb, args.repeat)
+        print(f"\n--- {label} ---")
+        summarize("time", times, "ms")
+        summarize("output", sizes, "KB")
+        summarize("longest edge", edges, "px")
+        print(f"over budget: {over_budget}, total time: {sum(times) / 1000:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Microbenchmark JSON extraction from model replies.
+
+Compares the regex cascade the GPT helpers used to run (split on ```json
+fences, then a greedy {.*} search, then json.loads) against the single-pass
+extract_json, on the recorded replies and on malformed variants of them
+(stray braces in trailing prose, truncated objects). Reports time per reply
+and how many replies each approach decodes to the right object or rejects.
+
+Usage (from the backend directory):
+    python benchmarks/bench_json_extract.py [--corpus DIR] [--number N]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+# Add the backend directory to Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.utils.json_extract import extract_json  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(backend_dir, "benchmarks", "json_corpus")
+
+def legacy_extract(content: str):
+    """The fence-split + greedy regex cascade previously inlined in each helper"""
+    content = content.strip()
+    if "```json" in content:
+        content = content.split("```json")[1]
+    if "```" in content:
+        content = content.split("```")[0]
+    content = content.strip()
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        json_match = re.search(r'\{.*\}', content, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group(0))
+        raise ValueError("No JSON structure found in response")
+
+def build_cases(corpus_dir: str):
+    """(label, text, expected object or None when the reply must be rejected)"""
+    cases = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(corpus_dir, name), encoding="utf-8") as f:
+            reply = f.read()
+        expected = extract_json(reply)
+        body = json.dumps(expected, indent=2)
+        cases.append((f"{name}", reply, expected))
+        cases.append((f"{name} +brace prose", f"{body}\n\nValues in {{}} are estimates.", expected))
+        cases.append((f"{name} truncated", f"```json\n{body[:len(body) * 2 // 3]}", None))
+    return cases
+
+def outcome(fn, text: str, expected) -> bool:
+    try:
+        return fn(text) == expected
+    except ValueError:
+        return expected is None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="directory of recorded model replies")
+    parser.add_argument("--number", type=int, default=2000, help="timing iterations per reply")
+    args = parser.parse_args()
+
+    cases = build_cases(args.corpus)
+    print(f"=== JSON extraction over {len(cases)} replies from {args.corpus} ===")
+    print(f"{'reply':<40} {'legacy us':>10} {'extract us':>11}  legacy  extract")
+
+    totals = {"legacy": [0.0, 0], "extract": [0.0, 0]}
+    for label, text, expected in cases:
+        row = []
+        for key, fn in (("legacy", legacy_extract), ("extract", extract_json)):
+            def run(fn=fn):
+                try:
+                    fn(text)
+                except ValueError:
+                    pass
+            seconds = timeit.timeit(run, number=args.number) / args.number
+            correct = outcome(fn, text, expected)
+            totals[key][0] += seconds
+            totals[key][1] += correct
+            row.append((seconds * 1e6, correct))
+        print(
+            f"{label:<40} {row[0][0]:>10.1f} {row[1][0]:>11.1f}  "
+            f"{'ok' if row[0][1] else 'WRONG':>6}  {'ok' if row[1][1] else 'WRONG':>7}"
+        )
+
+    print(
+        f"\ntotal: legacy {totals['legacy'][0] * 1e6:.1f}us, {totals['legacy'][1]}/{len(cases)} correct; "
+        f"extract_json {totals['extract'][0] * 1e6:.1f}us, {totals['extract'][1]}/{len(cases)} correct"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Benchmark the analyze -> details -> save meal pipeline end to end.
+
+Drives a running backend the way the frontend does: upload a photo to
+/api/nutrition/analyze-meal, answer the clarifying questions and post the
+conversation to /api/nutrition/analyze-details, then save the result with
+POST /api/nutrition/meals. Reports per-stage latency percentiles, errors
+and throughput at the chosen concurrency.
+
+To run offline, start the stand-in OpenAI server and point the backend at it:
+    python tools/fake_openai_server.py --port 8001
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake \
+        DETAILS_CACHE_ENABLED=false python run_server.py
+    python benchmarks/bench_meal_pipeline.py --sessions 50 --concurrency 10
+
+Every session registers its own user before timing starts, so near-duplicate
+detection (which only matches a user's own recent photos) never reuses an
+earlier upload, and each upload is a slightly perturbed corpus image so the
+vision cache does not answer it. The stand-in server describes every photo
+alike, so keep DETAILS_CACHE_ENABLED=false on the backend for a cold details
+stage. Pass --reuse-images (and leave the details cache on) to measure the
+cached path instead.
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+from PIL import Image
+
+# Add the backend directory to Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+DEFAULT_CORPUS = os.path.join(backend_dir, "app", "recipes")
+
+BENCH_PROFILE = {
+    "date_of_birth": "1990-01-01",
+    "age": 35,
+    "sex": "female",
+    "height": {"value": 165, "unit": "cm"},
+    "weight": {"value": 62, "unit": "kg"},
+    "activity_level": "moderately_active",
+    "personal_health_history": [],
+    "family_health_history": ["Heart disease"],
+    "priority_micronutrients": ["Iron", "Calcium"],
+    "dietary_preferences": ["Vegetarian"],
+    "meals_per_day": 3,
+    "foods_to_avoid": [],
+    "health_goals": ["Heart health"]
+}
+
+ANSWERS = ["About 1 tbsp of oil.", "It was around one cup.", "Simmered in a tomato base."]
+
+def load_images(corpus_dir: str, limit: int):
+    images = []
+    for name in sorted(os.listdir(corpus_dir))[:limit]:
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(corpus_dir, name), "rb") as f:
+                images.append(f.read())
+    return images
+
+# Side of the square recoloured per upload: large enough to survive the
+# reduced-scale decode the vision cache key hashes
+PERTURB_SIZE = 32
+
+def perturb(image_bytes: bytes, rng: random.Random) -> bytes:
+    """Recolour a small square so the upload misses the vision cache"""
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    x, y = rng.randrange(image.width - PERTURB_SIZE), rng.randrange(image.height - PERTURB_SIZE)
+    image.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + PERTURB_SIZE, y + PERTURB_SIZE))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+async def create_bench_user(client: httpx.AsyncClient) -> str:
+    email = f"bench-{uuid.uuid4().hex[:10]}@example.com"
+    password = uuid.uuid4().hex
+    response = await client.post("/api/auth/register", json={
+        "email": email, "first_name": "Bench", "password": password, "profile": BENCH_PROFILE
+    })
+    response.raise_for_status()
+    response = await client.post("/api/auth/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+def _numbers(values):
+    """Round the numeric entries of a dict; the meal model only takes numbers"""
+    return {k: round(v or 0) for k, v in (values or {}).items() if v is None or isinstance(v, (int, float))}
+
+def meal_payload(analysis, image_url):
+    """Shape the details analysis the way the frontend does before saving"""
+    return {
+        "meal_name": analysis.get("meal_name", "Benchmark meal"),
+        "image_url": image_url,
+        "ingredients": analysis.get("ingredients", []),
+        "cooking_method": analysis.get("cooking_method", ""),
+        "serving_size": analysis.get("serving_size", ""),
+        "macronutrients": _numbers(analysis.get("macronutrients")),
+        "scores": _numbers(analysis.get("scores")),
+        "health_tags": analysis.get("health_tags", []),
+        "health_benefits": analysis.get("health_benefits", []),
+        "potential_concerns": analysis.get("potential_concerns", []),
+        "suggestions": analysis.get("suggestions", []),
+        "recommended_recipes": [
+            recipe if isinstance(recipe, str) else recipe.get("name", "")
+            for recipe in analysis.get("recommended_recipes", [])
+        ],
+        "micronutrient_balance": analysis.get("micronutrient_balance") or {}
+    }
+
+async def run_session(client: httpx.AsyncClient, token: str, image: bytes, timings, errors):
+    headers = {"Authorization": f"Bearer {token}"}
+    stage = "analyze"
+    try:
+        start = time.perf_counter()
+        response = await client.post(
+            "/api/nutrition/analyze-meal", files={"file": ("meal.jpg", image, "image/jpeg")}, headers=headers
+        )
+        response.raise_for_status()
+        timings["analyze"].append(time.perf_counter() - start)
+        vision = response.json()["data"]
+
+        conversation = [{"role": "assistant", "content": ", ".join(
+            f"{item['name']} ({item['portion']})" for item in vision.get("detected_ingredients", [])
+        )}]
+        for question, answer in zip(vision.get("clarifying_questions", []), ANSWERS):
+            conversation.append({"role": "assistant", "content": question.get("question", "")})
+            conversation.append({"role": "user", "content": answer})
+
+        stage = "details"
+        start = time.perf_counter()
+        response = await client.post("/api/nutrition/analyze-details", json={
+            "conversation_history": conversation, "user_profile": {**BENCH_PROFILE, "profile": BENCH_PROFILE}
+        }, headers=headers)
+        response.raise_for_status()
+        timings["details"].append(time.perf_counter() - start)
+        analysis = response.json()["data"]
+
+        stage = "save"
+        start = time.perf_counter()
+        response = await client.post(
+            "/api/nutrition/meals", json=meal_payload(analysis, vision.get("image_url")), headers=headers
+        )
+        response.raise_for_status()
+        timings["save"].append(time.perf_counter() - start)
+    except (httpx.HTTPError, KeyError, ValueError) as e:
+        status = getattr(getattr(e, "response", None), "status_code", type(e).__name__)
+        errors[(stage, status)] += 1
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def main_async(args):
+    rng = random.Random(args.seed)
+    corpus = load_images(args.corpus, args.images)
+    if not corpus:
+        print(f"No images found in {args.corpus}")
+        return
+    uploads = [rng.choice(corpus) if args.reuse_images else perturb(rng.choice(corpus), rng) for _ in range(args.sessions)]
+
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.api, timeout=timeout) as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def register():
+            async with semaphore:
+                return await create_bench_user(client)
+
+        # One user per session, registered up front so sign-up isn't timed
+        tokens = await asyncio.gather(*(register() for _ in uploads))
+
+        timings = defaultdict(list)
+        errors = defaultdict(int)
+
+        async def bounded(token, image):
+            async with semaphore:
+                start = time.perf_counter()
+                await run_session(client, token, image, timings, errors)
+                timings["session"].append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(token, image) for token, image in zip(tokens, uploads)))
+        elapsed = time.perf_counter() - started
+
+    print(f"=== {args.sessions} sessions at concurrency {args.concurrency} against {args.api} ===")
+    for stage in ("analyze", "details", "save", "session"):
+        values = timings[stage]
+        if values:
+            print(
+                f"{stage:<8} n={len(values):<5} mean={statistics.mean(values) * 1000:>8.0f}ms  "
+                f"p50={percentile(values, 0.5) * 1000:>8.0f}ms  p95={percentile(values, 0.95) * 1000:>8.0f}ms  "
+                f"p99={percentile(values, 0.99) * 1000:>8.0f}ms"
+            )
+    completed = len(timings["save"])
+    print(f"completed {completed}/{args.sessions} in {elapsed:.1f}s ({completed / elapsed:.2f} sessions/s)")
+    for (stage, status), count in sorted(errors.items(), key=str):
+        print(f"errors at {stage}: {status} x{count}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="http://127.0.0.1:8000", help="backend base URL")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="directory of sample meal photos")
+    parser.add_argument("--images", type=int, default=10, help="how many corpus images to draw from")
+    parser.add_argument("--reuse-images", action="store_true", help="upload corpus images unchanged (vision cache hits)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark the vision-input preparation stage.
+
+For every image in a corpus directory, compares the original upload against
+the prepared (downscaled, re-encoded) image: bytes sent, JSON request size
+after base64 inflation, and preparation time. With --live, also measures
+end-to-end analyze_meal_image latency for both variants against the
+configured OPENAI_BASE_URL (point it at the local stand-in server to avoid
+spending API budget).
+
+Usage (from the backend directory):
+    python benchmarks/bench_vision_payload.py [--corpus DIR] [--live N]
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+
+# Add the backend directory to Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.utils.image_processing import prepare_vision_image  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(backend_dir, "app", "recipes")
+
+def request_size(image_bytes: bytes) -> int:
+    """Size of the JSON image part once base64-encoded into the request"""
+    image_base64 = base64.b64encode(image_bytes).decode("utf-8")
+    part = {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
+    return len(json.dumps(part))
+
+def load_corpus(corpus_dir: str):
+    images = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            with open(os.path.join(corpus_dir, name), "rb") as f:
+                images.append((name, f.read()))
+    return images
+
+def summarize(label: str, values, unit: str):
+    if not values:
+        return
+    print(
+        f"{label:<28} mean={statistics.mean(values):>12.1f}{unit}  "
+        f"median={statistics.median(values):>12.1f}{unit}  max={max(values):>12.1f}{unit}"
+    )
+
+async def measure_live(images, runs: int):
+    from app.utils.gpt import analyze_meal_image
+    from app.utils.openai_client import openai_client
+
+    original_latencies, prepared_latencies = [], []
+    try:
+        for name, content in images[:runs]:
+            start = time.perf_counter()
+            await analyze_meal_image(content, detail="auto")
+            original_latencies.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            prepared, detail = prepare_vision_image(content)
+            await analyze_meal_image(prepared, detail=detail)
+            prepared_latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        await openai_client.close()
+
+    print("\n=== End-to-end analyze_meal_image latency ===")
+    summarize("original upload", original_latencies, "ms")
+    summarize("prepared (incl. prep)", prepared_latencies, "ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="directory of sample meal photos")
+    parser.add_argument("--live", type=int, default=0, help="also time N end-to-end vision calls per variant")
+    args = parser.parse_args()
+
+    images = load_corpus(args.corpus)
+    if not images:
+        print(f"No images found in {args.corpus}")
+        return
+
+    original_bytes, prepared_bytes = [], []
+    original_request, prepared_request = [], []
+    prep_ms = []
+    details = {}
+
+    for name, content in images:
+        start = time.perf_counter()
+        prepared, detail = prepare_vision_image(content)
+        prep_ms.append((time.perf_counter() - start) * 1000)
+
+        original_bytes.append(len(content) / 1024)
+        prepared_bytes.append(len(prepared) / 1024)
+        original_request.append(request_size(content) / 1024)
+        prepared_request.append(request_size(prepared) / 1024)
+        details[detail] = details.get(detail, 0) + 1
+
+    print(f"=== Vision payload over {len(images)} images from {args.corpus} ===")
+    summarize("original image", original_bytes, "KB")
+    summarize("prepared image", prepared_bytes, "KB")
+    summarize("original request part", original_request, "KB")
+    summarize("prepared request part", prepared_request, "KB")
+    summarize("preparation time", prep_ms, "ms")
+    print(f"detail levels chosen: {details}")
+    reduction = 1 - sum(prepared_request) / sum(original_request)
+    print(f"request payload reduction: {reduction:.1%}")
+
+    if args.live:
+        asyncio.run(measure_live(images, args.live))
+
+if __name__ == "__main__":
+    main()
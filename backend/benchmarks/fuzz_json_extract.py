@@ -0,0 +1,98 @@
+"""
+Fuzz extract_json with mutations of recorded model replies.
+
+Each file in the corpus directory is a model reply in one of the shapes the
+GPT helpers receive (fenced, bare JSON-mode, wrapped in prose). Every reply
+is mutated many times in ways that must not change the extracted object
+(re-indenting, adding or removing fences, prose with stray braces before
+and after) and in ways that must be rejected (truncation inside the
+object). Any mismatch is printed with the seed needed to reproduce it.
+
+Usage (from the backend directory):
+    python benchmarks/fuzz_json_extract.py [--corpus DIR] [--iterations N] [--seed S]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+# Add the backend directory to Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.utils.json_extract import extract_json  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(backend_dir, "benchmarks", "json_corpus")
+
+PROSE = [
+    "Sure! Here's the analysis:",
+    "Based on the photo, here is my estimate.",
+    "Portions use the {name, portion} format.",
+    "Values in {} are approximate.",
+    "Let me know if you'd like changes :}",
+    "Note: I assumed {standard} serving sizes { where unclear.",
+    'He said "use less oil" - so I did.',
+    "",
+]
+
+def load_corpus(corpus_dir: str):
+    replies = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if name.endswith(".txt"):
+            with open(os.path.join(corpus_dir, name), encoding="utf-8") as f:
+                replies.append((name, f.read()))
+    return replies
+
+def preserving_mutation(obj, rng: random.Random) -> str:
+    """Render `obj` as a reply that must still extract to `obj`"""
+    body = json.dumps(obj, indent=rng.choice([None, 2, 4]), ensure_ascii=rng.random() < 0.5)
+    if rng.random() < 0.5:
+        body = f"```json\n{body}\n```"
+    return f"{rng.choice(PROSE)}\n{body}\n{rng.choice(PROSE)}"
+
+def truncating_mutation(obj, rng: random.Random) -> str:
+    """Render `obj` cut off partway through, which must be rejected"""
+    body = json.dumps(obj, indent=rng.choice([None, 2]))
+    cut = rng.randrange(1, len(body) - 1)
+    return f"{rng.choice(PROSE[:2])}\n```json\n{body[:cut]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="directory of recorded model replies")
+    parser.add_argument("--iterations", type=int, default=2000, help="mutations per reply")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    replies = load_corpus(args.corpus)
+    if not replies:
+        print(f"No replies found in {args.corpus}")
+        return 1
+
+    failures = 0
+    for name, reply in replies:
+        expected = extract_json(reply)
+        for i in range(args.iterations):
+            rng = random.Random(f"{args.seed}:{name}:{i}")
+            text = preserving_mutation(expected, rng)
+            try:
+                got = extract_json(text)
+            except ValueError as e:
+                got = e
+            if got != expected:
+                failures += 1
+                print(f"[{name} #{i}] preserving mutation changed the result: {got!r:.120}")
+
+            text = truncating_mutation(expected, rng)
+            try:
+                got = extract_json(text)
+            except ValueError:
+                continue
+            failures += 1
+            print(f"[{name} #{i}] truncated reply was accepted: {got!r:.120}")
+
+    print(f"{len(replies)} replies x {args.iterations} iterations: {failures} failures")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
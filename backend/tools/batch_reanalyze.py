@@ -0,0 +1,63 @@
+"""
+Re-run the meal details analysis over stored chats and meals through the
+OpenAI Batch API, e.g. after a prompt or model change.
+
+Each job is named and checkpointed in the reanalysis_jobs collection, so any
+command can be interrupted and run again to resume:
+
+    python tools/batch_reanalyze.py submit --job details-v2 --chunk-size 500
+    python tools/batch_reanalyze.py apply --job details-v2 --poll-interval 60
+    python tools/batch_reanalyze.py status --job details-v2
+
+`run` does submit then apply. `submit` builds JSONL request files from
+chat_history (matched to meals by user and image), writes them to
+--work-dir, uploads them and starts one batch per file. `apply` polls the
+batches and streams their results back into meals with bulk_write.
+
+To try it offline, start the stand-in server and point the tool at it:
+    python tools/fake_openai_server.py --port 8001 --batch-seconds 5
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake python tools/batch_reanalyze.py run --job test
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+# Add the backend directory to Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import settings
+from app.utils.openai_client import openai_client
+from app.services.batch_reanalysis import ReanalysisJob
+
+async def main_async(args):
+    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    db = client[settings.MONGODB_DB_NAME]
+    job = ReanalysisJob(db, args.job, work_dir=args.work_dir)
+    try:
+        if args.command in ("submit", "run"):
+            submitted = await job.submit(args.chunk_size, args.limit)
+            print(f"Submitted {submitted} requests")
+        if args.command in ("apply", "run"):
+            await job.apply(args.poll_interval, args.write_batch_size)
+        print(json.dumps(await job.status(), indent=2, default=str))
+    finally:
+        await openai_client.close()
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["submit", "apply", "run", "status"])
+    parser.add_argument("--job", required=True, help="job name; reuse it to resume")
+    parser.add_argument("--chunk-size", type=int, default=500, help="requests per batch file")
+    parser.add_argument("--limit", type=int, default=None, help="submit at most this many requests this run")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="seconds between batch status checks")
+    parser.add_argument("--write-batch-size", type=int, default=200, help="meal updates per bulk_write")
+    parser.add_argument("--work-dir", default=os.path.join(backend_dir, "batch_files"), help="where request files are written")
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Local OpenAI-compatible stand-in for load and latency testing.
+
+Implements the /v1/chat/completions surface used by app/utils/gpt.py
+(plain and streamed), plus the /v1/files and /v1/batches endpoints used by
+tools/batch_reanalyze.py, and answers with templated meal-analysis JSON in the
+shape each helper expects: vision ingredient detection, meal details,
+nutritional needs and profile analysis. Latency, error and rate-limit
+behaviour are configurable so the app can be benchmarked offline without
+spending API budget.
+
+Usage (from the backend directory):
+    python tools/fake_openai_server.py --port 8001 --latency-median-ms 800 --error-rate 0.02
+
+Then point the backend at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake python run_server.py
+
+GET /stats returns request counts by response kind and status.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+import uvicorn
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+@dataclass
+class FakeConfig:
+    latency_median_ms: float = 800.0  # time to first token
+    latency_sigma: float = 0.5  # lognormal spread; p95 is about median * e^(1.645 * sigma)
+    token_delay_ms: float = 2.0  # per completion token after the first
+    error_rate: float = 0.0  # fraction answered with a 500/503
+    rate_limit_rate: float = 0.0  # fraction answered with a 429
+    stream_chunk_chars: int = 24
+    batch_seconds: float = 5.0  # how long a batch stays in_progress
+
+config = FakeConfig()
+stats: Counter = Counter()
+rng = random.Random()
+
+# Uploaded and generated files by id, and batches by id
+files: Dict[str, Dict[str, Any]] = {}
+batches: Dict[str, Dict[str, Any]] = {}
+
+app = FastAPI(title="Fake OpenAI")
+
+INGREDIENT_POOL = [
+    ("basmati rice", "1 cup"), ("chickpea curry", "1/2 cup"), ("dal tadka", "3/4 cup"),
+    ("roti", "2 pieces"), ("paneer", "1/2 cup"), ("spinach", "1/2 cup"),
+    ("ghee", "1 tsp"), ("cilantro", "cilantro garnish"), ("mustard seeds", "1/4 tsp"),
+    ("tomato", "1/4 cup"), ("onion", "2 tbsp"), ("plain yogurt", "1/2 cup"),
+    ("grilled chicken", "3 oz"), ("cucumber raita", "1/4 cup"), ("lemon wedge", "1 wedge"),
+]
+
+# --- Templated replies -----------------------------------------------------
+
+def _vision_reply() -> Dict[str, Any]:
+    ingredients = rng.sample(INGREDIENT_POOL, k=rng.randint(3, 6))
+    return {
+        "detected_ingredients": [{"name": name, "portion": portion} for name, portion in ingredients],
+        "confidence_level": rng.choice(["high", "medium", "low"]),
+        "meal_type": rng.choice(["breakfast", "lunch", "dinner", "snack"]),
+        "clarifying_questions": [
+            {
+                "category": "preparation",
+                "question": f"How was the {ingredients[0][0]} cooked, and roughly how much oil was used?",
+                "validation_rules": {"required_terms": ["tbsp", "tsp", "ml"], "excluded_terms": [], "format": "amount_unit"}
+            },
+            {
+                "category": "serving size",
+                "question": f"Was the {ingredients[1][0]} portion about {ingredients[1][1]}?",
+                "validation_rules": {"required_terms": ["cup", "g", "piece"], "excluded_terms": [], "format": "amount_unit"}
+            }
+        ]
+    }
+
+def _details_reply(prompt: str) -> Dict[str, Any]:
+    named = [name for name, _ in INGREDIENT_POOL if name in prompt] or ["mixed vegetables", "rice"]
+    protein, carbs, fats = rng.randint(10, 40), rng.randint(30, 110), rng.randint(8, 35)
+    calories = protein * 4 + carbs * 4 + fats * 9
+    priority = []
+    for line in prompt.splitlines():
+        if line.startswith("- Priority Micronutrients:"):
+            priority = [item.strip() for item in line.split(":", 1)[1].split(",") if item.strip()]
+    return {
+        "meal_name": " with ".join(name.title() for name in named[:2]),
+        "ingredients": named,
+        "cooking_method": rng.choice(["simmered", "pan-fried", "steamed", "roasted"]),
+        "serving_size": "1 plate",
+        "macronutrients": {
+            "calories": calories, "protein": protein, "carbs": carbs, "fats": fats,
+            "fiber": rng.randint(2, 15), "sugar": rng.randint(1, 20), "sodium": rng.randint(200, 1200)
+        },
+        "health_tags": rng.sample(["Heart Healthy", "Gut Friendly", "Energy Enhancing", "Anti-Inflammatory", "Immune Boosting"], k=3),
+        "health_benefits": [f"The {name} contributes fiber and micronutrients." for name in named[:3]],
+        "potential_concerns": ["Sodium may be high if store-bought spice mixes were used."],
+        "suggestions": ["Add a side salad for extra vitamin C.", "Use 1 tsp less oil when tempering."],
+        "recommended_recipes": [
+            {"name": "Moong Dal Khichdi", "description": "Light, protein-rich one-pot meal",
+             "ingredients": ["moong dal", "rice", "turmeric"], "benefits": "Easy to digest and high in folate"}
+        ],
+        "macronutrient_split": {
+            "protein_percentage": round(protein * 400 / calories),
+            "carbs_percentage": round(carbs * 400 / calories),
+            "fats_percentage": round(fats * 900 / calories)
+        },
+        "micronutrients": {
+            "iron": {"amount": 3.2, "unit": "mg", "percentage_of_daily": 18},
+            "calcium": {"amount": 180, "unit": "mg", "percentage_of_daily": 14},
+            "vitamin_b12": {"amount": 0.4, "unit": "mcg", "percentage_of_daily": 17}
+        },
+        "priority_micronutrients": priority,
+        "micronutrient_balance": {
+            "score": rng.randint(20, 80),
+            "priority_nutrients": [{"name": name, "percentage": rng.randint(5, 60)} for name in priority]
+        },
+        "scores": {
+            "glycemic_index": rng.randint(30, 80), "inflammatory": rng.randint(10, 60),
+            "heart_health": rng.randint(40, 90), "digestive": rng.randint(40, 90), "meal_balance": rng.randint(40, 90)
+        }
+    }
+
+def _needs() -> Dict[str, Any]:
+    calories = rng.randrange(1700, 2600, 50)
+    return {
+        "calories": {"min": calories - 150, "max": calories + 150},
+        "macros": {
+            "protein": {"min": 70, "max": 110, "unit": "g"},
+            "carbs": {"min": 200, "max": 280, "unit": "g"},
+            "fats": {"min": 55, "max": 80, "unit": "g"}
+        },
+        "other_nutrients": {
+            "fiber": {"min": 25, "max": 35, "unit": "g"},
+            "sugar": {"min": 0, "max": 36, "unit": "g"},
+            "sodium": {"min": 1500, "max": 2300, "unit": "mg"}
+        }
+    }
+
+def _needs_with_recommendations_reply() -> Dict[str, Any]:
+    return {
+        "nutritional_needs": _needs(),
+        "dietary_recommendations": [
+            "Include a source of lean protein at every meal.",
+            "Pair iron-rich dals with vitamin C sources such as lemon.",
+            "Keep sodium under 2300 mg by limiting pickles and papad."
+        ]
+    }
+
+def _request_text(messages: List[Dict[str, Any]]) -> Tuple[str, bool, str]:
+    """All text in the request, whether it has an image part, and the system prompt"""
+    texts, has_image, system = [], False, ""
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    has_image = True
+                elif part.get("type") == "text":
+                    texts.append(part.get("text", ""))
+        else:
+            texts.append(content)
+            if message.get("role") == "system":
+                system = content
+    return "\n".join(texts), has_image, system
+
+def build_reply(body: Dict[str, Any]) -> Tuple[str, str]:
+    """Pick the reply template for a request; returns (kind, content)"""
+    text, has_image, system = _request_text(body.get("messages", []))
+    if has_image:
+        kind, document = "vision", _vision_reply()
+    elif system.startswith("You are a nutritional analysis AI"):
+        kind, document = "details", _details_reply(text)
+    elif "dietary_recommendations" in text:
+        kind, document = "needs", _needs_with_recommendations_reply()
+    elif "other_nutrients" in text:
+        kind, document = "profile", _needs()
+    else:
+        return "chat", "This is a reply from the local stand-in server."
+
+    content = json.dumps(document, indent=2)
+    if (body.get("response_format") or {}).get("type") != "json_object":
+        # Without JSON mode real models usually fence their JSON
+        content = f"Here is the analysis:\n```json\n{content}\n```"
+    return kind, content
+
+# --- Endpoints ---------------------------------------------------------------
+
+def _tokens(text: str) -> int:
+    return max(1, math.ceil(len(text) / 4))
+
+def _usage(body: Dict[str, Any], content: str) -> Dict[str, int]:
+    text, has_image, _ = _request_text(body.get("messages", []))
+    prompt_tokens = _tokens(text) + (765 if has_image else 0)
+    completion_tokens = _tokens(content)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+def _first_token_delay() -> float:
+    return config.latency_median_ms / 1000 * math.exp(config.latency_sigma * rng.gauss(0, 1))
+
+def _error_response(status_code: int, message: str, error_type: str) -> JSONResponse:
+    headers = {"Retry-After": "1"} if status_code == 429 else None
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": error_type, "code": None}},
+        headers=headers
+    )
+
+def _completion(body: Dict[str, Any], content: str) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-fake{rng.getrandbits(48):012x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o-mini"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": _usage(body, content)
+    }
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    kind, content = build_reply(body)
+
+    roll = rng.random()
+    if roll < config.rate_limit_rate:
+        stats[(kind, 429)] += 1
+        await asyncio.sleep(0.05)
+        return _error_response(429, "Rate limit reached for requests", "requests")
+    if roll < config.rate_limit_rate + config.error_rate:
+        status_code = rng.choice([500, 503])
+        stats[(kind, status_code)] += 1
+        await asyncio.sleep(_first_token_delay())
+        return _error_response(status_code, "The server had an error while processing your request.", "server_error")
+
+    stats[(kind, 200)] += 1
+    completion = _completion(body, content)
+    model, completion_id, created, usage = completion["model"], completion["id"], completion["created"], completion["usage"]
+
+    if not body.get("stream"):
+        await asyncio.sleep(_first_token_delay() + usage["completion_tokens"] * config.token_delay_ms / 1000)
+        return completion
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    async def events():
+        await asyncio.sleep(_first_token_delay())
+        step = config.stream_chunk_chars
+        for start in range(0, len(content), step):
+            piece = content[start:start + step]
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(_tokens(piece) * config.token_delay_ms / 1000)
+        final = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        if include_usage:
+            yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def _new_file(filename: str, purpose: str, data: bytes) -> Dict[str, Any]:
+    file_id = f"file-fake{rng.getrandbits(48):012x}"
+    files[file_id] = {
+        "id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+        "filename": filename, "purpose": purpose, "data": data
+    }
+    return files[file_id]
+
+def _file_info(file: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in file.items() if key != "data"}
+
+@app.post("/v1/files")
+async def upload_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    return _file_info(_new_file(file.filename, purpose, await file.read()))
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in files:
+        return _error_response(404, f"No such File object: {file_id}", "invalid_request_error")
+    return Response(files[file_id]["data"], media_type="application/jsonl")
+
+async def _run_batch(batch: Dict[str, Any]):
+    """Answer every request line of a batch after batch_seconds, like the real API would within its window"""
+    batch["status"] = "in_progress"
+    batch["in_progress_at"] = int(time.time())
+    await asyncio.sleep(config.batch_seconds)
+
+    outputs, errors = [], []
+    for line in files[batch["input_file_id"]]["data"].decode().splitlines():
+        if not line.strip():
+            continue
+        request_line = json.loads(line)
+        result = {"id": f"batch_req_fake{rng.getrandbits(48):012x}", "custom_id": request_line["custom_id"]}
+        kind, content = build_reply(request_line["body"])
+        if rng.random() < config.error_rate:
+            stats[(f"batch_{kind}", 500)] += 1
+            errors.append({**result, "response": None, "error": {"code": "server_error", "message": "The server had an error."}})
+        else:
+            stats[(f"batch_{kind}", 200)] += 1
+            outputs.append({**result, "response": {
+                "status_code": 200, "request_id": result["id"], "body": _completion(request_line["body"], content)
+            }, "error": None})
+
+    def jsonl(lines: List[Dict[str, Any]]) -> bytes:
+        return "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+    batch["output_file_id"] = _new_file(f"{batch['id']}_output.jsonl", "batch_output", jsonl(outputs))["id"]
+    if errors:
+        batch["error_file_id"] = _new_file(f"{batch['id']}_error.jsonl", "batch_output", jsonl(errors))["id"]
+    batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    if body.get("input_file_id") not in files:
+        return _error_response(400, f"No such File object: {body.get('input_file_id')}", "invalid_request_error")
+    batch_id = f"batch_fake{rng.getrandbits(48):012x}"
+    batch = batches[batch_id] = {
+        "id": batch_id, "object": "batch", "endpoint": body.get("endpoint"),
+        "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window", "24h"),
+        "status": "validating", "output_file_id": None, "error_file_id": None,
+        "created_at": int(time.time()), "request_counts": {"total": 0, "completed": 0, "failed": 0}
+    }
+    asyncio.create_task(_run_batch(batch))
+    return batch
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    if batch_id not in batches:
+        return _error_response(404, f"No such Batch object: {batch_id}", "invalid_request_error")
+    return batches[batch_id]
+
+@app.get("/stats")
+async def get_stats():
+    return {"requests": [{"kind": kind, "status": status, "count": count} for (kind, status), count in sorted(stats.items())]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-median-ms", type=float, default=config.latency_median_ms)
+    parser.add_argument("--latency-sigma", type=float, default=config.latency_sigma)
+    parser.add_argument("--token-delay-ms", type=float, default=config.token_delay_ms)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=config.rate_limit_rate)
+    parser.add_argument("--batch-seconds", type=float, default=config.batch_seconds)
+    parser.add_argument("--seed", type=int, default=None, help="make replies and latencies reproducible")
+    args = parser.parse_args()
+
+    config.latency_median_ms = args.latency_median_ms
+    config.latency_sigma = args.latency_sigma
+    config.token_delay_ms = args.token_delay_ms
+    config.error_rate = args.error_rate
+    config.rate_limit_rate = args.rate_limit_rate
+    config.batch_seconds = args.batch_seconds
+    rng.seed(args.seed)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
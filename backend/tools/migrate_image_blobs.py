@@ -0,0 +1,96 @@
+"""
+Move meal photo bytes out of db.images documents into the blob store.
+
+Older image documents carry the JPEG inline in a `data` field. This copies
+each one into the configured blob store (BLOB_STORE, or --store) and
+replaces `data` with blob_key/sha256/size/storage, in batches:
+
+    python tools/migrate_image_blobs.py --batch-size 100 --concurrency 8
+    python tools/migrate_image_blobs.py --store local --limit 1000
+    python tools/migrate_image_blobs.py --dry-run
+
+Only documents that still have `data` are selected, so the tool can be
+interrupted and run again to resume. Blobs are written before the document
+is updated, and the update only applies while `data` is still present, so
+an interrupted batch at worst leaves an unreferenced blob that the next run
+reuses. Mongo does not return the freed space to the OS until the images
+collection is compacted.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add the backend directory to Python path
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from app.config import settings
+from app.utils.blob_store import get_blob_store
+
+async def migrate(db, store_name: str, batch_size: int, concurrency: int, limit: int, dry_run: bool):
+    store = get_blob_store(db, store_name)
+    remaining = await db.images.count_documents({"data": {"$exists": True}})
+    print(f"{remaining} image documents still hold inline data; target store: {store.name}")
+    if dry_run or not remaining:
+        return
+
+    semaphore = asyncio.Semaphore(concurrency)
+    moved, moved_bytes, last_id = 0, 0, None
+    started = time.monotonic()
+
+    async def store_one(image):
+        async with semaphore:
+            data = bytes(image["data"])
+            key = await store.put(data)
+            return UpdateOne(
+                {"_id": image["_id"], "data": {"$exists": True}},
+                {
+                    "$set": {"storage": store.name, "blob_key": key, "sha256": key, "size": len(data)},
+                    "$unset": {"data": ""}
+                }
+            ), len(data)
+
+    while not limit or moved < limit:
+        query = {"data": {"$exists": True}}
+        if last_id is not None:
+            # Walk by _id so documents that fail to update aren't retried forever in one run
+            query["_id"] = {"$gt": last_id}
+        size = min(batch_size, limit - moved) if limit else batch_size
+        batch = await db.images.find(query).sort("_id", 1).limit(size).to_list(length=size)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        results = await asyncio.gather(*(store_one(image) for image in batch))
+        await db.images.bulk_write([update for update, _ in results], ordered=False)
+        moved += len(results)
+        moved_bytes += sum(size for _, size in results)
+        elapsed = time.monotonic() - started
+        print(f"moved {moved}/{remaining} images, {moved_bytes / 1024 / 1024:.1f}MB, {moved / elapsed:.1f} images/s")
+
+    print(f"Done: moved {moved} images ({moved_bytes / 1024 / 1024:.1f}MB) in {time.monotonic() - started:.1f}s")
+
+async def main_async(args):
+    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    try:
+        await migrate(
+            client[settings.MONGODB_DB_NAME], args.store, args.batch_size, args.concurrency, args.limit, args.dry_run
+        )
+    finally:
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", choices=["gridfs", "local"], default=settings.BLOB_STORE, help="blob store to move into")
+    parser.add_argument("--batch-size", type=int, default=100, help="image documents per batch")
+    parser.add_argument("--concurrency", type=int, default=8, help="blob writes in flight")
+    parser.add_argument("--limit", type=int, default=0, help="move at most this many images this run (0 = all)")
+    parser.add_argument("--dry-run", action="store_true", help="only count the documents left to move")
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()